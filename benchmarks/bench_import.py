@@ -0,0 +1,61 @@
+"""
+Import time of pyVASP, measured with python -X importtime in fresh interpreters,
+checking that modules only needed by some functionalities are not imported with it.
+
+Run from anywhere with:
+   python benchmarks/bench_import.py [--repeat 5] [--max-ms 400]
+"""
+import os
+import sys
+import argparse
+import subprocess
+
+BENCHMARKS = os.path.dirname(os.path.abspath(__file__))
+
+# loaded on first use only (pandas by atom_table.to_dataframe, the rest by runs, campaigns and parsers)
+LAZY_MODULES = ("pandas", "scipy", "subprocess", "concurrent.futures", "xml.etree.ElementTree", "shutil", "ase")
+
+
+def import_times(module):
+   """
+   Cumulative import time (in ms) of every module imported by a fresh interpreter running 'import module'.
+   """
+   # benchmarks/package.py registers this checkout as pyVASP in the fresh interpreter
+   code = "import sys; sys.path.insert(0, "+repr(BENCHMARKS)+"); import package; import "+module
+   process = subprocess.run([sys.executable, "-X", "importtime", "-c", code], capture_output=True, text=True, check=True)
+   times = {}
+   for line in process.stderr.splitlines():
+      if not line.startswith("import time:") or "cumulative" in line:
+         continue
+      _, cumulative, name = line[len("import time:"):].split("|")
+      times[name.strip()] = int(cumulative) / 1000
+   return times
+
+
+def main():
+   parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+   parser.add_argument("--module", default="pyVASP.code.main")
+   parser.add_argument("--repeat", type=int, default=5)
+   parser.add_argument("--max-ms", type=float, default=None, help="fail if the best import time is above this")
+   args = parser.parse_args()
+
+   runs = [import_times(args.module) for _ in range(args.repeat)]
+   best = min(runs, key=lambda times: times[args.module])
+
+   imported = [module for module in LAZY_MODULES if module in best]
+   assert not imported, "imported with "+args.module+": "+", ".join(imported)
+
+   print("{:>40} {:>10}".format("module", "ms"))
+   own = sorted((name for name in best if name.startswith("pyVASP.code.")), key=lambda name: -best[name])
+   for name in own + ["numpy"]:
+      if name in best:
+         print("{:>40} {:>10.1f}".format(name, best[name]))
+   print("{:>40} {:>10.1f}".format("total ("+args.module+")", best[args.module]))
+
+   if args.max_ms is not None:
+      assert best[args.module] <= args.max_ms, "import of "+args.module+" took {:.1f} ms".format(best[args.module])
+   return
+
+
+if __name__ == "__main__":
+   main()
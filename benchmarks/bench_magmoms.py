@@ -0,0 +1,92 @@
+"""
+Benchmark of magnetism.set_magmoms against the former site-by-site loop.
+
+Run from anywhere with:
+   python benchmarks/bench_magmoms.py
+"""
+import time
+import numpy as np
+from ase import Atoms
+
+import package  # registers this checkout as pyVASP
+from pyVASP.code.magnetism import magnetism
+
+
+def set_magmoms_loop(mag, structure_ase, number_of_atoms):
+   # Former implementation of magnetism.set_magmoms, kept as reference.
+   magmoms = []
+   for i in range(number_of_atoms):
+      this_m      = structure_ase.arrays["ms"][i]
+      this_betah  = structure_ase.arrays["betahs"][i]
+      this_magdir = structure_ase.arrays["magdirs"][i]
+
+      if this_m==1:
+         magmoms.append( this_magdir )
+
+      elif mag.DLM_type=="Heisenberg":
+         random_number = mag.rng.random()
+         theta = mag.get_theta_mag(random_number, this_betah)
+         phi   = mag.rng.random() * 2*np.pi
+
+         mod = np.linalg.norm( this_magdir )
+         mu = mod * np.array( [np.sin(theta)*np.cos(phi), np.sin(theta)*np.sin(phi), np.cos(theta)] )
+         magmoms.append( mag.rotate_magmom(mu, this_magdir) )
+
+      elif mag.DLM_type=="Ising":
+         random_number = mag.rng.random()
+         if random_number < 0.5*(this_m + 1):
+            magmoms.append( this_magdir )
+         else:
+            magmoms.append( -this_magdir )
+
+   return np.array(magmoms, dtype=float)
+
+
+def get_structure(number_of_atoms, m=0.5, seed=0):
+   rng = np.random.RandomState(seed)
+   structure_ase = Atoms("Mn"+str(number_of_atoms), positions=rng.random((number_of_atoms, 3)))
+   magdirs = rng.normal(size=(number_of_atoms, 3))
+   ms = np.full(number_of_atoms, m)
+   ms[::4] = 1 # some ordered sites
+   structure_ase.new_array("magdirs", magdirs, dtype=float)
+   structure_ase.new_array("ms", ms, dtype=float)
+   return structure_ase
+
+
+def time_call(function, repeat=3):
+   best = np.inf
+   for i in range(repeat):
+      start = time.perf_counter()
+      function()
+      best = min(best, time.perf_counter() - start)
+   return best
+
+
+def main(sizes=(10**2, 10**3, 10**4, 10**5), seed=1234):
+   print("{:>10} {:>12} {:>12} {:>12} {:>10}".format("natoms", "DLM_type", "loop [s]", "batched [s]", "speedup"))
+   for DLM_type in ["Heisenberg", "Ising"]:
+      for number_of_atoms in sizes:
+         structure_ase = get_structure(number_of_atoms)
+         mag = magnetism(seed=seed, DLM_type=DLM_type)
+         structure_ase = mag.set_betahs_from_ms(structure_ase, number_of_atoms)
+
+         def loop():
+            mag.rng = seed
+            return set_magmoms_loop(mag, structure_ase, number_of_atoms)
+
+         def batched():
+            mag.rng = seed
+            if "magmoms" in structure_ase.arrays:
+               structure_ase.set_array("magmoms", None)
+            return mag.set_magmoms(structure_ase, number_of_atoms).arrays["magmoms"]
+
+         assert np.allclose(loop(), batched(), rtol=0, atol=1e-12), "batched sampler differs from loop"
+
+         t_loop    = time_call(loop, repeat=1 if number_of_atoms >= 10**5 else 3)
+         t_batched = time_call(batched)
+         print("{:>10} {:>12} {:>12.5f} {:>12.5f} {:>9.1f}x".format(number_of_atoms, DLM_type, t_loop, t_batched, t_loop/t_batched))
+   return
+
+
+if __name__ == "__main__":
+   main()
@@ -0,0 +1,174 @@
+"""
+Benchmark of each stage of pyVASP.set_calculation (magnetic inputs, the df setter and
+every io writer) for supercells of Mn3GaN (triangular DLM on Mn) and bcc Fe (DLM on Fe).
+
+It runs offline in a temporary folder, with fake POTCARs and a fake executable,
+and saves the best time of each stage as JSON, so that runs on different commits
+can be compared (--compare prints the ratios to a previous file).
+
+Run from anywhere with:
+   python benchmarks/bench_stages.py [--sizes 1 2 5 10] [--output bench_stages.json] [--compare old.json]
+"""
+import os
+import json
+import time
+import argparse
+import platform
+import tempfile
+import subprocess
+import numpy as np
+from ase.build import bulk
+from ase.spacegroup import crystal
+
+import package  # registers this checkout as pyVASP
+from pyVASP.code.main import pyVASP
+
+# valence electrons of the fake POTCARs
+ZVALS = {"Mn_pv": 13.0, "Ga_d": 13.0, "N": 5.0, "Fe_pv": 14.0}
+
+
+def write_fake_inputs(folder, POTCAR_lines=3000):
+   """
+   Fake potential folders (POTCARs of a realistic size, with ZVAL) and a fake executable in folder.
+   Returns (potential_path, executable_path).
+   """
+   potential_path = os.path.join(folder, "potentials")
+   for potential, ZVAL in ZVALS.items():
+      os.makedirs(os.path.join(potential_path, potential))
+      with open(os.path.join(potential_path, potential, "POTCAR"), "w") as f:
+         f.write("  PAW_PBE "+potential+" 02Aug2007\n   POMASS =   54.938; ZVAL   =   "+str(ZVAL)+"    mass and valenz\n")
+         f.write("  0.12345678E+01  0.23456789E+01 -0.34567890E+01  0.45678901E+01  0.56789012E+01\n" * POTCAR_lines)
+         f.write(" End of Dataset\n")
+
+   executable_path = os.path.join(folder, "bin")
+   os.makedirs(executable_path)
+   with open(os.path.join(executable_path, "vasp_ncl"), "w") as f:
+      f.write("#!/bin/bash\necho fake vasp\n")
+   os.chmod(os.path.join(executable_path, "vasp_ncl"), 0o755)
+   return potential_path, executable_path
+
+
+def get_Mn3GaN(size, m=0.5):
+   structure_ase = crystal(("Ga", "Mn", "N"), basis=[(0, 0, 0), (0, .5, .5), (.5, .5, .5)],
+                           spacegroup=221, cellpar=[3.9, 3.9, 3.9, 90, 90, 90])
+   # triangular antiferromagnet on the Mn kagome planes
+   magdirs = np.zeros((len(structure_ase), 3))
+   ms = np.ones(len(structure_ase))
+   Mn = np.array(structure_ase.get_chemical_symbols()) == "Mn"
+   angles = 2*np.pi/3 * np.arange(1, Mn.sum() + 1)
+   magdirs[Mn] = 3.0 * np.stack([np.cos(angles), np.sin(angles), np.zeros_like(angles)], axis=1)
+   ms[Mn] = m
+   structure_ase.new_array("magdirs", magdirs, dtype=float)
+   structure_ase.new_array("ms", ms, dtype=float)
+   return structure_ase.repeat((size, size, size))
+
+
+def get_bcc_Fe(size, m=0.6):
+   structure_ase = bulk("Fe", "bcc", a=2.87, cubic=True)
+   structure_ase.new_array("magdirs", np.tile([0.0, 0.0, 2.2], (len(structure_ase), 1)), dtype=float)
+   structure_ase.new_array("ms", np.full(len(structure_ase), m), dtype=float)
+   return structure_ase.repeat((size, size, size))
+
+
+def time_stages(vasp, structure_ase, repeat=3):
+   """
+   Best time (s) of each stage of set_calculation for structure_ase.
+   """
+   number_of_atoms = len(structure_ase)
+   stages = {}
+   def record(stage, function):
+      start = time.perf_counter()
+      function()
+      stages[stage] = min(stages.get(stage, np.inf), time.perf_counter() - start)
+
+   for i in range(repeat):
+      # magnetic inputs, on a fresh copy as they add arrays to the structure
+      atoms = structure_ase.copy()
+      record("set_default_magnetic_inputs", lambda: vasp.magnetism.set_default_magnetic_inputs(atoms, number_of_atoms))
+      record("set_betahs_from_ms",          lambda: vasp.magnetism.set_betahs_from_ms(atoms, number_of_atoms))
+      record("set_magmoms",                 lambda: vasp.magnetism.set_magmoms(atoms, number_of_atoms))
+
+      # without and with the prepared structure in the cache
+      def set_df():
+         vasp.df = structure_ase
+      vasp.structure_cache.clear()
+      record("df", set_df)
+      record("df_cached", set_df)
+
+      io = vasp.io
+      record("get_inputs_fingerprint", lambda: io.get_inputs_fingerprint(vasp.potential_path, vasp.df, vasp.structure))
+      record("write_INCAR",   lambda: io.write_INCAR(vasp.structure.species, vasp.df["magmoms"], vasp.df["B_CONSTRs"]))
+      record("write_KPOINTS", lambda: io.write_KPOINTS(vasp.structure.kpoints))
+      record("write_POTCAR",  lambda: io.write_POTCAR(vasp.structure.species, vasp.potential_path))
+      record("write_POSCAR",  lambda: io.write_POSCAR(vasp.structure.lattice_vectors, vasp.df["positions"],
+                                                      vasp.df["elements"], vasp.structure.species))
+      record("write_job",     lambda: io.write_job(vasp.executable))
+
+      vasp.structure_cache.clear()
+      record("set_calculation", lambda: vasp.set_calculation(structure_ase))
+      record("set_calculation_cached", lambda: vasp.set_calculation(structure_ase))
+
+   return stages
+
+
+def get_metadata():
+   try:
+      commit = subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+                              capture_output=True, text=True).stdout.strip()
+   except OSError:
+      commit = ""
+   return {"commit": commit, "date": time.strftime("%Y-%m-%d %H:%M:%S"), "python": platform.python_version(),
+           "numpy": np.__version__, "machine": platform.machine(), "node": platform.node()}
+
+
+def compare(results, reference_file):
+   with open(reference_file) as f:
+      reference = {(row["system"], row["supercell"], row["stage"]): row["seconds"] for row in json.load(f)["results"]}
+   print("\n{:>8} {:>9} {:>28} {:>12} {:>12} {:>8}".format("system", "supercell", "stage", "before [s]", "now [s]", "ratio"))
+   for row in results:
+      key = (row["system"], row["supercell"], row["stage"])
+      if key in reference:
+         print("{:>8} {:>9} {:>28} {:>12.5f} {:>12.5f} {:>8.2f}".format(*key, reference[key], row["seconds"],
+                                                                         row["seconds"] / reference[key]))
+   return
+
+
+def main():
+   parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+   parser.add_argument("--sizes", type=int, nargs="+", default=list(range(1, 11)))
+   parser.add_argument("--systems", nargs="+", default=["Mn3GaN", "Fe"], choices=["Mn3GaN", "Fe"])
+   parser.add_argument("--repeat", type=int, default=3)
+   parser.add_argument("--output", default="bench_stages.json")
+   parser.add_argument("--compare", default=None, help="JSON file of a previous run")
+   args = parser.parse_args()
+
+   builders = {"Mn3GaN": get_Mn3GaN, "Fe": get_bcc_Fe}
+   results = []
+   with tempfile.TemporaryDirectory() as folder:
+      potential_path, executable_path = write_fake_inputs(folder)
+      print("{:>8} {:>9} {:>8} {:>28} {:>12}".format("system", "supercell", "natoms", "stage", "time [s]"))
+      for system in args.systems:
+         for size in args.sizes:
+            vasp = pyVASP(executable_path=executable_path, potential_path=potential_path, seed_mag=1234, verbose="low")
+            vasp.prepare_bfields(I_CONSTRAINED_M="5")
+            vasp.io.cwd = os.path.join(folder, system+"_"+str(size))
+            os.makedirs(vasp.io.cwd)
+
+            structure_ase = builders[system](size)
+            for stage, seconds in time_stages(vasp, structure_ase, args.repeat).items():
+               results.append({"system": system, "supercell": size, "number_of_atoms": len(structure_ase),
+                               "stage": stage, "seconds": seconds})
+               print("{:>8} {:>9} {:>8} {:>28} {:>12.5f}".format(system, str(size)+"x"+str(size)+"x"+str(size),
+                                                                 len(structure_ase), stage, seconds))
+
+   with open(args.output, "w") as f:
+      json.dump({"metadata": get_metadata(), "results": results}, f, indent=1)
+   print("\nResults saved in "+args.output)
+
+   if args.compare is not None:
+      compare(results, args.compare)
+   return
+
+
+if __name__ == "__main__":
+   main()
@@ -0,0 +1,120 @@
+"""
+Benchmark of the INCAR and POSCAR writers of io against the former
+per-value string concatenation, checking that both give the same bytes.
+
+Run from anywhere with:
+   python benchmarks/bench_writers.py
+"""
+import os
+import time
+import tempfile
+import numpy as np
+
+import package  # registers this checkout as pyVASP
+from pyVASP.code.io import io
+
+
+def write_INCAR_loop(writer, species, magmoms, B_CONSTRs):
+   # Former magnetic part of io.write_INCAR, kept as reference.
+   with open(writer.INCAR_file, "w") as text_file:
+      writer.add_INCAR_parameters(text_file)
+      writer.add_RWIGS_parameters(text_file, species)
+      writer.add_constr_INCAR_parameters(text_file)
+
+      MAGMOM_string   = 'MAGMOM= '
+      M_CONSTR_string = 'M_CONSTR= '
+      B_CONSTR_string = 'B_CONSTR= '
+      for magmom in magmoms:
+         for idir in range(3):
+            MAGMOM_string   += ' ' + '{:.7f}'.format(magmom[idir])
+            M_CONSTR_string += ' ' + '{:.7f}'.format(magmom[idir])
+         MAGMOM_string   += ' '
+         M_CONSTR_string += ' '
+      for B_CONSTR in B_CONSTRs:
+         for idir in range(3):
+            B_CONSTR_string += ' ' + '{:.7f}'.format(B_CONSTR[idir])
+         B_CONSTR_string += ' '
+
+      text_file.write(MAGMOM_string + '\n')
+      text_file.write(M_CONSTR_string + '\n')
+      text_file.write(B_CONSTR_string + '\n')
+   return
+
+
+def write_POSCAR_loop(writer, lattice_vectors, positions, elements, species, mode="Cartesian"):
+   # Former io.write_POSCAR, kept as reference.
+   with open(writer.POSCAR_file, 'w') as text_file:
+      text_file.write("Poscar file generated with python code pyVASP")
+      text_file.write("\n1.0")
+      text_file.write("\n")
+      for lattice_vector in lattice_vectors:
+         text_file.write('{:.7f}'.format(lattice_vector[0]) + " ")
+         text_file.write('{:.7f}'.format(lattice_vector[1]) + " ")
+         text_file.write('{:.7f}'.format(lattice_vector[2]) + "\n")
+      for element in species:
+         text_file.write(element + " ")
+      text_file.write("\n")
+      for element in species:
+         text_file.write( str( elements.count(element) ) + " " )
+      text_file.write("\n"+mode)
+      text_file.write("\n")
+      for position in positions:
+         text_file.write('{:.7f}'.format(position[0]) + " ")
+         text_file.write('{:.7f}'.format(position[1]) + " ")
+         text_file.write('{:.7f}'.format(position[2]) + "\n")
+   return
+
+
+def read(file_name):
+   with open(file_name, 'rb') as f:
+      return f.read()
+
+
+def time_call(function, repeat=3):
+   best = np.inf
+   for i in range(repeat):
+      start = time.perf_counter()
+      function()
+      best = min(best, time.perf_counter() - start)
+   return best
+
+
+def main(sizes=(10**3, 10**4, 10**5), seed=1234):
+   rng = np.random.RandomState(seed)
+   species = ["Ga", "Mn", "N"]
+   lattice_vectors = np.diag([3.95, 3.95, 3.95]) * 10
+
+   print("{:>10} {:>8} {:>12} {:>12} {:>10}".format("natoms", "file", "loop [s]", "buffer [s]", "speedup"))
+   with tempfile.TemporaryDirectory() as cwd:
+      reference = io(cwd + "/reference")
+      writer    = io(cwd + "/writer")
+      for directory in [reference.cwd, writer.cwd]:
+         os.makedirs(directory)
+      writer.bfields = True
+      writer.INCAR_constr.I_CONSTRAINED_M = "5"
+      reference.INCAR_constr.I_CONSTRAINED_M = "5"
+
+      for number_of_atoms in sizes:
+         elements  = sorted(rng.choice(species, number_of_atoms).tolist())
+         positions = [tuple(row) for row in rng.random((number_of_atoms, 3)) * 40]
+         magmoms   = [tuple(row) for row in rng.normal(size=(number_of_atoms, 3))]
+         B_CONSTRs = [tuple(row) for row in rng.normal(size=(number_of_atoms, 3))]
+
+         runs = {
+            "INCAR"  : (lambda: write_INCAR_loop(reference, species, magmoms, B_CONSTRs),
+                        lambda: writer.write_INCAR(species, magmoms, B_CONSTRs),
+                        "INCAR_file"),
+            "POSCAR" : (lambda: write_POSCAR_loop(reference, lattice_vectors, positions, elements, species),
+                        lambda: writer.write_POSCAR(lattice_vectors, positions, elements, species),
+                        "POSCAR_file"),
+         }
+         for name, (loop, buffered, file_attribute) in runs.items():
+            t_loop     = time_call(loop)
+            t_buffered = time_call(buffered)
+            assert read(getattr(reference, file_attribute)) == read(getattr(writer, file_attribute)), name+" differs"
+            print("{:>10} {:>8} {:>12.5f} {:>12.5f} {:>9.1f}x".format(number_of_atoms, name, t_loop, t_buffered, t_loop/t_buffered))
+   return
+
+
+if __name__ == "__main__":
+   main()
@@ -0,0 +1,21 @@
+"""
+Makes this checkout importable as pyVASP (from pyVASP.code.main import pyVASP) in the benchmarks,
+whatever the name of its folder, unless a pyVASP package is already installed or on the path.
+"""
+import os
+import sys
+import types
+import importlib.util
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def register_package():
+   if "pyVASP" not in sys.modules and importlib.util.find_spec("pyVASP") is None:
+      package = types.ModuleType("pyVASP")
+      package.__path__ = [ROOT]
+      sys.modules["pyVASP"] = package
+   return
+
+
+register_package()
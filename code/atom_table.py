@@ -0,0 +1,85 @@
+import numpy as np
+
+class atom_table:
+   """
+   Array-backed table of the atoms of a calculation, sorted as VASP needs them
+   (by elements, then magdirs, then positions).
+   Columns are contiguous NumPy arrays, accessed as table["magmoms"] or table.magmoms.
+   """
+
+   vector_columns = ("positions", "magdirs", "magmoms", "B_CONSTRs")
+   scalar_columns = ("ms", "betahs")
+   columns        = ("elements", "positions", "magdirs", "ms", "betahs", "magmoms", "B_CONSTRs")
+
+   __slots__ = columns + ("index",)
+
+   def __init__(self, elements, positions, magdirs, ms, betahs, magmoms, B_CONSTRs):
+      """
+      All arguments are given in the order of the original structure.
+      index keeps, for each sorted row, its position in the original structure.
+      """
+      elements  = np.asarray(elements, dtype=str)
+      positions = np.asarray(positions, dtype=float).reshape(-1, 3)
+      magdirs   = np.asarray(magdirs, dtype=float).reshape(-1, 3)
+
+      # np.lexsort sorts by the last key first
+      species, element_codes = np.unique(elements, return_inverse=True)
+      self.index = np.lexsort((positions[:,2], positions[:,1], positions[:,0],
+                               magdirs[:,2], magdirs[:,1], magdirs[:,0],
+                               element_codes))
+
+      self.elements  = elements[self.index]
+      self.positions = positions[self.index]
+      self.magdirs   = magdirs[self.index]
+      self.ms        = np.asarray(ms, dtype=float)[self.index]
+      self.betahs    = np.asarray(betahs, dtype=float)[self.index]
+      self.magmoms   = np.asarray(magmoms, dtype=float).reshape(-1, 3)[self.index]
+      self.B_CONSTRs = np.asarray(B_CONSTRs, dtype=float).reshape(-1, 3)[self.index]
+
+      return
+
+   def with_magmoms(self, magmoms):
+      """
+      Table of the same atoms with magmoms (in the order of the original structure), without sorting again.
+      The other columns are shared with this table.
+      """
+      table = object.__new__(atom_table)
+      for name in self.__slots__:
+         setattr(table, name, getattr(self, name))
+      table.magmoms = np.asarray(magmoms, dtype=float).reshape(-1, 3)[self.index]
+      return table
+
+   def set_read_only(self):
+      for name in self.__slots__:
+         getattr(self, name).setflags(write=False)
+      return self
+
+   def __getitem__(self, column):
+      if column not in self.columns:
+         raise KeyError(column)
+      return getattr(self, column)
+
+   def __len__(self):
+      return len(self.index)
+
+   def __repr__(self):
+      return repr(self.to_dataframe())
+
+   def _repr_html_(self):
+      return self.to_dataframe()._repr_html_()
+
+   def to_dataframe(self):
+      """
+      pandas DataFrame view of the table (vectors as tuples, indexed by the original atom order).
+      """
+      import pandas as pd
+
+      data = {}
+      for column in self.columns:
+         values = self[column]
+         if column in self.vector_columns:
+            data[column] = [tuple(row) for row in values.tolist()]
+         else:
+            data[column] = values.tolist()
+
+      return pd.DataFrame(data, index=self.index)
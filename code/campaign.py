@@ -0,0 +1,167 @@
+import os
+import copy
+import time
+from itertools import product
+from dataclasses import dataclass, fields
+
+# dataclasses of io that a variation can modify, e.g. {"INCAR.ENCUT": "600"}
+VARIABLE_DATACLASSES = ("INCAR", "INCAR_constr", "INCAR_constr_flag5", "INCAR_relaxation",
+                        "INCAR_U", "INCAR_VDW", "job_parameters", "RWIGS", "potential_files")
+# other keys a variation can have
+VARIATION_KEYS = ("folder", "structure", "kpoints", "seed", "mode", "ntasks", "time")
+
+
+@dataclass(frozen=True)
+class job_spec:
+   """
+   Immutable description of one job of a campaign.
+   settings is a tuple of (dataclass name, field name, value) applied on top of the template.
+   """
+   folder:        str
+   structure_ase: object
+   settings:      tuple = ()
+   kpoints:       str   = None
+   seed:          int   = None
+   mode:          str   = "Cartesian"
+   ntasks:        str   = None
+   time:          str   = None
+
+
+def get_folder_value(value):
+   """
+   value as part of a folder name: runs of whitespace (e.g. in "4 4 4") become "x", slashes "-".
+   """
+   return "x".join(str(value).split()).replace("/", "-")
+
+
+def grid(**axes):
+   """
+   Cartesian product of variations. Keys are the same as in a variation, with dots
+   replaced by double underscores, e.g. grid(INCAR__ENCUT=["400", "500"], INCAR_constr__LAMBDA=["1", "10"]).
+   Each variation gets a folder name built from its values, e.g. "ENCUT_400_LAMBDA_1" or "kpoints_4x4x4"
+   (spaces become "x", see get_folder_value; structures are numbered, e.g. "structure_0").
+   """
+   keys = [key.replace("__", ".") for key in axes]
+   variations = []
+   for indices in product(*[range(len(values)) for values in axes.values()]):
+      values = [axis[index] for axis, index in zip(axes.values(), indices)]
+      variation = dict(zip(keys, values))
+      # structures are named by their position in the axis
+      variation["folder"] = "_".join(key.split(".")[-1] + "_" + (str(index) if key == "structure" else get_folder_value(value))
+                                     for key, value, index in zip(keys, values, indices))
+      variations.append(variation)
+   return variations
+
+
+def write_job_spec(template, spec):
+   """
+   Writes the inputs of one job in spec.folder, working on a copy of the template pyVASP
+   object. Neither the template nor the current working directory are modified.
+   """
+   vasp = copy.deepcopy(template)
+   os.makedirs(spec.folder, exist_ok=True)
+   vasp.io.cwd = spec.folder
+
+   for dataclass_name, field_name, value in spec.settings:
+      setattr(getattr(vasp.io, dataclass_name), field_name, value)
+   if spec.kpoints is not None:
+      vasp.structure.kpoints = spec.kpoints
+   if spec.seed is not None:
+      vasp.magnetism.rng = spec.seed
+
+   # the structure is not modified (and is prepared only once for all jobs, see structure_cache)
+   vasp.set_calculation(spec.structure_ase, mode=spec.mode, ntasks=spec.ntasks, time=spec.time)
+
+   return vasp.io.cwd
+
+
+class campaign:
+   """
+   Set of jobs built from a template pyVASP object and a declarative list of variations.
+
+   A variation is a dict whose keys are either "dataclass.field" (any field of
+   INCAR, INCAR_constr, INCAR_constr_flag5, INCAR_relaxation, INCAR_U, INCAR_VDW,
+   job_parameters, RWIGS or potential_files) or one of
+   "folder", "structure", "kpoints", "seed", "mode", "ntasks", "time".
+   """
+
+   def __init__(self, template, structure_ase, variations, root=None, verbose="normal"):
+
+      self.template      = template
+      self.structure_ase = structure_ase
+      self.variations    = list(variations)
+      self.verbose       = verbose
+
+      if root is None:
+         root = template.io.cwd
+      self.root = template.io.add_slash(os.path.abspath(root))
+
+      self.specs = self.build()
+
+      return
+
+   ###############################################################################
+   # functionalities
+
+   def build(self):
+      """
+      One job_spec per variation. Every job is seeded with the template seed unless
+      the variation gives its own, so all jobs share the same magnetic sampling.
+      """
+      specs = []
+      folders = set()
+      for i, variation in enumerate(self.variations):
+         settings = []
+         for key, value in variation.items():
+            if key in VARIATION_KEYS:
+               continue
+            dataclass_name, _, field_name = key.partition(".")
+            if dataclass_name not in VARIABLE_DATACLASSES:
+               raise ValueError("Unknown key in variation "+str(i)+": "+key)
+            if field_name not in [field.name for field in fields(getattr(self.template.io, dataclass_name))]:
+               raise ValueError("Unknown field in variation "+str(i)+": "+key)
+            settings.append( (dataclass_name, field_name, str(value)) )
+
+         folder = self.root + str(variation.get("folder", "job_"+str(i)))
+         if folder in folders:
+            raise ValueError("Two variations write in the same folder: "+folder)
+         folders.add(folder)
+
+         specs.append(job_spec(
+            folder        = folder,
+            structure_ase = variation.get("structure", self.structure_ase),
+            settings      = tuple(settings),
+            kpoints       = variation.get("kpoints"),
+            seed          = variation.get("seed", self.template.magnetism.seed),
+            mode          = variation.get("mode", "Cartesian"),
+            ntasks        = variation.get("ntasks"),
+            time          = variation.get("time")))
+
+      return specs
+
+   def write(self, max_workers=None, executor="thread"):
+      """
+      Writes all jobs through a pool of threads (executor="thread") or processes (executor="process").
+      Returns the list of folders written, and keeps the throughput (jobs/s) in self.throughput.
+      """
+      # imported here, as it is slow to import and only needed to write
+      from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+      if executor == "thread":
+         pool = ThreadPoolExecutor(max_workers=max_workers)
+      elif executor == "process":
+         pool = ProcessPoolExecutor(max_workers=max_workers)
+      else:
+         raise ValueError("executor should be 'thread' or 'process', not "+str(executor))
+
+      start = time.perf_counter()
+      with pool:
+         futures = [pool.submit(write_job_spec, self.template, spec) for spec in self.specs]
+         folders = [future.result() for future in futures]
+      self.duration   = time.perf_counter() - start
+      self.throughput = len(folders) / self.duration if self.duration > 0 else float("inf")
+
+      if self.verbose != "low":
+         print("\nCampaign: "+str(len(folders))+" jobs written in "+"{:.2f}".format(self.duration)+" s ("
+               +"{:.1f}".format(self.throughput)+" jobs/s)")
+
+      return folders
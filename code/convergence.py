@@ -0,0 +1,245 @@
+import os
+import json
+import time
+import shlex
+import numpy as np
+from pyVASP.code.campaign import job_spec, write_job_spec, get_folder_value
+from pyVASP.code.parsers import OSZICAR_parser, is_finished
+from pyVASP.code.results import get_composition
+from pyVASP.code.runner import run_command, job_runner
+from pyVASP.code.structure import get_kpoints_mesh
+
+# parameters a convergence study can scan, with the dataclass and field of io they set (None: structure.kpoints)
+PARAMETERS = {"ENCUT": ("INCAR", "ENCUT"), "kpoints": None}
+
+
+def get_ENCUT_ladder(start=300, stop=800, step=50):
+   """
+   ENCUT values (eV) from start to stop (included), as INCAR strings.
+   """
+   return [str(int(value)) for value in np.arange(start, stop + step/2, step)]
+
+
+def get_kpoints_ladder(lattice_vectors, densities=np.arange(1.5, 12, 0.5), reference_lattice_vectors=None):
+   """
+   Meshes of increasing density for the cell lattice_vectors (rows, in Angstrom), as KPOINTS strings,
+   one per density in k-points per 1/Angstrom (see structure.get_kpoints_mesh).
+   Densities giving the same mesh as a lower one are skipped.
+   """
+   meshes = []
+   for density in densities:
+      mesh = get_kpoints_mesh(lattice_vectors, density, reference_lattice_vectors)
+      if mesh not in meshes:
+         meshes.append(mesh)
+   return meshes
+
+
+def read_energy(folder, out_file_name="out"):
+   """
+   Energy (E0, sigma -> 0) of the last ionic step of the calculation in folder, read from its OSZICAR
+   or, if there is none, from its out file (VASP prints the same ionic lines). NaN if there is none yet.
+   """
+   for file_name in ["OSZICAR", out_file_name]:
+      file_name = os.path.join(folder, file_name)
+      if not os.path.exists(file_name):
+         continue
+      step = {}
+      for step in OSZICAR_parser(file_name):
+         pass
+      if "E0" in step:
+         return step["E0"]
+   return np.nan
+
+
+def read_convergence_record(record_file):
+   """
+   Converged choices recorded in record_file, as {composition: {parameter: entry}} (see convergence_study.record).
+   """
+   try:
+      with open(record_file) as f:
+         return json.load(f)
+   except (OSError, ValueError):
+      return {}
+
+
+class convergence_study:
+   """
+   Ladder of values of ENCUT or kpoints for one structure, written from a template pyVASP object
+   (as a campaign, without modifying it) and run or submitted batch_size values at a time, in order.
+
+   The ladder stops as soon as the energy per atom changes by less than tolerance (eV/atom) between
+   consecutive values, patience times in a row: the converged choice is the first value of that run,
+   and the remaining (more expensive) values are never run. Values whose calculation failed (see failed)
+   are skipped, comparing the values around them. The choice is then recorded for the
+   composition of the structure in record_file (pyVASP_convergence.json in the cwd of the template
+   by default), to be reused with pyVASP.use_converged.
+   """
+
+   def __init__(self, template, structure_ase, parameter, values, tolerance=1e-3, patience=1,
+                root=None, record_file=None, verbose="normal"):
+
+      if parameter not in PARAMETERS:
+         raise ValueError("parameter should be one of "+", ".join(PARAMETERS)+", not "+str(parameter))
+      self.template      = template
+      self.structure_ase = structure_ase
+      self.parameter     = parameter
+      self.values        = [str(value) for value in values]
+      self.tolerance     = tolerance
+      self.patience      = patience
+      self.verbose       = verbose
+
+      if root is None:
+         root = template.io.cwd + "convergence_" + parameter
+      self.root = template.io.add_slash(os.path.abspath(root))
+      if record_file is None:
+         record_file = template.io.cwd + "pyVASP_convergence.json"
+      self.record_file = record_file
+
+      species, counts = np.unique(structure_ase.get_chemical_symbols(), return_counts=True)
+      self.composition     = get_composition(species, counts)
+      self.number_of_atoms = len(structure_ase)
+
+      self.specs    = [self.get_spec(value) for value in self.values]
+      self.energies = np.full(len(self.values), np.nan) # per atom
+      self.failed   = set() # indices of the values whose calculation failed
+      self.converged_value = None
+
+      return
+
+   ###############################################################################
+   # functionalities
+   def get_spec(self, value):
+      folder = self.root + self.parameter + "_" + get_folder_value(value)
+      if self.parameter == "kpoints":
+         return job_spec(folder, self.structure_ase, kpoints=value, seed=self.template.magnetism.seed)
+      dataclass_name, field_name = PARAMETERS[self.parameter]
+      return job_spec(folder, self.structure_ase, settings=((dataclass_name, field_name, value),),
+                      seed=self.template.magnetism.seed)
+
+   def read_energies(self, indices):
+      """
+      Energies per atom of the values of indices. Those of failed calculations (or without an energy)
+      are NaN, and are added to failed.
+      """
+      for i in indices:
+         if i not in self.failed:
+            self.energies[i] = read_energy(self.specs[i].folder, self.template.io.out_file_name) / self.number_of_atoms
+         if np.isnan(self.energies[i]):
+            self.failed.add(i)
+      return
+
+   def check_convergence(self):
+      """
+      Looks for patience consecutive changes below tolerance among the values run so far, in order,
+      leaving out the failed ones. Sets converged_value and returns True if found.
+      """
+      done = [i for i in range(len(self.values)) if not np.isnan(self.energies[i])]
+      below = 0
+      for k in range(1, len(done)):
+         below = below + 1 if abs(self.energies[done[k]] - self.energies[done[k-1]]) < self.tolerance else 0
+         if below == self.patience:
+            self.converged_value = self.values[done[k - self.patience]]
+            return True
+      return False
+
+   def get_batches(self, batch_size):
+      return [range(start, min(start + batch_size, len(self.values))) for start in range(0, len(self.values), batch_size)]
+
+   def run(self, batch_size=1):
+      """
+      Runs the ladder on this machine (as pyVASP.run_vasp), batch_size values side by side.
+      Returns the converged value (None if the ladder did not converge).
+      """
+      command = self.template.io.command + " " + shlex.quote(self.template.executable)
+      for batch in self.get_batches(batch_size):
+         folders = [write_job_spec(self.template, self.specs[i]) for i in batch]
+         if batch_size == 1:
+            results = [run_command(command, folders[0], folders[0] + self.template.io.out_file_name)]
+         else:
+            with job_runner(max_jobs=batch_size) as runner:
+               for folder in folders:
+                  runner.submit(command, folder, folder + self.template.io.out_file_name)
+               results = runner.wait()
+         self.failed.update(i for i, result in zip(batch, results) if result.returncode != 0)
+         if self.update(batch):
+            break
+      return self.finish()
+
+   def submit(self, batch_size=1, poll_interval=60, timeout=None):
+      """
+      Submits the ladder (as pyVASP.submit_job), batch_size jobs at a time, waiting for each batch to finish
+      (checking every poll_interval seconds that their OUTCARs are complete) before deciding whether to go on.
+      A job that left the Slurm queue without a complete OUTCAR failed (while squeue fails, jobs are only waited for).
+      Raises TimeoutError if a batch takes longer than timeout seconds.
+      Returns the converged value (None if the ladder did not converge).
+      """
+      from pyVASP.code.monitor import get_slurm_jobs
+      for batch in self.get_batches(batch_size):
+         folders = [write_job_spec(self.template, self.specs[i]) for i in batch]
+         for folder in folders:
+            run_command("sbatch "+shlex.quote(self.template.io.job_script_name), folder)
+
+         start   = time.monotonic()
+         pending = dict(zip(batch, folders))
+         while pending:
+            jobs = get_slurm_jobs()
+            for i, folder in list(pending.items()):
+               if is_finished(folder + "OUTCAR"):
+                  del pending[i]
+               elif jobs is not None and os.path.abspath(folder) not in jobs:
+                  # left the queue without finishing (and is_finished once more, in case it just finished)
+                  if not is_finished(folder + "OUTCAR"):
+                     self.failed.add(i)
+                  del pending[i]
+            if not pending:
+               break
+            if timeout is not None and time.monotonic() - start > timeout:
+               raise TimeoutError("Convergence study: jobs in "+", ".join(pending.values())+" did not finish in "+str(timeout)+" s")
+            time.sleep(poll_interval)
+         if self.update(batch):
+            break
+      return self.finish()
+
+   def update(self, batch):
+      self.read_energies(batch)
+      if self.verbose != "low":
+         for i in batch:
+            if i in self.failed:
+               print("WARNING: convergence of "+self.parameter+" for "+self.composition+": "+self.values[i]
+                     +" failed (see "+self.specs[i].folder+"), skipped")
+               continue
+            print("Convergence of "+self.parameter+" for "+self.composition+": "+self.values[i]
+                  +", E0 = "+"{:.6f}".format(self.energies[i])+" eV/atom")
+      return self.check_convergence()
+
+   def finish(self):
+      if self.converged_value is None:
+         if self.verbose != "low":
+            print("WARNING: "+self.parameter+" did not converge to "+str(self.tolerance)+" eV/atom for "+self.composition)
+         return None
+      self.record()
+      if self.verbose != "low":
+         print(self.parameter+" converged for "+self.composition+": "+self.converged_value
+               +" (recorded in "+self.record_file+")")
+      return self.converged_value
+
+   def record(self):
+      """
+      Adds the converged choice to record_file, under the composition and parameter, with the tolerance,
+      the energies per atom of the values run, the values that failed and their folders. The file is replaced atomically.
+      """
+      records = read_convergence_record(self.record_file)
+      run = ~np.isnan(self.energies)
+      records.setdefault(self.composition, {})[self.parameter] = {
+         "value":     self.converged_value,
+         "tolerance": self.tolerance,
+         "patience":  self.patience,
+         "energies":  {value: float(energy) for value, energy, done in zip(self.values, self.energies, run) if done},
+         "failed":    [self.values[i] for i in sorted(self.failed)],
+         "root":      self.root}
+
+      tmp_file = self.record_file + "." + str(os.getpid()) + ".tmp"
+      with open(tmp_file, "w") as f:
+         json.dump(records, f, indent=1)
+      os.replace(tmp_file, self.record_file)
+      return
@@ -26,6 +26,7 @@ class INCAR:
     LMAXMIX:       str = '6'
     LNONCOLLINEAR: str = '.TRUE.'
     NPAR:          str = '5'
+    KPAR:          str = None # not written unless set (e.g. by plan_parallelization)
     ISYM:          str = '2'
 
 # INCAR_constr parameters
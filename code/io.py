@@ -1,6 +1,24 @@
-from dataclasses import dataclass, fields
+import os
+import re
+import json
+import shlex
+import hashlib
+import numpy as np
+from collections import Counter
+from io import StringIO
+from dataclasses import dataclass, fields, asdict
 from pyVASP.code.dataclass_inputs import INCAR, INCAR_constr, INCAR_constr_flag5, INCAR_relaxation, INCAR_U, INCAR_VDW
 from pyVASP.code.dataclass_inputs import job_parameters, RWIGS, potential_files
+from pyVASP.code.parsers import OUTCAR_parser, OSZICAR_parser, is_finished
+from pyVASP.code.volumetric import volumetric_data
+from pyVASP.code.vasprun import vasprun_parser
+from pyVASP.code.results import results_store
+from pyVASP.code.profiling import null_profiler
+from pyVASP.code.restart import transfer_file, update_INCAR_text, get_INCAR_changes, has_content, is_true
+
+# Concatenated POTCARs shared by all io instances,
+# keyed by (potential_path, species, potential file of each species)
+_POTCAR_cache = {}
 
 class io:
    """
@@ -45,6 +63,17 @@ class io:
       self.job_parameters      = job_parameters()
       self.RWIGS               = RWIGS()
       self.potential_files     = potential_files()
+
+      # If set, POTCARs are stored once in this folder (named by their sha256)
+      # and hardlinked (or symlinked) into each job folder
+      self.POTCAR_cache_dir    = None
+
+      # If set, write_inputs and write_job record the fingerprint of what they write in the manifest
+      # (pyVASP_manifest.json, which always has m and betah) and leave folders untouched when it matches the one recorded
+      self.skip_unchanged      = False
+
+      # timers and bytes written (see pyVASP.enable_profiling)
+      self.profiler            = null_profiler()
       
       ###############################################################################
       # Set files
@@ -114,6 +143,11 @@ class io:
       self.INCAR_file   = self.cwd+'INCAR'
       self.job_file     = self.cwd+self.job_script_name
       self.out_file     = self.cwd+self.out_file_name
+      self.OUTCAR_file  = self.cwd+'OUTCAR'
+      self.OSZICAR_file = self.cwd+'OSZICAR'
+      self.CHGCAR_file  = self.cwd+'CHGCAR'
+      self.vasprun_file = self.cwd+'vasprun.xml'
+      self.manifest_file = self.cwd+'pyVASP_manifest.json'
       return
 
    def add_slash(self, path):
@@ -154,26 +188,301 @@ class io:
    # functionalities
 
    def write_inputs(self, potential_path, df, structure, mode="Cartesian"):
+      """
+      Writes INCAR, KPOINTS, POTCAR and POSCAR, and records m and betah (and, with skip_unchanged,
+      the fingerprint of the inputs) in the manifest.
+      Returns False if the folder was skipped (see skip_unchanged), True otherwise.
+      """
+      if self.skip_unchanged:
+         with self.profiler.stage("get_inputs_fingerprint"):
+            fingerprint = self.get_inputs_fingerprint(potential_path, df, structure, mode)
+         if self.is_unchanged("inputs", fingerprint):
+            return False
+
+      with self.profiler.stage("write_INCAR"):
+         self.write_INCAR(structure.species, df["magmoms"], df["B_CONSTRs"])
+      self.write_structure_inputs(potential_path, df, structure, mode)
+      self.record_inputs(df, fingerprint if self.skip_unchanged else None)
+      return True
+
+   def write_structure_inputs(self, potential_path, df, structure, mode="Cartesian"):
+      """
+      Writes the inputs that do not depend on the magnetic configuration: KPOINTS, POTCAR and POSCAR.
+      """
+      with self.profiler.stage("write_KPOINTS"):
+         self.write_structure_KPOINTS(structure)
+      with self.profiler.stage("write_POTCAR"):
+         self.write_POTCAR(structure.species, potential_path)
+      with self.profiler.stage("write_POSCAR"):
+         self.write_POSCAR(structure.lattice_vectors, df["positions"], df["elements"], structure.species, mode)
+      return
 
-      elements  = df["elements"].tolist()
-      positions = df["positions"].tolist()
-      magmoms   = df["magmoms"].tolist()
-      B_CONSTRs = df["B_CONSTRs"].tolist()
-      
-      kpoints         = structure.kpoints
-      lattice_vectors = structure.lattice_vectors
-      species         = structure.species
-
-      self.write_INCAR(species, magmoms, B_CONSTRs)
-      self.write_KPOINTS(kpoints)
-      self.write_POTCAR(species, potential_path)
-      self.write_POSCAR(lattice_vectors, positions, elements, species, mode)
+   def link_structure_inputs(self, source_dir, targets=None):
+      """
+      Links KPOINTS, POTCAR and POSCAR (or the files in targets) of source_dir into cwd (relative symlinks),
+      falling back to a copy where symlinks are not supported.
+      """
+      source_dir = self.add_slash(source_dir)
+      if targets is None:
+         targets = [self.KPOINTS_file, self.POTCAR_file, self.POSCAR_file]
+      for target in targets:
+         source = source_dir + os.path.basename(target)
+         if os.path.lexists(target):
+            os.remove(target)
+         try:
+            os.symlink(os.path.relpath(source, self.cwd), target)
+         except OSError:
+            import shutil
+            shutil.copyfile(source, target)
       return
 
+   ###############
+   # restarts
+   def get_restart_files(self):
+      """
+      Outputs that a restart (ISTART = ICHARG = 1) takes from the previous calculation, as (file name, shared):
+      CHGCAR and WAVECAR can share their inode with the previous ones only if the new run does not rewrite them
+      (LCHARG, LWAVE). CHG is not read by VASP, so it is only kept (shared) when it is not rewritten.
+      """
+      rewrites_charge = is_true(self.INCAR.LCHARG)
+      files = [("CHGCAR", not rewrites_charge)]
+      if not rewrites_charge:
+         files.append(("CHG", True))
+      files.append(("WAVECAR", not is_true(self.INCAR.LWAVE)))
+      return files
+
+   def transfer_restart_files(self, source_dir):
+      """
+      Brings the restart files (see get_restart_files) of source_dir into cwd with restart.transfer_file:
+      hardlinks or symlinks for shared files, reflinks or copies otherwise. Missing files are skipped.
+      Returns a dict with the method used for each file (None if missing).
+      """
+      source_dir = self.add_slash(source_dir)
+      methods = {}
+      for file_name, shared in self.get_restart_files():
+         methods[file_name] = transfer_file(source_dir + file_name, self.cwd + file_name, shared)
+         self.profiler.count("restart files: "+str(methods[file_name]))
+      return methods
+
+   def get_restart_commands(self, source_dir):
+      """
+      Shell lines of the job script that bring the restart files of source_dir when the job starts
+      (for restarts from calculations that have not run yet): the same as transfer_restart_files,
+      with cp --reflink=auto for the files that need their own inode.
+      """
+      source_dir = os.path.abspath(source_dir)
+      text = "\n\n# restart files of "+source_dir+" (missing ones are skipped)"
+      for file_name, shared in self.get_restart_files():
+         source = shlex.quote(source_dir+'/'+file_name)
+         if shared:
+            command = "ln -f "+source+" . 2>/dev/null || ln -sf "+source+" ."
+         else:
+            command = "cp --reflink=auto "+source+" ."
+         text += "\n[ -e "+source+" ] && { rm -f "+file_name+"; "+command+"; }"
+      return text
+
+   def write_restart_inputs(self, source_dir, potential_path, df, structure, mode="Cartesian"):
+      """
+      Inputs in cwd for a restart of the calculation in source_dir with the current settings: its INCAR with
+      only the tags that differ rewritten, and its KPOINTS, POTCAR and POSCAR linked (if cwd is another folder)
+      when they are the same, written otherwise. Falls back to write_inputs if source_dir has no INCAR.
+      With skip_unchanged, the fingerprint is that of the content of the four files.
+      Returns False if the folder was skipped (see skip_unchanged), True otherwise.
+      """
+      source_dir = self.add_slash(source_dir)
+      if not os.path.exists(source_dir + "INCAR"):
+         return self.write_inputs(potential_path, df, structure, mode)
+
+      with self.profiler.stage("update_INCAR"):
+         with open(source_dir + "INCAR") as f:
+            text = f.read()
+         INCAR_text = self.get_INCAR_text(structure.species, df["magmoms"], df["B_CONSTRs"])
+         INCAR_text = update_INCAR_text(text, get_INCAR_changes(text, INCAR_text))
+      contents = {self.KPOINTS_file: self.get_structure_KPOINTS_text(structure),
+                  self.POTCAR_file:  self.get_POTCAR(structure.species, potential_path)[0],
+                  self.POSCAR_file:  self.get_POSCAR_text(structure.lattice_vectors, df["positions"], df["elements"],
+                                                          structure.species, mode)}
+
+      if self.skip_unchanged:
+         with self.profiler.stage("get_inputs_fingerprint"):
+            fingerprint = self.get_contents_fingerprint([INCAR_text] + list(contents.values()))
+         if self.is_unchanged("inputs", fingerprint):
+            return False
+
+      self.write_file(self.INCAR_file, INCAR_text)
+      same_folder = os.path.abspath(source_dir) == os.path.abspath(self.cwd)
+      for target, content in contents.items():
+         if has_content(source_dir + os.path.basename(target), content):
+            if not same_folder:
+               self.link_structure_inputs(source_dir, [target])
+         elif target == self.POTCAR_file:
+            with self.profiler.stage("write_POTCAR"):
+               self.write_POTCAR(structure.species, potential_path)
+         else:
+            self.write_file(target, content)
+
+      self.record_inputs(df, fingerprint if self.skip_unchanged else None)
+      return True
+
+   ###############
+   # fingerprints and manifest
+   def get_inputs_fingerprint(self, potential_path, df, structure, mode="Cartesian"):
+      """
+      sha256 of everything write_inputs writes: the INCAR, RWIGS and potential dataclasses, the flags,
+      kpoints, lattice vectors, the atom arrays and the content of the POTCAR.
+      """
+      settings = {name: asdict(getattr(self, name)) for name in ["INCAR", "INCAR_constr", "INCAR_constr_flag5",
+                                                                   "INCAR_relaxation", "INCAR_U", "INCAR_VDW",
+                                                                   "RWIGS", "potential_files"]}
+      settings["flags"]     = [self.bfields, self.relaxation, self.U, self.VDW]
+      settings["structure"] = [mode, structure.kpoints, list(structure.species), np.asarray(df["elements"]).tolist()]
+      # only when not the default mesh, so that fingerprints of existing folders stay the same
+      if structure.kpoints_style != "Monkhorst_Pack" or structure.kpoints_shift != "0 0 0" or structure.explicit_kpoints:
+         settings["kpoints"] = [structure.kpoints_style, structure.kpoints_shift, structure.explicit_kpoints,
+                                self.INCAR.ISYM, None if structure.rotations is None else np.asarray(structure.rotations).tolist()]
+
+      fingerprint = hashlib.sha256(json.dumps(settings, sort_keys=True, default=str).encode())
+      fingerprint.update(self.get_POTCAR(structure.species, potential_path)[1].encode())
+      for array in [structure.lattice_vectors, df["positions"], df["magmoms"], df["B_CONSTRs"]]:
+         fingerprint.update(np.ascontiguousarray(array, dtype=float).tobytes())
+      return fingerprint.hexdigest()
+
+   def get_contents_fingerprint(self, contents):
+      """
+      sha256 of the contents (str or bytes) of files, e.g. the inputs written by write_restart_inputs.
+      """
+      fingerprint = hashlib.sha256()
+      for content in contents:
+         fingerprint.update(content.encode() if isinstance(content, str) else content)
+      return fingerprint.hexdigest()
+
+   def get_job_fingerprint(self, executable, restart_from=None):
+      """
+      sha256 of everything write_job writes: job_parameters, command, executable, out file (and restart folder).
+      """
+      settings = [asdict(self.job_parameters), self.command, executable, self.out_file]
+      if restart_from is not None:
+         settings += [self.get_restart_commands(restart_from)]
+      return hashlib.sha256(json.dumps(settings, sort_keys=True, default=str).encode()).hexdigest()
+
+   def get_magnetic_parameters(self, df):
+      """
+      Mean m and betah over the magnetic sites (non-zero magdirs) of df, kept in the manifest
+      for the results store (see record_inputs). NaN if there are no magnetic sites.
+      """
+      magnetic = np.linalg.norm(df["magdirs"], axis=1) > 0
+      if not magnetic.any():
+         return {"m": float("nan"), "betah": float("nan")}
+      return {"m": float(np.mean(df["ms"][magnetic])), "betah": float(np.mean(df["betahs"][magnetic]))}
+
+   def record_inputs(self, df, fingerprint=None):
+      """
+      Records m and betah of df (for the results store) and the fingerprint of the inputs in the manifest.
+      Without a fingerprint (skip_unchanged not set) the one of former inputs is dropped, as it no longer holds.
+      """
+      self.update_manifest(inputs=fingerprint, **self.get_magnetic_parameters(df))
+      return
+
+   def read_manifest(self):
+      """
+      Fingerprints recorded in cwd (empty if there is no readable manifest).
+      """
+      try:
+         with open(self.manifest_file) as f:
+            return json.load(f)
+      except (OSError, ValueError):
+         return {}
+
+   def update_manifest(self, **entries):
+      manifest = self.read_manifest()
+      manifest.update(entries)
+      self.write_file(self.manifest_file, json.dumps(manifest, indent=1, sort_keys=True) + "\n")
+      return
+
+   def is_unchanged(self, key, fingerprint):
+      """
+      With skip_unchanged, True if the manifest of cwd already has fingerprint under key
+      (a finished calculation whose inputs changed is written again).
+      """
+      if not self.skip_unchanged:
+         return False
+      return self.read_manifest().get(key) == fingerprint
+
+   def is_submitted(self):
+      """
+      True if the current inputs and job file of cwd were already submitted (see pyVASP.submit_job).
+      """
+      manifest = self.read_manifest()
+      return "submitted" in manifest and manifest["submitted"] == [manifest.get("inputs"), manifest.get("job")]
+
+   def mark_submitted(self):
+      manifest = self.read_manifest()
+      self.update_manifest(submitted=[manifest.get("inputs"), manifest.get("job")])
+      return
+
+   def is_finished(self):
+      """
+      True if the OUTCAR in cwd ends with the timing summary VASP writes once a run is complete.
+      """
+      return is_finished(self.OUTCAR_file)
+
+   def is_finished_with_current_inputs(self):
+      """
+      True if the calculation in cwd finished after its INCAR was last written.
+      """
+      try:
+         return self.is_finished() and os.path.getmtime(self.OUTCAR_file) >= os.path.getmtime(self.INCAR_file)
+      except OSError:
+         return False
+
+   ###############
+   # outputs
+   def get_OUTCAR_parser(self, offset=0, number_of_steps=0):
+      """
+      Streaming parser of the OUTCAR in cwd, starting at byte offset (see parsers.output_parser).
+      Iterate over it to get the ionic steps.
+      """
+      return OUTCAR_parser(self.OUTCAR_file, offset, number_of_steps)
+
+   def get_OSZICAR_parser(self, offset=0, number_of_steps=0):
+      """
+      Streaming parser of the OSZICAR in cwd, starting at byte offset (see parsers.output_parser).
+      Iterate over it to get the ionic steps.
+      """
+      return OSZICAR_parser(self.OSZICAR_file, offset, number_of_steps)
+
+   def read_CHGCAR(self, file_name=None, cache=True):
+      """
+      Volumetric data of the CHGCAR in cwd (or of file_name, e.g. a CHG), see volumetric.volumetric_data.
+      With cache, the grids are kept in a memory-mapped .npy sidecar for the next reads.
+      """
+      if file_name is None:
+         file_name = self.CHGCAR_file
+      return volumetric_data(file_name, cache)
+
+   def get_results_store(self, root=None):
+      """
+      Results store (see results.results_store) in root, by default cwd/results/.
+      """
+      if root is None:
+         root = self.cwd + "results/"
+      return results_store(root)
+
+   def read_vasprun(self, fields=("final_energy",), file_name=None):
+      """
+      Only the given fields of the vasprun.xml in cwd (or of file_name), see vasprun.vasprun_parser.
+      """
+      if file_name is None:
+         file_name = self.vasprun_file
+      return vasprun_parser(file_name, fields).parse()
+
    ###############
    # INCAR file
    def add_INCAR_parameters(self, text_file):
       for field in fields(self.INCAR):
+         # tags left to the default of VASP
+         if getattr(self.INCAR, field.name) is None:
+            continue
          string = field.name + "="
          string += getattr(self.INCAR, field.name) 
          string += "\n"
@@ -228,115 +537,328 @@ class io:
       return
 
    def write_INCAR(self, species, magmoms, B_CONSTRs):
-      with open(self.INCAR_file, "w") as text_file:
-         self.add_INCAR_parameters(text_file)
-         self.add_RWIGS_parameters(text_file, species)
-
-         # Relaxation:
-         if self.relaxation:
-            self.add_relaxation_parameters(text_file)
-
-         # +U:
-         if self.U:
-            self.add_U_parameters(text_file)
-
-         # VDW:
-         if self.VDW:
-            self.add_VDW_parameters(text_file)
-
-         # Magnetism:
-         if self.bfields:
-            self.add_constr_INCAR_parameters(text_file)
-
-         self.initialise_magnetic_strings()
-
-         for i, magmom in enumerate(magmoms):
-            for idir in range(3):
-               self._MAGMOM_string   += ' ' + '{:.7f}'.format(magmom[idir])
-               if self.bfields:
-                  self._M_CONSTR_string += ' ' + '{:.7f}'.format(magmom[idir])
-            self._MAGMOM_string   += ' '
-            if self.bfields:
-               self._M_CONSTR_string += ' '
-         
-         if self.bfields == True and self.INCAR_constr.I_CONSTRAINED_M == '5':
-            for i, B_CONSTR in enumerate(B_CONSTRs):
-               for idir in range(3):
-                  self._B_CONSTR_string += ' ' + '{:.7f}'.format(B_CONSTR[idir])
-               self._B_CONSTR_string   += ' '
-
-         text_file.write(self._MAGMOM_string + '\n')
-         if self.bfields:
-            text_file.write(self._M_CONSTR_string + '\n')
-            if self.INCAR_constr.I_CONSTRAINED_M == "5":
-               text_file.write(self._B_CONSTR_string + '\n')
+      self.write_file(self.INCAR_file, self.get_INCAR_text(species, magmoms, B_CONSTRs))
+      return
+
+   def get_INCAR_text(self, species, magmoms, B_CONSTRs):
+      """
+      Text of the INCAR of the current settings (see write_INCAR).
+      """
+      text_file = StringIO()
+      self.add_INCAR_parameters(text_file)
+      self.add_RWIGS_parameters(text_file, species)
+
+      # Relaxation:
+      if self.relaxation:
+         self.add_relaxation_parameters(text_file)
+
+      # +U:
+      if self.U:
+         self.add_U_parameters(text_file)
+
+      # VDW:
+      if self.VDW:
+         self.add_VDW_parameters(text_file)
+
+      # Magnetism:
+      if self.bfields:
+         self.add_constr_INCAR_parameters(text_file)
+
+      self.initialise_magnetic_strings()
+
+      vectors_string = self.format_vectors(magmoms, ' ', ' ', ' ')
+      self._MAGMOM_string += vectors_string
+      if self.bfields:
+         self._M_CONSTR_string += vectors_string
+
+      if self.bfields == True and self.INCAR_constr.I_CONSTRAINED_M == '5':
+         self._B_CONSTR_string += self.format_vectors(B_CONSTRs, ' ', ' ', ' ')
+
+      text_file.write(self._MAGMOM_string + '\n')
+      if self.bfields:
+         text_file.write(self._M_CONSTR_string + '\n')
+         if self.INCAR_constr.I_CONSTRAINED_M == "5":
+            text_file.write(self._B_CONSTR_string + '\n')
+      return text_file.getvalue()
+
+   def format_vectors(self, vectors, before, between, after):
+      """
+      Formats an (N, 3) array of vectors with '{:.7f}' in a single pass,
+      each vector as before + x + between + y + between + z + after.
+      """
+      values = np.asarray(vectors, dtype=float).reshape(-1, 3)
+      vector_format = before + '%.7f' + between + '%.7f' + between + '%.7f' + after
+      return (vector_format * len(values)) % tuple(values.ravel().tolist())
+
+   def write_file(self, file_name, text):
+      """
+      Writes text to file_name with a single write. A symlink at file_name
+      (e.g. to inputs shared by an ensemble) is replaced rather than written through.
+      """
+      if os.path.islink(file_name):
+         os.remove(file_name)
+      with open(file_name, "w") as text_file:
+         text_file.write(text)
+         # bytes, not characters (comments and tags may not be ASCII)
+         self.profiler.add_bytes(file_name, text_file.tell())
       return
 
    ###############
    # KPOINTS file
-   def write_KPOINTS(self, kpoints):
-      with open(self.KPOINTS_file, "w") as text_file:
-         text_file.write('KPOINTS created by pyVASP python class\n')
-         text_file.write('0\n')
-         text_file.write('Monkhorst_Pack\n')
-         text_file.write(kpoints + '\n')
-         text_file.write('0 0 0\n')
+   def write_KPOINTS(self, kpoints, style="Monkhorst_Pack", shift="0 0 0", explicit=None):
+      """
+      Writes the mesh kpoints ("n1 n2 n3") of style Monkhorst_Pack or Gamma, or, if explicit is given
+      as (fractional coordinates, weights), that list of k-points (e.g. the irreducible ones of the mesh).
+      """
+      self.write_file(self.KPOINTS_file, self.get_KPOINTS_text(kpoints, style, shift, explicit))
+      return
+
+   def get_KPOINTS_text(self, kpoints, style="Monkhorst_Pack", shift="0 0 0", explicit=None):
+      if explicit is not None:
+         kpoints, weights = explicit
+         text  = 'KPOINTS created by pyVASP python class\n'
+         text += str(len(weights)) + '\nReciprocal\n'
+         text += "".join("{:.12f} {:.12f} {:.12f} {:d}\n".format(*kpoint, int(weight)) for kpoint, weight in zip(kpoints, weights))
+         return text
+      return ('KPOINTS created by pyVASP python class\n'
+              + '0\n'
+              + style + '\n'
+              + kpoints + '\n'
+              + shift + '\n')
+
+   def write_structure_KPOINTS(self, structure):
+      self.write_file(self.KPOINTS_file, self.get_structure_KPOINTS_text(structure))
       return
 
+   def get_structure_KPOINTS_text(self, structure):
+      """
+      KPOINTS of structure: its mesh, or the irreducible k-points of the mesh with explicit_kpoints
+      (with time-reversal symmetry unless ISYM = -1, as VASP).
+      """
+      explicit = None
+      if structure.explicit_kpoints:
+         explicit = structure.get_irreducible_kpoints(time_reversal = self.INCAR.ISYM != "-1")
+      return self.get_KPOINTS_text(structure.kpoints, structure.kpoints_style, structure.kpoints_shift, explicit)
+
    ###############
    # POTCAR file
    def write_POTCAR(self, species, potential_path):
-      with open(self.POTCAR_file, 'w') as text_file:
-         for element in species:
-            potential = potential_path + getattr(self.potential_files, element) + "/POTCAR"
-            with open(potential) as f:
-               potential_text = f.readlines()
-            for i in potential_text:
-               text_file.write(i)
+      POTCAR_bytes, digest = self.get_POTCAR(species, potential_path)
+
+      # never write through an existing link to a cached POTCAR
+      if os.path.lexists(self.POTCAR_file):
+         os.remove(self.POTCAR_file)
+
+      if self.POTCAR_cache_dir is not None:
+         cached_file = self.store_POTCAR(POTCAR_bytes, digest)
+         try:
+            os.link(cached_file, self.POTCAR_file)
+            self.profiler.count("POTCAR links")
+            return
+         except OSError:
+            pass
+         try:
+            os.symlink(os.path.abspath(cached_file), self.POTCAR_file)
+            self.profiler.count("POTCAR links")
+            return
+         except OSError:
+            pass
+
+      with open(self.POTCAR_file, 'wb') as text_file:
+         text_file.write(POTCAR_bytes)
+      self.profiler.add_bytes(self.POTCAR_file, len(POTCAR_bytes))
+      return
+
+   def get_POTCAR(self, species, potential_path):
+      """
+      Concatenated POTCAR of species (and its sha256),
+      read from potential_path only the first time it is needed.
+      """
+      potentials = tuple( getattr(self.potential_files, element) for element in species )
+      key = (potential_path, tuple(species), potentials)
+
+      if key not in _POTCAR_cache:
+         POTCAR_bytes = b''
+         for potential in potentials:
+            with open(potential_path + potential + "/POTCAR", 'rb') as f:
+               POTCAR_bytes += f.read()
+         self.profiler.count("POTCAR files read", len(potentials))
+         _POTCAR_cache[key] = (POTCAR_bytes, hashlib.sha256(POTCAR_bytes).hexdigest())
+
+      return _POTCAR_cache[key]
+
+   def get_valence_electrons(self, species, elements, potential_path):
+      """
+      Number of valence electrons (NELECT) from the ZVAL of each POTCAR, or None if a ZVAL is missing.
+      """
+      counts = Counter( np.asarray(elements).tolist() )
+      number_of_electrons = 0.0
+      for element in species:
+         POTCAR_bytes, digest = self.get_POTCAR([element], potential_path)
+         match = re.search(rb"ZVAL\s*=\s*([-+]?[\d.]+)", POTCAR_bytes)
+         if match is None:
+            return None
+         number_of_electrons += float(match.group(1)) * counts[element]
+      return number_of_electrons
+
+   def store_POTCAR(self, POTCAR_bytes, digest):
+      """
+      Content-addressed copy of POTCAR_bytes in POTCAR_cache_dir. Returns its path.
+      """
+      cache_dir = self.add_slash(self.POTCAR_cache_dir)
+      cached_file = cache_dir + digest + ".POTCAR"
+      if not os.path.exists(cached_file):
+         os.makedirs(cache_dir, exist_ok=True)
+         tmp_file = cached_file + "." + str(os.getpid()) + ".tmp"
+         with open(tmp_file, 'wb') as f:
+            f.write(POTCAR_bytes)
+         os.replace(tmp_file, cached_file)
+      return cached_file
+
+   def clear_POTCAR_cache(self):
+      """
+      Forget the POTCARs kept in memory, e.g. after changing the files under potential_path.
+      """
+      _POTCAR_cache.clear()
       return
 
    ###############
    # POSCAR file
    def write_POSCAR(self, lattice_vectors, positions, elements, species, mode="Cartesian"):
-      with open(self.POSCAR_file, 'w') as text_file:
-         text_file.write("Poscar file generated with python code pyVASP")
-         text_file.write("\n1.0")
-         text_file.write("\n")
-         for lattice_vector in lattice_vectors:
-            text_file.write('{:.7f}'.format(lattice_vector[0]) + " ")
-            text_file.write('{:.7f}'.format(lattice_vector[1]) + " ")
-            text_file.write('{:.7f}'.format(lattice_vector[2]) + "\n")
-         for element in species:
-            text_file.write(element + " ")
-         text_file.write("\n")
-         for element in species:
-            text_file.write( str( elements.count(element) ) + " " )
-         text_file.write("\n"+mode)
-         text_file.write("\n")
-         for position in positions:
-            text_file.write('{:.7f}'.format(position[0]) + " ")
-            text_file.write('{:.7f}'.format(position[1]) + " ")
-            text_file.write('{:.7f}'.format(position[2]) + "\n")
-         
+      self.write_file(self.POSCAR_file, self.get_POSCAR_text(lattice_vectors, positions, elements, species, mode))
       return
 
+   def get_POSCAR_text(self, lattice_vectors, positions, elements, species, mode="Cartesian"):
+      counts = Counter( np.asarray(elements).tolist() )
+      return ("Poscar file generated with python code pyVASP"
+              + "\n1.0"
+              + "\n"
+              + self.format_vectors(lattice_vectors, '', ' ', '\n')
+              + "".join(element + " " for element in species)
+              + "\n"
+              + "".join(str(counts[element]) + " " for element in species)
+              + "\n" + mode
+              + "\n"
+              + self.format_vectors(positions, '', ' ', '\n'))
+
    ###############
    # job file
-   def write_job(self, executable):
+   def write_job(self, executable, restart_from=None):
+      """
+      Writes the job script (and, with skip_unchanged, records its fingerprint in the manifest).
+      With restart_from, the job first brings the restart files of that folder (see get_restart_commands)
+      and exits with the status of VASP.
+      Returns False if the folder was skipped (see skip_unchanged), True otherwise.
+      """
+      if self.skip_unchanged:
+         fingerprint = self.get_job_fingerprint(executable, restart_from)
+         if self.is_unchanged("job", fingerprint):
+            return False
+
+      text_file = StringIO()
+      self.add_job_header(text_file)
+      if restart_from is not None:
+         text_file.write(self.get_restart_commands(restart_from))
+      text_file.write("\n\nstart_time=$(date +%s)  # Record the start time")
+      text_file.write("\n\n"+self.command+" "+shlex.quote(executable)+" > "+shlex.quote(self.out_file))
+      if restart_from is not None:
+         # the exit status of VASP is that of the job, so that the restarts that depend on it (afterok) only start if it ran
+         text_file.write("\nstatus=$?")
+      self.add_job_duration(text_file)
+      if restart_from is not None:
+         text_file.write("\nexit $status")
+      self.write_file(self.job_file, text_file.getvalue())
+      if self.skip_unchanged:
+         self.update_manifest(job=fingerprint)
+
+      return True
+
+   def add_job_header(self, text_file, extra_parameters=None):
+      """
+      Shebang and #SBATCH lines from job_parameters, followed by those in extra_parameters
+      (which override job_parameters with the same name).
+      """
       header_str = "#!/bin/bash"
       sbatch_str = "\n#SBATCH --"
-      with open(self.job_file, "w") as text_file:
-         text_file.write(header_str)
-         for field in fields(self.job_parameters):
-            string = sbatch_str
-            string += field.name.replace("_", "-") + "="
-            string += getattr(self.job_parameters, field.name)
-            text_file.write(string)
-         text_file.write("\n\nstart_time=$(date +%s)  # Record the start time")
-         text_file.write("\n\n"+self.command+" "+executable+" > "+self.out_file)
-         text_file.write("\n\nend_time=$(date +%s)  # Record the end time")
-         text_file.write("\nduration=$((end_time - start_time))  # Calculate the duration in seconds")
-         text_file.write("\n\n# Print the duration")
-         text_file.write("\necho \"Job duration: $((duration/60)) minutes\"")
+      parameters = {field.name: getattr(self.job_parameters, field.name) for field in fields(self.job_parameters)}
+      if extra_parameters is not None:
+         parameters.update(extra_parameters)
+      text_file.write(header_str)
+      for name, value in parameters.items():
+         string = sbatch_str
+         string += name.replace("_", "-") + "="
+         string += str(value)
+         text_file.write(string)
+      return
 
+   def add_job_duration(self, text_file):
+      text_file.write("\n\nend_time=$(date +%s)  # Record the end time")
+      text_file.write("\nduration=$((end_time - start_time))  # Calculate the duration in seconds")
+      text_file.write("\n\n# Print the duration")
+      text_file.write("\necho \"Job duration: $((duration/60)) minutes\"")
       return
+
+   def write_index_file(self, folders, index_file_name):
+      """
+      Index of the folders of a packed job, one absolute path per line
+      (line i+1 is the folder of SLURM_ARRAY_TASK_ID = i).
+      """
+      if len(folders) == 0:
+         raise ValueError("No folders to submit")
+      index_file = self.cwd + index_file_name
+      self.write_file(index_file, "".join(self.add_slash(os.path.abspath(folder)) + "\n" for folder in folders))
+      return index_file
+
+   def write_array_job(self, executable, folders, job_script_name="job_array", index_file_name="job_array.index",
+                       max_simultaneous=None):
+      """
+      Writes in cwd one Slurm job array running executable in each of the (already prepared) folders,
+      at most max_simultaneous at a time. Each array task gets the resources of job_parameters
+      and finds its folder in the index file. Returns the path of the job script.
+      """
+      index_file = self.write_index_file(folders, index_file_name)
+      array = "0-" + str(len(folders) - 1)
+      if max_simultaneous is not None:
+         array += "%" + str(max_simultaneous)
+
+      text_file = StringIO()
+      self.add_job_header(text_file, {"array": array})
+      text_file.write("\n\nfolder=$(sed -n \"$((SLURM_ARRAY_TASK_ID + 1))p\" "+shlex.quote(index_file)+")")
+      text_file.write("\ncd \"$folder\" || exit 1")
+      text_file.write("\n\nstart_time=$(date +%s)  # Record the start time")
+      text_file.write("\n\n"+self.command+" "+shlex.quote(executable)+" > "+shlex.quote(self.out_file_name))
+      self.add_job_duration(text_file)
+
+      job_file = self.cwd + job_script_name
+      self.write_file(job_file, text_file.getvalue())
+      return job_file
+
+   def write_packed_job(self, executable, folders, ntasks_per_step, max_parallel_steps,
+                        job_script_name="job_packed", index_file_name="job_packed.index"):
+      """
+      Writes in cwd a single Slurm job running executable in each of the (already prepared) folders
+      as job steps of ntasks_per_step tasks, with max_parallel_steps of them side by side in the allocation.
+      The script waits for free slots with wait -n, so it needs bash >= 4.3 (it exits at once with older ones).
+      Returns the path of the job script.
+      """
+      index_file = self.write_index_file(folders, index_file_name)
+      ntasks = int(ntasks_per_step) * int(max_parallel_steps)
+
+      text_file = StringIO()
+      self.add_job_header(text_file, {"ntasks": str(ntasks)})
+      text_file.write("\n\n# wait -n needs bash >= 4.3")
+      text_file.write("\nif (( BASH_VERSINFO[0] < 4 || (BASH_VERSINFO[0] == 4 && BASH_VERSINFO[1] < 3) )); then")
+      text_file.write("\n   echo \"bash >= 4.3 is needed to run this job, found $BASH_VERSION\" >&2; exit 1")
+      text_file.write("\nfi")
+      text_file.write("\n\nstart_time=$(date +%s)  # Record the start time")
+      text_file.write("\n\nwhile read -r folder; do")
+      text_file.write("\n   while [ $(jobs -rp | wc -l) -ge "+str(max_parallel_steps)+" ]; do wait -n; done")
+      text_file.write("\n   (cd \"$folder\" && "+self.command+" --exact --ntasks="+str(ntasks_per_step)+" "
+                      +shlex.quote(executable)+" > "+shlex.quote(self.out_file_name)+") &")
+      text_file.write("\ndone < "+shlex.quote(index_file))
+      text_file.write("\nwait")
+      self.add_job_duration(text_file)
+
+      job_file = self.cwd + job_script_name
+      self.write_file(job_file, text_file.getvalue())
+      return job_file
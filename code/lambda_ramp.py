@@ -0,0 +1,303 @@
+import os
+import json
+import time
+import shlex
+import numpy as np
+from pyVASP.code.parsers import OUTCAR_parser, OSZICAR_parser, is_finished
+from pyVASP.code.runner import run_command
+
+# tags set in every calculation of a ramp, so that each one leaves the CHGCAR and WAVECAR of the next
+RAMP_INCAR = {"LWAVE": ".TRUE.", "LCHARG": ".TRUE."}
+
+
+def read_constraint(folder):
+   """
+   Dict with the penalty_energy, LAMBDA and integrated_moments of the last ionic step in the OUTCAR of folder
+   (None if missing), and electronic_steps: the number of electronic steps in its OSZICAR.
+   """
+   folder = os.path.join(folder, "")
+   constraint = {"penalty_energy": None, "LAMBDA": None, "integrated_moments": None, "electronic_steps": 0}
+   if os.path.exists(folder + "OUTCAR"):
+      for step in OUTCAR_parser(folder + "OUTCAR"):
+         constraint.update({key: step[key] for key in ("penalty_energy", "LAMBDA", "integrated_moments")})
+   if os.path.exists(folder + "OSZICAR"):
+      constraint["electronic_steps"] = sum(len(step["electronic_energies"]) for step in OSZICAR_parser(folder + "OSZICAR"))
+   return constraint
+
+
+def get_moment_deviations(moments, targets):
+   """
+   Angles (in degrees) between the integrated moments of the atoms and their constrained directions
+   (M_CONSTR, both (N, 3)). NaN for atoms without a constrained direction or moment.
+   """
+   moments = np.asarray(moments, dtype=float).reshape(-1, 3)
+   targets = np.asarray(targets, dtype=float).reshape(-1, 3)
+   norms = np.linalg.norm(moments, axis=1) * np.linalg.norm(targets, axis=1)
+   with np.errstate(invalid="ignore", divide="ignore"):
+      cosines = np.einsum("ij,ij->i", moments, targets) / norms
+   return np.degrees(np.arccos(np.clip(cosines, -1, 1)))
+
+
+def get_LAMBDA_factor(LAMBDAs, penalties, target_penalty, min_factor=1.5, max_factor=10.):
+   """
+   Factor by which LAMBDA should grow for the penalty energy to reach target_penalty, from a power law
+   E_p ~ LAMBDA^p through the last two steps (LAMBDAs and penalties, in order). With a single step p = -1:
+   once the moments follow the constraint, their deviation goes as 1/LAMBDA and E_p = LAMBDA deviation^2 as 1/LAMBDA.
+   While E_p does not decrease yet (LAMBDA too small to turn the moments), the factor is max_factor.
+   The factor is kept within [min_factor, max_factor], so that each step starts close to the solution of the previous one.
+   """
+   exponent = -1.
+   if len(LAMBDAs) > 1 and LAMBDAs[-1] != LAMBDAs[-2] and min(penalties[-2:]) > 0:
+      exponent = np.log(penalties[-1] / penalties[-2]) / np.log(LAMBDAs[-1] / LAMBDAs[-2])
+   if exponent > -0.1:
+      return max_factor
+   factor = (target_penalty / penalties[-1]) ** (1 / exponent) if penalties[-1] > 0 else min_factor
+   return float(np.clip(factor, min_factor, max_factor))
+
+
+class lambda_ramp:
+   """
+   Ramp of LAMBDA for constrained moments, run from the calculation in the cwd of template (a pyVASP object
+   prepared with prepare_bfields and set_calculation), which is run first if it has not finished.
+   Each step restarts from the CHGCAR and WAVECAR of the previous one (see pyVASP.prepare_restarts), in
+   root/folder_name_i. Every calculation, the first one included (if it has not run yet), has
+   LWAVE = LCHARG = .TRUE. (RAMP_INCAR), so that the next step gets the wavefunctions and the charge density.
+
+   After each step, the penalty energy E_p and the deviations of the integrated moments from their
+   constrained directions are read from the OUTCAR, and the next LAMBDA is chosen to bring E_p down to
+   safety*target_penalty (and the largest deviation to max_deviation degrees, if given) in as few steps
+   as possible (see get_LAMBDA_factor). The ramp stops once both are reached, at LAMBDA_max, after
+   max_steps or when a step fails. The steps are recorded in root/pyVASP_lambda_ramp.json.
+   """
+
+   def __init__(self, template, target_penalty=1e-3, max_deviation=None, LAMBDA_max=1e4, max_steps=10,
+                min_factor=1.5, max_factor=10., safety=0.8, root=None, folder_name="lambda", verbose="normal"):
+
+      if not template.io.bfields:
+         raise ValueError("A LAMBDA ramp needs constrained moments: call prepare_bfields first")
+      self.template       = template
+      self.target_penalty = target_penalty
+      self.max_deviation  = max_deviation
+      self.LAMBDA_max     = LAMBDA_max
+      self.max_steps      = max_steps
+      self.min_factor     = min_factor
+      self.max_factor     = max_factor
+      self.safety         = safety
+      self.folder_name    = folder_name
+      self.verbose        = verbose
+
+      self.root = template.io.add_slash(os.path.abspath(template.io.cwd if root is None else root))
+      self.record_file = self.root + "pyVASP_lambda_ramp.json"
+      # M_CONSTR, in the order of the INCAR
+      self.targets = np.array(template.df["magmoms"], dtype=float)
+
+      self.steps     = [] # dicts with folder, LAMBDA, penalty_energy, max_deviation, electronic_steps
+      self.converged = False
+      self.folder    = None # of the last step run
+
+      return
+
+   ###############################################################################
+   # functionalities
+   @property
+   def electronic_steps(self):
+      """
+      Electronic steps of all the calculations of the ramp (the cost the ramp tries to keep low).
+      """
+      return sum(step["electronic_steps"] for step in self.steps)
+
+   def run(self):
+      """
+      Runs the ramp on this machine. Returns the folder of the last step.
+      """
+      return self.ramp(self.run_step)
+
+   def submit(self, poll_interval=60, timeout=None):
+      """
+      Runs the ramp through Slurm, one job at a time, checking every poll_interval seconds whether it
+      finished (or left the queue without finishing, which stops the ramp). Raises TimeoutError if a step
+      takes longer than timeout seconds. Returns the folder of the last step.
+      """
+      return self.ramp(lambda step: self.submit_step(step, poll_interval, timeout))
+
+   def ramp(self, execute_step):
+      """
+      Runs the ramp with execute_step(step), which runs a restart_step (the calculation in cwd if None)
+      and returns whether it succeeded.
+      """
+      folder = self.template.io.cwd
+      finished = is_finished(folder + "OUTCAR")
+      if not finished:
+         self.prepare_first_step()
+         finished = self.try_step(execute_step, None)
+      if finished:
+         self.update(folder, self.template.io.INCAR_constr.LAMBDA)
+         while not self.check_convergence() and len(self.steps) < self.max_steps:
+            LAMBDA = self.get_next_LAMBDA()
+            if LAMBDA is None:
+               break
+            step = self.prepare_step(folder, LAMBDA, len(self.steps) - 1)
+            if not (self.is_done(step) or self.try_step(execute_step, step)):
+               break
+            folder = step.folder
+            self.update(folder, step.LAMBDA)
+      self.folder = folder
+      self.finish()
+      return folder
+
+   def prepare_first_step(self):
+      """
+      Rewrites the INCAR of the calculation in cwd (which has not run yet) from the settings of the template,
+      with the tags of RAMP_INCAR, which are then set back in template.io.INCAR.
+      """
+      template = self.template
+      if os.path.exists(template.io.INCAR_file):
+         INCAR = {tag: getattr(template.io.INCAR, tag) for tag in RAMP_INCAR}
+         try:
+            for tag, value in RAMP_INCAR.items():
+               setattr(template.io.INCAR, tag, value)
+            template.io.write_INCAR(template.structure.species, template.df["magmoms"], template.df["B_CONSTRs"])
+         finally:
+            for tag, value in INCAR.items():
+               setattr(template.io.INCAR, tag, value)
+      return
+
+   def try_step(self, execute_step, step):
+      if execute_step(step):
+         return True
+      if self.verbose != "low":
+         print("WARNING: LAMBDA ramp stopped, the calculation in "
+               +(self.template.io.cwd if step is None else step.folder)+" failed")
+      return False
+
+   def run_step(self, step):
+      if step is None:
+         return self.template.run_vasp().returncode == 0
+      if self.template.pyscript:
+         io = self.template.io
+         # LWAVE and LCHARG as in the INCAR of the step, so that the files it rewrites are not shared with the parent
+         base, INCAR = io.cwd, {tag: getattr(io.INCAR, tag) for tag in RAMP_INCAR}
+         io.cwd = step.folder
+         try:
+            for tag, value in RAMP_INCAR.items():
+               setattr(io.INCAR, tag, value)
+            io.transfer_restart_files(step.parent)
+         finally:
+            io.cwd = base
+            for tag, value in INCAR.items():
+               setattr(io.INCAR, tag, value)
+         command = self.template.io.command + " " + shlex.quote(self.template.executable)
+         return run_command(command, step.folder, step.folder + self.template.io.out_file_name).returncode == 0
+      return self.template.run_restarts([step])[step.folder].returncode == 0
+
+   def submit_step(self, step, poll_interval=60, timeout=None):
+      from pyVASP.code.monitor import get_slurm_jobs
+      if step is None:
+         folder = self.template.io.cwd
+         run_command("sbatch "+shlex.quote(self.template.io.job_script_name), folder)
+      else:
+         folder = step.folder
+         self.template.submit_restarts([step])
+
+      start = time.monotonic()
+      while not is_finished(folder + "OUTCAR"):
+         jobs = get_slurm_jobs()
+         # (if squeue failed, wait for the next poll)
+         if jobs is not None and os.path.abspath(folder) not in jobs:
+            # left the queue without finishing (and is_finished once more, in case it just finished)
+            return is_finished(folder + "OUTCAR")
+         if timeout is not None and time.monotonic() - start > timeout:
+            raise TimeoutError("LAMBDA ramp: the job in "+folder+" did not finish in "+str(timeout)+" s")
+         time.sleep(poll_interval)
+      return True
+
+   def prepare_step(self, parent_folder, LAMBDA, i):
+      """
+      Inputs of step i (see pyVASP.prepare_restarts), restarting from parent_folder with LAMBDA.
+      """
+      base = self.template.io.cwd
+      self.template.io.cwd = parent_folder
+      try:
+         step = {"LAMBDA": LAMBDA, "folder": self.folder_name + "_" + str(i), "INCAR": dict(RAMP_INCAR)}
+         return self.template.prepare_restarts([step], root=self.root)[0]
+      finally:
+         self.template.io.cwd = base
+
+   def is_done(self, step):
+      """
+      True if the step already finished with its LAMBDA (e.g. when a ramp is run again).
+      """
+      if not is_finished(step.folder + "OUTCAR"):
+         return False
+      LAMBDA = read_constraint(step.folder)["LAMBDA"]
+      return LAMBDA is not None and np.isclose(LAMBDA, float(step.LAMBDA), rtol=1e-3)
+
+   def update(self, folder, LAMBDA):
+      constraint = read_constraint(folder)
+      deviations = np.array([np.nan])
+      if constraint["integrated_moments"] is not None and len(constraint["integrated_moments"]) == len(self.targets):
+         deviations = get_moment_deviations(constraint["integrated_moments"], self.targets)
+      if constraint["LAMBDA"] is not None:
+         LAMBDA = constraint["LAMBDA"]
+      self.steps.append({"folder":           folder,
+                         "LAMBDA":           float(LAMBDA),
+                         "penalty_energy":   constraint["penalty_energy"],
+                         "max_deviation":    None if np.all(np.isnan(deviations)) else float(np.nanmax(deviations)),
+                         "electronic_steps": constraint["electronic_steps"]})
+      if self.verbose != "low":
+         step = self.steps[-1]
+         print("LAMBDA = "+str(step["LAMBDA"])+": E_p = "+str(step["penalty_energy"])+" eV, largest deviation = "
+               +str(step["max_deviation"])+" degrees, "+str(step["electronic_steps"])+" electronic steps")
+      return
+
+   def check_convergence(self):
+      step = self.steps[-1]
+      if step["penalty_energy"] is None:
+         return False
+      self.converged = step["penalty_energy"] <= self.target_penalty and \
+                       (self.max_deviation is None or step["max_deviation"] is None or step["max_deviation"] <= self.max_deviation)
+      return self.converged
+
+   def get_next_LAMBDA(self):
+      """
+      LAMBDA of the next step (as an INCAR string), None if the ramp cannot go on.
+      """
+      if self.steps[-1]["penalty_energy"] is None:
+         if self.verbose != "low":
+            print("WARNING: no penalty energy (E_p) in the OUTCAR of "+self.steps[-1]["folder"])
+         return None
+      if self.steps[-1]["LAMBDA"] >= self.LAMBDA_max:
+         return None
+      steps = [step for step in self.steps if step["penalty_energy"] is not None]
+
+      factor = 1.
+      if steps[-1]["penalty_energy"] > self.target_penalty:
+         factor = get_LAMBDA_factor([step["LAMBDA"] for step in steps], [step["penalty_energy"] for step in steps],
+                                    self.safety * self.target_penalty, self.min_factor, self.max_factor)
+      if self.max_deviation is not None and steps[-1]["max_deviation"] is not None:
+         # the deviation goes as 1/LAMBDA
+         factor = max(factor, np.clip(steps[-1]["max_deviation"] / (self.safety * self.max_deviation),
+                                      self.min_factor, self.max_factor))
+      return "{:.4g}".format(min(steps[-1]["LAMBDA"] * factor, self.LAMBDA_max))
+
+   def finish(self):
+      self.record()
+      if self.verbose != "low":
+         status = "reached" if self.converged else "NOT reached"
+         print("LAMBDA ramp: target "+status+" after "+str(len(self.steps))+" calculations and "
+               +str(self.electronic_steps)+" electronic steps (recorded in "+self.record_file+")")
+      return
+
+   def record(self):
+      """
+      Writes the steps of the ramp and its targets to record_file, replaced atomically.
+      """
+      record = {"target_penalty": self.target_penalty,
+                "max_deviation":  self.max_deviation,
+                "converged":      self.converged,
+                "steps":          self.steps}
+      tmp_file = self.record_file + "." + str(os.getpid()) + ".tmp"
+      with open(tmp_file, "w") as f:
+         json.dump(record, f, indent=1)
+      os.replace(tmp_file, self.record_file)
+      return
@@ -1,5 +1,5 @@
 import numpy as np
-from scipy.optimize import minimize_scalar
+from pyVASP.code.spin_configurations import spin_configurations
 
 class magnetism:
    """
@@ -75,58 +75,84 @@ class magnetism:
       return structure_ase
 
    def set_betahs_from_ms(self, structure_ase, number_of_atoms):
-      betahs = []
-      ms = structure_ase.arrays["ms"]
-      for i in range(number_of_atoms):
-         if ms[i] == 1 or ms[i] is False or ms[i] is None:
-            betahs.append( np.inf )
-         else:
-            if self.DLM_type=="Heisenberg":
-               betahs.append( self.get_betah_from_m( ms[i] ) )
-            elif self.DLM_type=="Ising":
-               betahs.append( np.arctanh(ms[i]) )
+      ms = structure_ase.arrays["ms"][:number_of_atoms]
+
+      betahs = np.full(number_of_atoms, np.inf)
+      dlm = ms != 1
+      if self.DLM_type=="Heisenberg":
+         betahs[dlm] = self.get_betahs_from_ms( ms[dlm] )
+      elif self.DLM_type=="Ising":
+         betahs[dlm] = np.arctanh( ms[dlm] )
 
       structure_ase.new_array("betahs", betahs, dtype=float)
       
       return structure_ase
 
    def set_magmoms(self, structure_ase, number_of_atoms):
-      magmoms = []
-      for i in range(number_of_atoms):
-         this_m      = structure_ase.arrays["ms"][i]
-         this_betah  = structure_ase.arrays["betahs"][i]
-         this_magdir = structure_ase.arrays["magdirs"][i]
+      """
+      Sample the magnetic moments of all DLM sites at once.
+      Random numbers are drawn in the same order as a site-by-site loop would
+      (theta then phi for each Heisenberg site, one number per Ising site),
+      so a given seed gives the same magmoms.
+      """
+      magmoms = self.get_magmoms(structure_ase, number_of_atoms, [self.rng])[0]
 
-         if this_m is False or this_m is None or this_m==1:
-            magmoms.append( this_magdir )
+      structure_ase.new_array("magmoms", magmoms, dtype=float)
+
+      return structure_ase
 
-         elif self.DLM_type=="Heisenberg":
-            random_number = self.rng.random()
-            theta = self.get_theta_mag(random_number, this_betah)
-            phi   = self.rng.random() * 2*np.pi
+   def get_magmoms_ensemble(self, structure_ase, number_of_atoms, ensemble_size, seeds=None):
+      """
+      Sample ensemble_size independent sets of magmoms, returned as an array of shape
+      (ensemble_size, number_of_atoms, 3) together with the seed of each snapshot.
+      By default the seeds are self.seed, self.seed+1, ..., so that snapshot i is the same
+      as a single set_magmoms call with seed = seeds[i].
+      """
+      if seeds is None:
+         seeds = [self.seed + i for i in range(ensemble_size)]
+      elif len(seeds) != ensemble_size:
+         raise ValueError("Pass one seed per snapshot: got "+str(len(seeds))+" seeds for ensemble_size = "+str(ensemble_size))
 
-            mod = np.linalg.norm( this_magdir )
-            mux = np.sin(theta) * np.cos(phi)
-            muy = np.sin(theta) * np.sin(phi)
-            muz = np.cos(theta)
-            mu = mod * np.array( [mux, muy, muz] ) 
+      rngs = [np.random.RandomState(seed) for seed in seeds]
+      magmoms = self.get_magmoms(structure_ase, number_of_atoms, rngs)
 
-            # now rotate magmom:
-            mu = self.rotate_magmom(mu, this_magdir)
+      return magmoms, list(seeds)
 
-            magmoms.append( mu )
+   def get_magmoms(self, structure_ase, number_of_atoms, rngs):
+      """
+      One set of magmoms per random number generator in rngs, shape (len(rngs), number_of_atoms, 3).
+      """
+      ms      = structure_ase.arrays["ms"][:number_of_atoms]
+      betahs  = structure_ase.arrays["betahs"][:number_of_atoms]
+      magdirs = structure_ase.arrays["magdirs"][:number_of_atoms]
+
+      magmoms = np.repeat(np.array(magdirs, dtype=float)[None], len(rngs), axis=0)
+      dlm = ms != 1
+      number_of_dlm_sites = np.count_nonzero(dlm)
+
+      if number_of_dlm_sites > 0:
+         if self.DLM_type=="Heisenberg":
+            random_numbers = np.array([rng.random((number_of_dlm_sites, 2)) for rng in rngs])
+            thetas = self.get_theta_mags(random_numbers[...,0], np.broadcast_to(betahs[dlm], random_numbers.shape[:-1]))
+            phis   = random_numbers[...,1] * 2*np.pi
+
+            mods = np.linalg.norm(magdirs[dlm], axis=1)
+            mus = np.empty(thetas.shape + (3,))
+            mus[...,0] = np.sin(thetas) * np.cos(phis)
+            mus[...,1] = np.sin(thetas) * np.sin(phis)
+            mus[...,2] = np.cos(thetas)
+            mus *= mods[:,None]
+
+            # now rotate magmoms:
+            magmoms[:,dlm] = self.rotate_magmoms(mus, magdirs[dlm])
 
          elif self.DLM_type=="Ising":
-            random_number = self.rng.random()
-            conc_up = 0.5*(this_m + 1)
-            if random_number < conc_up:
-               magmoms.append( this_magdir )
-            else:
-               magmoms.append( -this_magdir )
-
-      structure_ase.new_array("magmoms", magmoms, dtype=float)
+            random_numbers = np.array([rng.random(number_of_dlm_sites) for rng in rngs])
+            concs_up = 0.5*(ms[dlm] + 1)
+            signs = np.where(random_numbers < concs_up, 1.0, -1.0)
+            magmoms[:,dlm] = signs[...,None] * magdirs[dlm]
 
-      return structure_ase
+      return magmoms
 
    def get_theta_mag(self, random_number, betah, tol=1e-4):
       if betah > tol:
@@ -134,6 +160,25 @@ class magnetism:
       else:
          return np.arccos(1 - 2*random_number - 2*(random_number-1)*random_number*betah)
 
+   def get_theta_mags(self, random_numbers, betahs, tol=1e-4):
+      """
+      Array version of get_theta_mag.
+      """
+      random_numbers = np.asarray(random_numbers, dtype=float)
+      betahs         = np.asarray(betahs, dtype=float)
+      large = betahs > tol
+
+      thetas = np.empty(np.shape(betahs))
+      with np.errstate(over='ignore', invalid='ignore'):
+         b = betahs[large]
+         r = random_numbers[large]
+         thetas[large] = np.arccos(np.log(np.exp(b)-2*r*np.sinh(b))/b)
+      b = betahs[~large]
+      r = random_numbers[~large]
+      thetas[~large] = np.arccos(1 - 2*r - 2*(r-1)*r*b)
+
+      return thetas
+
    def rotate_magmom(self, mu, magdir):
       mod = np.linalg.norm(magdir)
       theta = np.arccos(magdir[2]/mod)
@@ -146,6 +191,19 @@ class magnetism:
       mu_rotated = np.dot(Rphi, mu_rotated)
 
       return mu_rotated
+
+   def rotate_magmoms(self, mus, magdirs):
+      """
+      Array version of rotate_magmom: rotates each row of mus (..., N, 3)
+      from the z-axis onto the corresponding row of magdirs (N, 3).
+      """
+      mods = np.linalg.norm(magdirs, axis=1)
+      thetas = np.arccos(magdirs[:,2]/mods)
+      phis = np.arctan2(magdirs[:,1], magdirs[:,0])
+
+      R = np.matmul(self.get_Rphis(phis), self.get_Rthetas(thetas))
+
+      return np.einsum('nij,...nj->...ni', R, mus)
    
    def get_Rtheta(self, angle):
       """
@@ -171,6 +229,56 @@ class magnetism:
       R[2,2] = 1
       return R
 
+   def get_Rthetas(self, angles):
+      """
+      stacked rotations about y-axis, shape (N, 3, 3)
+      """
+      angles = np.asarray(angles, dtype=float)
+      R = np.zeros((len(angles),3,3))
+      R[:,0,0] = np.cos(angles)
+      R[:,0,2] = np.sin(angles)
+      R[:,2,0] = -np.sin(angles)
+      R[:,2,2] = np.cos(angles)
+      R[:,1,1] = 1
+      return R
+
+   def get_Rphis(self, angles):
+      """
+      stacked rotations about z-axis, shape (N, 3, 3)
+      """
+      angles = np.asarray(angles, dtype=float)
+      R = np.zeros((len(angles),3,3))
+      R[:,0,0] = np.cos(angles)
+      R[:,0,1] = -np.sin(angles)
+      R[:,1,0] = np.sin(angles)
+      R[:,1,1] = np.cos(angles)
+      R[:,2,2] = 1
+      return R
+
+
+   ###############################################################################
+   # spin configurations
+
+   def enumerate_magdirs(self, structure_ase, magnetic_sites=None, directions=None, counts=None,
+                         time_reversal=True, max_configurations=None, symprec=1e-4):
+      """
+      Generator of magdirs arrays (number_of_atoms, 3), one per symmetry-inequivalent spin configuration
+      of the magnetic sites of structure_ase (by default, those with non-zero magdirs), see spin_configurations.
+      Each one can be set with structure_ase.set_array("magdirs", magdirs) before set_calculation.
+      """
+      configurations = spin_configurations(structure_ase, magnetic_sites, directions, counts, time_reversal, symprec)
+      for configuration in configurations.enumerate(max_configurations):
+         yield configurations.get_magdirs(configuration)
+
+   def sample_magdirs(self, structure_ase, number_of_configurations, magnetic_sites=None, directions=None,
+                      counts=None, time_reversal=True, symprec=1e-4):
+      """
+      As enumerate_magdirs, for supercells too large to enumerate: up to number_of_configurations
+      inequivalent configurations drawn at random with self.rng.
+      """
+      configurations = spin_configurations(structure_ase, magnetic_sites, directions, counts, time_reversal, symprec)
+      for configuration in configurations.sample(number_of_configurations, self.rng):
+         yield configurations.get_magdirs(configuration)
 
    ###############################################################################
    # DLM methods
@@ -188,19 +296,64 @@ class magnetism:
          return -1/betah + 1/np.tanh(betah)
 
    def get_betah_from_m(self, order_parameter, maximum_value_of_betah = 1000, tolerance_of_order_parameter_for_inversion=1e-2):
-      def f(x, order_parameter):
-         return ( 1 + x*( order_parameter-1/np.tanh(x) ) )**2
+      return float( self.get_betahs_from_ms(np.array([order_parameter]), maximum_value_of_betah,
+                                            tolerance_of_order_parameter_for_inversion)[0] )
 
-      if abs(order_parameter) < tolerance_of_order_parameter_for_inversion:
-         betah = 3*order_parameter
-      else:
-         if order_parameter > 0:
-            res = minimize_scalar(f, bounds=(0, maximum_value_of_betah),
-                              args=(order_parameter), method='bounded')
-            # res = minimize_scalar(f, args=(order_parameter), method='golden')
-         else:
-            res = minimize_scalar(f, bounds=(-maximum_value_of_betah, 0),
-                              args=(order_parameter), method='bounded')
-         betah = res.x
-
-      return betah
\ No newline at end of file
+   def get_betahs_from_ms(self, ms, maximum_value_of_betah = 1000, tolerance_of_order_parameter_for_inversion=1e-2):
+      """
+      Inverse of the Langevin function (get_m_from_betah) for a whole array of order parameters.
+      Each distinct value of ms is solved only once.
+
+      Below tolerance_of_order_parameter_for_inversion the linear limit betah = 3*m is used.
+      Otherwise a safeguarded Newton iteration is run inside the bracket
+      3|m| <= |betah| <= 1/(1-|m|), so that |get_m_from_betah(betah) - m| < 1e-12
+      (or |betah| = maximum_value_of_betah when m is too close to 1).
+      Over m in [-0.999, 0.999] it differs from the bounded minimize_scalar search used
+      formerly by at most about 3e-5 relative to betah (that search stops at xatol = 1e-5).
+      """
+      ms = np.asarray(ms, dtype=float)
+      unique_ms, inverse = np.unique(ms, return_inverse=True)
+
+      abs_ms = np.abs(unique_ms)
+      betahs = 3*abs_ms
+      solve = abs_ms >= tolerance_of_order_parameter_for_inversion
+      if np.any(solve):
+         betahs[solve] = self._inverse_langevin(abs_ms[solve], maximum_value_of_betah)
+      betahs = np.sign(unique_ms) * betahs
+
+      return betahs[inverse].reshape(ms.shape)
+
+   def _inverse_langevin(self, ms, maximum_value_of_betah, tol=1e-12, max_iterations=100):
+      """
+      Safeguarded Newton solver of L(x) = m for 0 < m, with L(x) = coth(x) - 1/x.
+      """
+      with np.errstate(divide='ignore', invalid='ignore', over='ignore'):
+         lower = np.minimum(3*ms, maximum_value_of_betah)
+         upper = np.minimum(1/(1-ms), maximum_value_of_betah)
+         upper = np.where(np.isnan(upper) | (upper < lower), maximum_value_of_betah, upper)
+
+         # Pade approximant (Cohen 1991) as initial guess
+         x = np.clip(ms*(3-ms**2)/(1-ms**2), lower, upper)
+         x = np.where(np.isnan(x), upper, x)
+
+         active = np.ones(len(ms), dtype=bool)
+         for iteration in range(max_iterations):
+            xa = x[active]
+            residual = 1/np.tanh(xa) - 1/xa - ms[active]
+            derivative = 1/xa**2 - 1/np.sinh(xa)**2
+
+            # update bracket
+            lower[active] = np.where(residual < 0, xa, lower[active])
+            upper[active] = np.where(residual > 0, xa, upper[active])
+
+            x_new = xa - residual/derivative
+            outside = ~((x_new > lower[active]) & (x_new < upper[active]))
+            x_new = np.where(outside, 0.5*(lower[active] + upper[active]), x_new)
+
+            converged = (np.abs(residual) < tol) | (upper[active] - lower[active] < tol*upper[active])
+            x[active] = np.where(converged, xa, x_new)
+            active[np.flatnonzero(active)[converged]] = False
+            if not np.any(active):
+               break
+
+      return x
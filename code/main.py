@@ -1,10 +1,21 @@
-import numpy as np
 import os
-import pandas as pd
-from subprocess import run
+import shlex
+import numpy as np
 from pyVASP.code.io import io
 from pyVASP.code.structure import structure
 from pyVASP.code.magnetism import magnetism
+from pyVASP.code.atom_table import atom_table
+from pyVASP.code.structure_cache import prepared_structure, shared_structure_cache
+from pyVASP.code.campaign import campaign
+from pyVASP.code.runner import run_command
+from pyVASP.code.results import get_composition
+from pyVASP.code.parallelization import parallelization_planner, cost_model, memory_model, get_default_NPAR, \
+                                           get_number_of_plane_waves, get_memory_in_MB
+from pyVASP.code.profiling import profiler, null_profiler
+from pyVASP.code.restart import restart_step
+from pyVASP.code.monitor import job_monitor
+from pyVASP.code.lambda_ramp import lambda_ramp
+from pyVASP.code.convergence import convergence_study, get_ENCUT_ladder, get_kpoints_ladder, read_convergence_record
 
 class pyVASP:
    """
@@ -46,12 +57,19 @@ class pyVASP:
       # set ntasks per node
       self.ntasks_per_node = ntasks_per_node
       self.io.job_parameters.ntasks = str(self.ntasks_per_node)
+      # cost and memory models used to choose KPAR and NPAR, see plan_parallelization
+      self.parallelization_model = cost_model()
+      self.memory_model          = memory_model()
       # set command
       self.io.command = command
+      # timers and counters of each stage, off unless enable_profiling is called
+      self.profiler = self.io.profiler = null_profiler()
+      # prepared structures, shared by all pyVASP objects (see structure_cache)
+      self.structure_cache = shared_structure_cache
       self.pyscript   = pyscript
 
       ###############################################################################
-      # Setting executable and potential paths, and checking these exist
+      # Setting executable and potential paths (checked to exist when first used)
       self.executable_path = executable_path
       self.potential_path  = potential_path
       
@@ -60,7 +78,7 @@ class pyVASP:
       
       ###############################################################################
       if self.verbose == "high":
-         self.io.write_initialization_info(self.executable, self.potential_path, seed_mag)
+         self.io.write_initialization_info(self._executable, self._potential_path, seed_mag)
 
       return
    
@@ -83,22 +101,30 @@ class pyVASP:
       
    @property
    def potential_path(self):
+      # checked the first time it is used rather than when set, as it may be on a slow network mount
+      if not self._potential_path_checked:
+         assert os.path.exists(self._potential_path) is True, "\nYour potential path does not exist!\nYour potential path is:\n"+self._potential_path
+         self._potential_path_checked = True
       return self._potential_path
    @potential_path.setter
    def potential_path(self, new_val):
       # Fixing "/" in the executable path if necessary
       new_val = self.io.add_slash(new_val)
       self._potential_path = new_val
-      assert os.path.exists(self._potential_path) is True, "\nYour potential path does not exist!\nYour potential path is:\n"+self.potential_path
+      self._potential_path_checked = False
       
    @property
    def executable(self):
+      # checked the first time it is used, as the potential path
+      if not self._executable_checked:
+         assert os.path.exists(self._executable) is True, "\nYour executable does not exist!\nYour executable is:\n"+self._executable
+         self._executable_checked = True
       return self._executable
    @executable.setter
    def executable(self, new_val):
       self.executable_name = new_val
       self._executable = self.executable_path + new_val
-      assert os.path.exists(self._executable) is True, "\nYour executable does not exist!\nYour executable is:\n"+self.executable
+      self._executable_checked = False
       
    @property
    def df(self):
@@ -111,50 +137,151 @@ class pyVASP:
       #    raise ValueError("Pass an iterable with two items: structure_ase (from ASE) and class.io.magnetic_inputs")
       # else:
 
-      # First get number of magnetic atoms and set default values to magnetic_inputs.ms and magnetic.inputs.B_CONSTRs if not given
-      self.io.number_of_atoms = len(structure_ase)
-      structure_ase = self.magnetism.set_default_magnetic_inputs(structure_ase, self.io.number_of_atoms)
+      # structure_ase is not modified: its magnetic inputs and sorted table are prepared on a copy,
+      # kept in structure_cache, and only the magmoms are sampled again at every call
+      prepared = self.get_prepared_structure(structure_ase)
 
       # Get magmoms from magdirs and betahs (if ms is 1, magmom = magdir at that site)
-      structure_ase = self.magnetism.set_betahs_from_ms(structure_ase, self.io.number_of_atoms)
-      structure_ase = self.magnetism.set_magmoms(structure_ase, self.io.number_of_atoms)
-
-      self._df = pd.DataFrame({
-      "elements"  : structure_ase.get_chemical_symbols(),
-      "positions" : [tuple(sublist) for sublist in list( structure_ase.positions )],
-      "magdirs"   : [tuple(sublist) for sublist in list( structure_ase.arrays["magdirs"] )],
-      "ms"        : list( structure_ase.arrays["ms"] ),
-      "betahs"    : list( structure_ase.arrays["betahs"] ),
-      "magmoms"   : [tuple(sublist) for sublist in list( structure_ase.arrays["magmoms"] )],
-      "B_CONSTRs" : [tuple(sublist) for sublist in list( structure_ase.arrays["B_CONSTRs"] )]
-      })
-      # sort values to satisfy vasp
-      self._df = self._df.sort_values(["elements", "magdirs", "positions"])
+      structure_ase = prepared.atoms.copy()
+      with self.profiler.stage("set_magmoms"):
+         structure_ase = self.magnetism.set_magmoms(structure_ase, self.io.number_of_atoms)
+      self.set_prepared_structure(prepared, structure_ase)
+
+      return
+
+   def get_prepared_structure(self, structure_ase):
+      """
+      Prepared copy of structure_ase (see prepare_structure), taken from structure_cache when possible.
+      """
+      self.io.number_of_atoms = len(structure_ase)
+      settings = [self.magnetism.DLM_type, self.magnetism.default_magdir, self.magnetism.default_m,
+                  self.magnetism.default_B_CONSTR, self.structure.symprec]
+      key = self.structure_cache.get_key(structure_ase, settings)
+      prepared = self.structure_cache.get(key)
+      if prepared is None:
+         prepared = self.prepare_structure(structure_ase)
+         self.structure_cache.put(key, prepared)
+      else:
+         self.profiler.count("structure cache hits")
+      return prepared
+
+   def set_prepared_structure(self, prepared, structure_ase):
+      """
+      Sets the atom table, structure and symmetry from prepared and its copy structure_ase,
+      which already holds the sampled magmoms.
+      """
+      self._df = prepared.table.with_magmoms(structure_ase.arrays["magmoms"])
+      self.profiler.count("atoms", self.io.number_of_atoms)
 
       self.io.structure_ase = structure_ase
 
+      # also updates kpoints when they follow a density (see structure.set_kpoints_density)
       self.structure.lattice_vectors = structure_ase.cell.array
+      if self.structure.symprec is not None:
+         if prepared.rotations is not None:
+            self.structure.rotations = prepared.rotations
+         else:
+            with self.profiler.stage("symmetry"):
+               self.structure.set_symmetry(structure_ase, structure_ase.arrays["magmoms"])
       self.structure.elements = self._df["elements"]
-      species = []
-      for element in self.structure.elements:
-         if element not in species:
-            species.append(element)
-      self.structure.species = species
+      # species in order of appearance
+      self.structure.species = list( dict.fromkeys( self.structure.elements.tolist() ) )
 
       return
 
+   def prepare_structure(self, structure_ase):
+      """
+      Magnetic inputs (defaults and betahs) and sorted atom_table of a copy of structure_ase, plus its
+      point group if it does not depend on the sampled magmoms (see structure_cache.prepared_structure).
+      """
+      with self.profiler.stage("prepare_structure"):
+         atoms = structure_ase.copy()
+         # First get number of magnetic atoms and set default values to ms and B_CONSTRs if not given
+         with self.profiler.stage("set_default_magnetic_inputs"):
+            atoms = self.magnetism.set_default_magnetic_inputs(atoms, self.io.number_of_atoms)
+         with self.profiler.stage("set_betahs_from_ms"):
+            atoms = self.magnetism.set_betahs_from_ms(atoms, self.io.number_of_atoms)
+
+         # sorted (as needed by vasp) table of atoms; use self.df.to_dataframe() for a pandas view.
+         # magmoms are set at every call (see atom_table.with_magmoms), magdirs only hold their place
+         with self.profiler.stage("atom_table"):
+            table = atom_table(
+               elements  = atoms.get_chemical_symbols(),
+               positions = atoms.positions,
+               magdirs   = atoms.arrays["magdirs"],
+               ms        = atoms.arrays["ms"],
+               betahs    = atoms.arrays["betahs"],
+               magmoms   = atoms.arrays["magdirs"],
+               B_CONSTRs = atoms.arrays["B_CONSTRs"]).set_read_only()
+
+         # without DLM sites, magmoms are the magdirs
+         rotations = None
+         if self.structure.symprec is not None and np.all(atoms.arrays["ms"] == 1):
+            with self.profiler.stage("symmetry"):
+               self.structure.set_symmetry(atoms, atoms.arrays["magdirs"])
+            rotations = self.structure.rotations
+
+      return prepared_structure(atoms, table, rotations)
+
    ###############################################################################
    # functionalities
-   def run_vasp(self):
-      os.chdir(self.io.cwd)
-      run(self.io.command+" "+self.executable+" > "+self.io.out_file, shell=True)
-      return
+   def run_vasp(self, runner=None):
+      """
+      Runs vasp in cwd, with its output in out_file (and stderr in out_file + ".err", see run_command).
+      Without runner it blocks until vasp finishes; with a runner.job_runner it returns at once
+      a future of the job_result (exit status and wall time), so that many jobs can run side by side.
+      """
+      command = self.io.command+" "+shlex.quote(self.executable)
+      if runner is None:
+         return run_command(command, self.io.cwd, self.io.out_file)
+      return runner.submit(command, self.io.cwd, self.io.out_file)
    
-   def submit_job(self):      
-      os.chdir(self.io.cwd)
-      run("sbatch "+self.io.job_file, shell=True)
+   def submit_job(self):
+      """
+      Submits the job file of cwd. With io.skip_unchanged, inputs that were already submitted unchanged,
+      or that finished since they were last written, are not submitted again.
+      """
+      if self.io.skip_unchanged and (self.io.is_finished_with_current_inputs() or self.io.is_submitted()):
+         if self.verbose != "low":
+            print("Skipping submission of "+self.io.cwd+": already submitted or finished")
+         return
+      run_command("sbatch "+shlex.quote(self.io.job_file), self.io.cwd)
+      if self.io.skip_unchanged:
+         self.io.mark_submitted()
       return
 
+   def monitor_jobs(self, folders=None, stall_time=None, use_inotify=True):
+      """
+      job_monitor of folders (by default cwd): call its poll() for the progress, ETA and failures of the runs,
+      or watch() to follow them until they finish (optionally cancelling those that diverge or slosh).
+      NELM and EDIFF are read from the INCAR of each folder, with those of io.INCAR as fallback.
+      """
+      if folders is None:
+         folders = [self.io.cwd]
+      return job_monitor(folders, NELM=self.io.INCAR.NELM, EDIFF=self.io.INCAR.EDIFF, stall_time=stall_time,
+                         use_inotify=use_inotify, verbose=self.verbose)
+
+   def submit_array_job(self, folders, max_simultaneous=None, packed=False, ntasks_per_step=None):
+      """
+      Submits the (already prepared) folders with a single sbatch call, from cwd:
+      as a Slurm job array (one task per folder, at most max_simultaneous running), or,
+      with packed=True, as one allocation running max_simultaneous job steps of
+      ntasks_per_step tasks side by side (which needs bash >= 4.3 on the nodes).
+      The array tasks can be cancelled folder by folder (see monitor.cancel_jobs), the runs of a packed job cannot.
+      Raises ValueError if folders is empty.
+      """
+      if packed:
+         if ntasks_per_step is None:
+            ntasks_per_step = self.io.job_parameters.ntasks
+         if max_simultaneous is None:
+            max_simultaneous = len(folders)
+         job_file = self.io.write_packed_job(self.executable, folders, ntasks_per_step, max_simultaneous)
+      else:
+         job_file = self.io.write_array_job(self.executable, folders, max_simultaneous=max_simultaneous)
+
+      run_command("sbatch "+shlex.quote(job_file), self.io.cwd)
+      return job_file
+
    def prepare_bfields(self, I_CONSTRAINED_M="4", LAMBDA="1",
                        B_MIX="1.0", B_ref="0.02", N_MIX="1.0", E_PENALTY_MAX="3.8", LAMBDA_FIELD_MAX="1e-3"):
       self.io.bfields = True
@@ -199,79 +326,404 @@ class pyVASP:
       return
 
    def set_calculation(self, structure_ase, mode="Cartesian", ntasks=None, time=None, chdir=False):
-      # set ntasks, if given
-      if ntasks != None:
-         self.set_ntasks(ntasks)
+      with self.profiler.stage("set_calculation"):
+         # set time, if given
+         if time != None:
+            time = float(time)
+            time = str(int(time))
+            self.io.job_parameters.time = time
+
+         # prepare structure and magnetism
+         with self.profiler.stage("df"):
+            self.df = structure_ase
+
+         # set ntasks, if given (after the structure, which sets the number of bands)
+         if ntasks != None:
+            with self.profiler.stage("set_ntasks"):
+               self.set_ntasks(ntasks)
+
+         # write files
+         if chdir:
+            os.chdir(self.io.cwd)
+         with self.profiler.stage("write_inputs"):
+            written = self.io.write_inputs(self.potential_path, self.df, self.structure, mode)
+
+         if not self.pyscript:
+            with self.profiler.stage("write_job"):
+               written = self.io.write_job(self.executable) or written
+
+         if not written:
+            self.profiler.count("folders skipped")
+            if self.verbose == "high":
+               print("Inputs of "+self.io.cwd+" are unchanged or finished, folder skipped")
+
+      self.print_profile()
+      return
 
+   def set_ensemble(self, structure_ase, ensemble_size, seeds=None, folder_name="snapshot",
+                    mode="Cartesian", ntasks=None, time=None):
+      """
+      Writes ensemble_size DLM snapshots of structure_ase, one per folder cwd/folder_name_i/.
+      The structure is prepared and sorted only once, KPOINTS, POTCAR and POSCAR are written once in
+      cwd/folder_name_shared/ and linked into every snapshot folder, which then only gets its own INCAR (and job file).
+      The magmoms of all snapshots are kept in self.ensemble_magmoms, shape (ensemble_size, natoms, 3),
+      in the (sorted) order of self.df, and the seed of each snapshot in self.ensemble_seeds.
+      self.df holds the magmoms of the first snapshot.
+      Returns the list of snapshot folders.
+      """
       # set time, if given
       if time != None:
          time = float(time)
          time = str(int(time))
          self.io.job_parameters.time = time
 
-      # prepare structure and magnetism
-      self.df = structure_ase
+      # prepare structure and magnetism (sampled only once, for the whole ensemble)
+      prepared = self.get_prepared_structure(structure_ase)
+      structure_ase = prepared.atoms.copy()
+      with self.profiler.stage("set_magmoms"):
+         magmoms, seeds = self.magnetism.get_magmoms_ensemble(structure_ase, self.io.number_of_atoms,
+                                                              ensemble_size, seeds)
+      structure_ase.new_array("magmoms", magmoms[0], dtype=float)
+      self.set_prepared_structure(prepared, structure_ase)
 
-      # write files
-      if chdir:
-         os.chdir(self.io.cwd)
-      self.io.write_inputs(self.potential_path, self.df, self.structure, mode)
-      
-      if not self.pyscript:
-         self.io.write_job(self.executable)
+      # set ntasks, if given (after the structure, which sets the number of bands)
+      if ntasks != None:
+         self.set_ntasks(ntasks)
 
-      return
+      # same order as the sorted atom table
+      self.ensemble_magmoms = magmoms[:, self.df.index]
+      self.ensemble_seeds   = seeds
+
+      # write shared files
+      base_cwd = self.io.cwd
+      B_CONSTRs = self.df["B_CONSTRs"]
+
+      folders = []
+      try:
+         shared_cwd = base_cwd + folder_name + "_shared/"
+         self.io.cwd = shared_cwd
+         os.makedirs(self.io.cwd, exist_ok=True)
+         self.io.write_structure_inputs(self.potential_path, self.df, self.structure, mode)
+
+         for i in range(ensemble_size):
+            self.io.cwd = base_cwd + folder_name + "_" + str(i)
+            os.makedirs(self.io.cwd, exist_ok=True)
+            self.io.link_structure_inputs(shared_cwd)
+            self.io.write_INCAR(self.structure.species, self.ensemble_magmoms[i], B_CONSTRs)
+            self.io.record_inputs(self.df)
+            if not self.pyscript:
+               self.io.write_job(self.executable)
+            folders.append(self.io.cwd)
+      finally:
+         self.io.cwd = base_cwd
 
-   def restart_from_charge(self, cwd_new=False, kpoints=False, LAMBDA=False, chdir=False):
+      if self.verbose == "high":
+         print("\nEnsemble of "+str(ensemble_size)+" snapshots written in "+base_cwd+folder_name+"_*")
+         print("   seeds = "+str(seeds))
+
+      return folders
+
+   def write_campaign(self, structure_ase, variations, root=None, max_workers=None, executor="thread"):
+      """
+      Writes one job per variation (see campaign) in parallel, using this object as template.
+      Neither this object nor the current working directory are modified.
+      Returns the campaign, whose specs describe every job.
+      """
+      jobs = campaign(self, structure_ase, variations, root=root, verbose=self.verbose)
+      jobs.write(max_workers=max_workers, executor=executor)
+      return jobs
+
+   def converge(self, structure_ase, parameter, values=None, tolerance=1e-3, patience=1, batch_size=1,
+                submit=False, root=None, record_file=None, **submit_options):
+      """
+      Convergence study of parameter ("ENCUT" or "kpoints") for structure_ase (see convergence_study):
+      values (by default get_ENCUT_ladder() or get_kpoints_ladder of the cell, with the same kpoints_reference) are run in order, locally
+      or submitted (submit=True, with submit_options poll_interval and timeout), until the energy per atom
+      changes by less than tolerance (eV/atom). Neither this object nor cwd are modified.
+      Returns the study, with the converged value in study.converged_value.
+      """
+      if values is None:
+         values = get_ENCUT_ladder() if parameter == "ENCUT" else get_kpoints_ladder(structure_ase.cell.array,
+                                                                                     reference_lattice_vectors=self.structure.kpoints_reference)
+      study = convergence_study(self, structure_ase, parameter, values, tolerance=tolerance, patience=patience,
+                                root=root, record_file=record_file, verbose=self.verbose)
+      if submit:
+         study.submit(batch_size=batch_size, **submit_options)
+      else:
+         study.run(batch_size=batch_size)
+      return study
+
+   def use_converged(self, structure_ase, record_file=None):
+      """
+      Sets ENCUT and kpoints to the converged choices recorded (see converge) for the composition of structure_ase,
+      leaving those not recorded as they are. Returns a dict with the values set.
+      """
+      if record_file is None:
+         record_file = self.io.cwd + "pyVASP_convergence.json"
+      species, counts = np.unique(structure_ase.get_chemical_symbols(), return_counts=True)
+      records = read_convergence_record(record_file).get(get_composition(species, counts), {})
+
+      used = {}
+      if "ENCUT" in records:
+         self.io.INCAR.ENCUT = used["ENCUT"] = records["ENCUT"]["value"]
+      if "kpoints" in records:
+         self.structure.kpoints = used["kpoints"] = records["kpoints"]["value"]
+      if self.verbose == "high":
+         print("Converged parameters used: "+str(used))
+      return used
+
+   def ramp_LAMBDA(self, target_penalty=1e-3, max_deviation=None, LAMBDA_max=1e4, max_steps=10, submit=False,
+                   root=None, **ramp_options):
+      """
+      Ramps LAMBDA from the calculation in cwd (see lambda_ramp), locally or submitted (submit=True, with
+      ramp_options poll_interval and timeout), each step restarting from the CHGCAR and WAVECAR of the previous one,
+      until the penalty energy is below target_penalty (eV) and the moments within max_deviation (degrees) of
+      their constrained directions. If the calculation in cwd has not run yet, its INCAR is rewritten with
+      LWAVE = LCHARG = .TRUE. (see lambda_ramp.prepare_first_step). cwd, LAMBDA and the INCAR tags are left as they were.
+      Returns the ramp, with its steps and the folder of the last one (ramp.folder).
+      """
+      submit_options = {key: ramp_options.pop(key) for key in ("poll_interval", "timeout") if key in ramp_options}
+      ramp = lambda_ramp(self, target_penalty=target_penalty, max_deviation=max_deviation, LAMBDA_max=LAMBDA_max,
+                         max_steps=max_steps, root=root, verbose=self.verbose, **ramp_options)
+      if submit:
+         ramp.submit(**submit_options)
+      else:
+         ramp.run()
+      return ramp
 
-      if cwd_new is not False:         
-         if not os.path.exists(cwd_new):
-            run("mkdir " + cwd_new, shell=True)
-         run("cp CHGCAR CHG WAVECAR "+cwd_new, shell=True)
-         self.io.cwd = cwd_new
+   def restart_from_charge(self, cwd_new=False, kpoints=False, LAMBDA=False, chdir=False):
+      """
+      Restarts the calculation of cwd (ISTART = ICHARG = 1) from its CHGCAR and WAVECAR, in cwd_new if given
+      (which becomes cwd), with new kpoints and LAMBDA if given and the other current settings. The restart files
+      are hardlinked, reflinked or copied as needed (see io.transfer_restart_files, missing ones are skipped),
+      and only the INCAR tags that differ from those of cwd are rewritten (see io.write_restart_inputs).
+      """
+      with self.profiler.stage("restart_from_charge"):
+         source_dir = self.io.cwd
+         self.set_restart_parameters(LAMBDA)
+         if kpoints is not False:
+            self.structure.kpoints = kpoints
+
+         if cwd_new is not False:
+            os.makedirs(cwd_new, exist_ok=True)
+            self.io.cwd = cwd_new
+            with self.profiler.stage("transfer_restart_files"):
+               self.io.transfer_restart_files(source_dir)
+
+         # write files
+         if chdir:
+            os.chdir(self.io.cwd)
+         with self.profiler.stage("write_inputs"):
+            self.io.write_restart_inputs(source_dir, self.potential_path, self.df, self.structure)
+
+      self.print_profile()
+      return
 
+   def set_restart_parameters(self, LAMBDA=False):
+      """
+      Sets ISTART = ICHARG = 1 (and LAMBDA, if given) for a restart.
+      """
       self.io.INCAR.ISTART = "1"
       self.io.INCAR.ICHARG = "1"
-
-      if kpoints is not False:
-         self.structure.kpoints = kpoints
       if LAMBDA is not False:
          self.io.INCAR_constr.LAMBDA = str(LAMBDA)
-
-      # write files
-      if chdir:
-         os.chdir(self.io.cwd)
-      self.io.write_inputs(self.potential_path, self.df, self.structure)
-
       return
 
-   def set_ntasks(self, ntasks="40"):
-      ntasks = float(ntasks)
-      NPAR0 = round(np.sqrt(ntasks))
-      NPAR = NPAR0
-      res = ntasks % NPAR
-
-      dN_list = [-1, 1]
-      idN = 0
-      dNf = 1
-      while res != 0:
-         NPAR = NPAR0 + dN_list[idN]*dNf
+   def prepare_restarts(self, steps, root=None, folder_name="restart"):
+      """
+      Prepares a graph of restarts, e.g. a LAMBDA or kpoints ramp, from the calculation in cwd (which does not
+      need to have run yet). steps is a list of dicts with the LAMBDA and/or kpoints of each calculation, and
+      optionally its folder (by default root/folder_name_i, root being cwd by default), parent: the index
+      of the step it restarts from (by default the previous one, -1 being the calculation in cwd), and INCAR:
+      a dict of other tags of io.INCAR to change (e.g. {"LWAVE": ".TRUE."}).
+      For example, [{"LAMBDA": 1}, {"LAMBDA": 10}, {"LAMBDA": 100}] is a LAMBDA ramp.
+      Each folder gets the INCAR of its parent with only the changed tags (those of the step and its ancestors,
+      and any other setting changed since the parent was written), and a job that brings the restart
+      files of its parent when it starts. Returns the list of restart_step, to be run with submit_restarts
+      (as Slurm dependencies) or run_restarts (locally). cwd, LAMBDA, kpoints and io.INCAR are left as they were.
+      """
+      base_cwd = self.io.cwd
+      root = base_cwd if root is None else self.io.add_slash(root)
+      original = (self.io.INCAR.ISTART, self.io.INCAR.ICHARG, self.io.INCAR_constr.LAMBDA, self.structure.kpoints)
+      kpoints_density = self.structure.kpoints_density
+      original_INCAR  = {tag: getattr(self.io.INCAR, tag) for step in steps for tag in step.get("INCAR", {})
+                         if hasattr(self.io.INCAR, tag)}
+
+      restart_steps = []
+      step_INCARs   = []
+      try:
+         for i, step in enumerate(steps):
+            parent = step.get("parent", i - 1)
+            if not -1 <= parent < i:
+               raise ValueError("The parent of step "+str(i)+" should be a previous step or -1, not "+str(parent))
+            if parent == -1:
+               parent_folder, LAMBDA, kpoints, INCAR = base_cwd, original[2], original[3], {}
+            else:
+               parent_folder, LAMBDA, kpoints = restart_steps[parent].folder, restart_steps[parent].LAMBDA, restart_steps[parent].kpoints
+               INCAR = step_INCARs[parent]
+
+            folder = self.io.add_slash(root + str(step.get("folder", folder_name + "_" + str(i))))
+            os.makedirs(folder, exist_ok=True)
+            self.io.cwd = folder
+
+            new_LAMBDA  = str(step.get("LAMBDA", LAMBDA))
+            new_kpoints = step.get("kpoints", kpoints)
+            self.structure.kpoints = new_kpoints
+            self.set_restart_parameters(new_LAMBDA)
+            # INCAR tags of the step and its ancestors
+            INCAR = dict(INCAR, **{tag: str(value) for tag, value in step.get("INCAR", {}).items()})
+            for tag, value in dict(original_INCAR, **INCAR).items():
+               if not hasattr(self.io.INCAR, tag):
+                  raise ValueError("Unknown INCAR tag of step "+str(i)+": "+str(tag))
+               setattr(self.io.INCAR, tag, value)
+            step_INCARs.append(INCAR)
+            self.io.write_restart_inputs(parent_folder, self.potential_path, self.df, self.structure)
+            if not self.pyscript:
+               self.io.write_job(self.executable, restart_from=parent_folder)
+
+            restart_steps.append(restart_step(folder, parent_folder, new_LAMBDA, new_kpoints))
+      finally:
+         self.io.cwd = base_cwd
+         self.io.INCAR.ISTART, self.io.INCAR.ICHARG, self.io.INCAR_constr.LAMBDA, self.structure.kpoints = original
+         self.structure.kpoints_density = kpoints_density
+         for tag, value in original_INCAR.items():
+            setattr(self.io.INCAR, tag, value)
+
+      return restart_steps
+
+   def submit_restarts(self, restart_steps, after=None):
+      """
+      Submits the jobs of restart_steps (see prepare_restarts), each one starting only after the job of its
+      parent finished successfully (and the first ones after the Slurm job after, if given).
+      Returns a dict with the job id of each folder (the output of sbatch is kept in its sbatch.out).
+      """
+      job_ids = {}
+      for step in restart_steps:
+         parent_id = job_ids.get(step.parent, after)
+         dependency = "" if parent_id is None else " --dependency=afterok:"+str(parent_id)
+         out_file = os.path.join(step.folder, "sbatch.out")
+         result = run_command("sbatch --parsable"+dependency+" "+shlex.quote(self.io.job_script_name), step.folder, out_file)
+         if result.returncode != 0:
+            with open(result.err_file) as f:
+               raise RuntimeError("sbatch failed in "+step.folder+" (exit status "+str(result.returncode)+"):\n"+f.read())
+         # --parsable prints "job id" or "job id;cluster"
+         with open(out_file) as f:
+            job_ids[step.folder] = f.read().strip().split(";")[0]
+      return job_ids
+
+   def run_restarts(self, restart_steps):
+      """
+      Runs the jobs of restart_steps (see prepare_restarts) locally, one after the other, with bash
+      (so that each one brings its restart files first). Steps whose parent failed are skipped.
+      Returns a dict with the job_result of each folder (None if skipped).
+      """
+      results = {}
+      failed  = set()
+      for step in restart_steps:
+         if step.parent in failed:
+            results[step.folder] = None
+            failed.add(step.folder)
+            continue
+         results[step.folder] = run_command("bash "+shlex.quote(self.io.job_script_name), step.folder)
+         if results[step.folder].returncode != 0:
+            failed.add(step.folder)
+      return results
+
+   def enable_profiling(self, callback=None, cprofile=False):
+      """
+      Starts timing every stage of set_calculation and restart_from_charge (and counting the bytes written),
+      see profiling.profiler. callback(stage, seconds) is called at the end of each stage, and with cprofile
+      the stages are also profiled with cProfile. Returns the profiler, e.g. to call write_json or write_pstats.
+      With verbose = 'high', a summary table is printed after each calculation.
+      """
+      self.profiler = self.io.profiler = profiler(callback, cprofile)
+      return self.profiler
+
+   def disable_profiling(self):
+      self.profiler = self.io.profiler = null_profiler()
+      return
 
-         idN += 1
-         if idN > 1:
-            idN = 0
-            dNf += 1
+   def print_profile(self):
+      if self.profiler.enabled and self.verbose == "high":
+         print("\n"+self.profiler.summary())
+      return
 
-         res = ntasks % NPAR
+   def set_ntasks(self, ntasks="40", plan=False, objective="core_hours"):
+      """
+      Sets ntasks and NPAR: the divisor of ntasks closest to sqrt(ntasks), with a single k-group (KPAR is not changed).
+      With plan=True, KPAR, NCORE and NPAR are chosen by plan_parallelization instead, whose ranked plans are returned.
+      """
+      if plan:
+         return self.plan_parallelization(ntasks_options=[int(float(ntasks))], objective=objective)
 
-      if ntasks%self.ntasks_per_node == 0:
-         nodes_job = str(int(ntasks/self.ntasks_per_node))
-      else:
-         #raise ValueError("ntasks chosen is not a multiple of default ntasks per node")
+      ntasks = int(float(ntasks))
+      if ntasks % self.ntasks_per_node != 0 and self.verbose != "low":
          print("ntasks chosen is not a multiple of default ntasks per node")
+      self.io.job_parameters.ntasks = str(ntasks) # needed for mpie
+      self.io.job_parameters.nodes  = str(-(-ntasks // self.ntasks_per_node))
+      self.io.INCAR.NPAR = str(get_default_NPAR(ntasks))
+      return
+
+   def plan_parallelization(self, ntasks_options=None, max_nodes=1, objective="core_hours",
+                            number_of_kpoints=None, number_of_bands=None, max_memory=None):
+      """
+      Enumerates the valid (nodes, ntasks, KPAR, NCORE/NPAR) combinations for the structure and kpoints,
+      ranks them with self.parallelization_model (see parallelization.cost_model, which can be fitted
+      to measured timings) among those that fit in max_memory MB per task (by default job_parameters.mem_per_cpu,
+      see parallelization.memory_model), and writes the best one into INCAR and job_parameters.
+      ntasks_options defaults to whole nodes up to max_nodes (and divisors of ntasks_per_node).
+      The numbers of irreducible k-points and of bands are estimated if not given.
+      Returns the ranked list of plans.
+      """
+      planner = parallelization_planner(self.ntasks_per_node, self.parallelization_model, self.memory_model)
+      if ntasks_options is None:
+         ntasks_options = planner.get_ntasks_options(max_nodes)
+      if number_of_kpoints is None:
+         number_of_kpoints = self.structure.get_number_of_irreducible_kpoints(time_reversal = self.io.INCAR.ISYM != "-1")
+      if number_of_bands is None:
+         number_of_bands = self.get_number_of_bands()
+      if max_memory is None:
+         max_memory = get_memory_in_MB(self.io.job_parameters.mem_per_cpu)
+      volume = abs(np.linalg.det(np.asarray(self.structure.lattice_vectors, dtype=float)))
+      number_of_plane_waves = get_number_of_plane_waves(volume, self.io.INCAR.ENCUT)
+      spinors = 2 if self.io.INCAR.LNONCOLLINEAR == ".TRUE." else 1
+
+      plans = planner.enumerate_plans(ntasks_options, number_of_kpoints, number_of_bands, number_of_plane_waves, spinors)
+      plans = planner.rank(plans, objective, max_memory)
+      if not plans:
+         raise ValueError("No valid parallelization for ntasks = "+str(ntasks_options))
+      self.set_parallelization(plans[0])
+
+      if plans[0].memory is not None and plans[0].memory > max_memory and self.verbose != "low":
+         print("WARNING: no parallelization fits in "+str(max_memory)+" MB per task (the one used, with KPAR = 1, needs "
+               +"{:.0f}".format(plans[0].memory)+" MB)")
+      if self.verbose == "high":
+         print("\nParallelization plans (best first):")
+         for plan in plans[:5]:
+            print("   "+str(plan))
 
-      self.io.job_parameters.ntasks = str(int(ntasks)) # needed for mpie
-      self.io.job_parameters.nodes  = nodes_job
-      self.io.INCAR.NPAR = str(int(NPAR))
+      return plans
 
+   def set_parallelization(self, plan):
+      self.io.job_parameters.ntasks = str(plan.ntasks) # needed for mpie
+      self.io.job_parameters.nodes  = str(plan.nodes)
+      self.io.INCAR.NPAR = str(plan.NPAR)
+      self.io.INCAR.KPAR = str(plan.KPAR)
       return
+
+   def get_number_of_bands(self):
+      """
+      Default NBANDS of VASP for the current structure, or None if unknown
+      (no structure set yet, or no ZVAL in the POTCARs).
+      """
+      if not hasattr(self, "_df"):
+         return None
+      number_of_electrons = self.io.get_valence_electrons(self.structure.species, self.structure.elements, self.potential_path)
+      if number_of_electrons is None:
+         return None
+      number_of_atoms = len(self.structure.elements)
+      number_of_bands = max(int(round(number_of_electrons + 2)) // 2 + max(number_of_atoms // 2, 3),
+                            int(0.6 * number_of_electrons))
+      if self.io.INCAR.LNONCOLLINEAR == ".TRUE.":
+         number_of_bands *= 2
+      return number_of_bands
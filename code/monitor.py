@@ -0,0 +1,492 @@
+import os
+import re
+import time
+import struct
+import numpy as np
+from dataclasses import dataclass
+from pyVASP.code.parsers import OSZICAR_parser, is_finished
+
+# states of a run that are worth cancelling it for
+FAILED_STATES = ("diverging", "sloshing", "unconverged", "stalled")
+
+# index of the folders of a job array, in its submit folder (see io.write_array_job)
+ARRAY_INDEX_FILE = "job_array.index"
+
+_NELM_re  = re.compile(r"^\s*NELM\s*=\s*(\d+)", re.M)
+_EDIFF_re = re.compile(r"^\s*EDIFF\s*=\s*([-+]?[\d.]+(?:[EeDd][-+]?\d+)?)", re.M)
+
+
+@dataclass(frozen=True)
+class run_status:
+   """
+   State of one running calculation (see job_monitor):
+   waiting (no OSZICAR yet), running, finished, or one of FAILED_STATES.
+   electronic_steps and dE are those of the ionic step in progress, rate is in electronic steps per second
+   and eta the estimated time (s) until its electronic loop converges (None while unknown).
+   """
+   folder:                 str
+   state:                  str
+   ionic_steps:            int   = 0
+   electronic_steps:       int   = 0
+   total_electronic_steps: int   = 0
+   energy:                 float = np.nan
+   dE:                     float = np.nan
+   rate:                   float = None
+   eta:                    float = None
+   message:                str   = ""
+
+   @property
+   def failed(self):
+      return self.state in FAILED_STATES
+
+
+def read_electronic_settings(folder, NELM=None, EDIFF=None):
+   """
+   NELM and EDIFF of the INCAR in folder, falling back to the ones given and then to the defaults of VASP.
+   """
+   try:
+      with open(os.path.join(folder, "INCAR")) as f:
+         text = f.read()
+   except OSError:
+      text = ""
+   match = _NELM_re.search(text)
+   if match is not None:
+      NELM = int(match.group(1))
+   match = _EDIFF_re.search(text)
+   if match is not None:
+      EDIFF = float(match.group(1).replace("D", "E").replace("d", "e"))
+   return (60 if NELM is None else int(NELM)), (1e-4 if EDIFF is None else float(EDIFF))
+
+
+def diagnose(dEs, NELM, EDIFF, window=10, min_steps=15, divergence_slope=0.05, sloshing_slope=-0.02):
+   """
+   State of an electronic loop from its energy changes dEs so far, with the number of steps it still needs
+   (None if unknown): log10|dE| is fitted over the last window steps.
+   - running: converged (|dE| < EDIFF, no more steps), or converging at the fitted rate
+     (at most NELM steps in total).
+   - diverging: |dE| grows faster than divergence_slope decades per step, and is 10 times its minimum.
+   - sloshing: dE keeps changing sign without decreasing (slope above sloshing_slope), i.e. the charge
+     density oscillates instead of converging.
+   - unconverged: NELM steps reached without |dE| < EDIFF.
+   Only diverging and sloshing need min_steps steps, as the first ones are not self-consistent.
+   """
+   dEs = np.asarray(dEs, dtype=float)
+   number_of_steps = len(dEs)
+   if number_of_steps == 0:
+      return "running", None
+   if not np.all(np.isfinite(dEs)):
+      return "diverging", None
+   sizes = np.abs(dEs)
+   if sizes[-1] < EDIFF:
+      return "running", 0
+   if number_of_steps >= NELM:
+      return "unconverged", None
+
+   recent = sizes[-window:]
+   if len(recent) < 3:
+      return "running", None
+   slope = np.polyfit(np.arange(len(recent)), np.log10(np.maximum(recent, 1e-300)), 1)[0]
+
+   if number_of_steps >= min_steps:
+      if slope > divergence_slope and sizes[-1] > 10*sizes.min():
+         return "diverging", None
+      signs = np.sign(dEs[-window:])
+      if np.mean(signs[1:] != signs[:-1]) >= 0.5 and slope > sloshing_slope:
+         return "sloshing", None
+
+   remaining = NELM - number_of_steps
+   if slope < 0:
+      remaining = min(remaining, int(np.ceil((np.log10(EDIFF) - np.log10(sizes[-1])) / slope)))
+   return "running", remaining
+
+
+class run_tracker:
+   """
+   Incremental reader of the outputs of one calculation: OSZICAR is parsed from the offset of its last
+   complete ionic step (see parsers.output_parser), and only when its size or modification time changed;
+   OUTCAR is only checked for completion when it changed. The electronic-step rate is measured between
+   the modification times of OSZICAR.
+   If OSZICAR is replaced (another inode), truncated or rewritten (the bytes before the offset changed),
+   e.g. by a new run in the folder, everything read so far is dropped and it is parsed again from the start.
+   """
+
+   # bytes before the offset compared to detect a rewritten OSZICAR
+   check_size = 64
+
+   def __init__(self, folder, NELM=None, EDIFF=None, window=10, stall_time=None):
+      self.folder     = os.path.abspath(folder)
+      # read from the INCAR once the run started (see update)
+      self.default_settings = (NELM, EDIFF)
+      self.NELM, self.EDIFF = None, None
+      self.window     = window
+      self.stall_time = stall_time
+      self.OSZICAR_file = os.path.join(self.folder, "OSZICAR")
+      self.OUTCAR_file  = os.path.join(self.folder, "OUTCAR")
+
+      self.signatures  = {}
+      self.last_change = time.time()
+      self.status      = run_status(self.folder, "waiting")
+      self.reset()
+      return
+
+   def reset(self):
+      """
+      Forgets what was read from OSZICAR (and the settings and completion of the run).
+      """
+      self.parser = OSZICAR_parser(self.OSZICAR_file)
+      self.NELM, self.EDIFF = None, None
+      self.completed_electronic_steps = 0 # of the completed ionic steps
+      self.energies, self.dEs = [], []
+      self.last_energy = np.nan
+      self.last_step   = None # (mtime, total electronic steps)
+      self.rate        = None
+      self.finished    = False
+      self.checked_bytes = b""
+      return
+
+   def get_signature(self, file_name):
+      try:
+         stat = os.stat(file_name)
+      except OSError:
+         return None
+      return (stat.st_size, stat.st_mtime_ns, stat.st_ino)
+
+   def is_rewritten(self, signature):
+      """
+      True if OSZICAR (of signature, see get_signature) is not the file parsed up to the offset anymore.
+      """
+      offset = self.parser.offset
+      if offset == 0:
+         return False
+      previous = self.signatures.get("OSZICAR")
+      if previous is None or signature[2] != previous[2] or signature[0] < offset:
+         return True
+      try:
+         with open(self.OSZICAR_file, "rb") as f:
+            f.seek(offset - len(self.checked_bytes))
+            return f.read(len(self.checked_bytes)) != self.checked_bytes
+      except OSError:
+         return True
+
+   def update(self, now=None):
+      """
+      Reads what changed since the last update and returns the run_status.
+      """
+      now = time.time() if now is None else now
+      OSZICAR_signature = self.get_signature(self.OSZICAR_file)
+      OUTCAR_signature  = self.get_signature(self.OUTCAR_file)
+      OSZICAR_changed = OSZICAR_signature != self.signatures.get("OSZICAR")
+      OUTCAR_changed  = OUTCAR_signature != self.signatures.get("OUTCAR")
+      if OSZICAR_changed and OSZICAR_signature is not None and self.is_rewritten(OSZICAR_signature):
+         # a new run: read its settings and outputs from the start
+         self.reset()
+         OUTCAR_changed = True
+      self.signatures["OSZICAR"], self.signatures["OUTCAR"] = OSZICAR_signature, OUTCAR_signature
+
+      if OSZICAR_signature is None:
+         return self.status
+      if self.NELM is None:
+         self.NELM, self.EDIFF = read_electronic_settings(self.folder, *self.default_settings)
+      if OUTCAR_changed and OUTCAR_signature is not None:
+         self.finished = is_finished(self.OUTCAR_file)
+      if not OSZICAR_changed and not OUTCAR_changed:
+         if self.stall_time is not None and not self.finished and now - self.last_change > self.stall_time:
+            self.status = self.get_status("stalled", message="no output for "+str(int(now - self.last_change))+" s")
+         return self.status
+      self.last_change = now
+
+      if OSZICAR_changed:
+         offset = self.parser.offset
+         for step in self.parser.steps():
+            self.completed_electronic_steps += len(step["electronic_dEs"])
+            self.last_energy = step.get("E0", np.nan)
+         self.energies, self.dEs = self.parser.get_pending_electronic_steps()
+         if self.parser.offset != offset:
+            self.checked_bytes = self.read_checked_bytes()
+
+         # rate between the last two writes that added electronic steps
+         total = self.completed_electronic_steps + len(self.dEs)
+         mtime = OSZICAR_signature[1] / 1e9
+         if self.last_step is not None and total > self.last_step[1] and mtime > self.last_step[0]:
+            rate = (total - self.last_step[1]) / (mtime - self.last_step[0])
+            self.rate = rate if self.rate is None else 0.5*(self.rate + rate)
+         if self.last_step is None or total > self.last_step[1]:
+            self.last_step = (mtime, total)
+
+      if self.finished:
+         self.status = self.get_status("finished")
+         return self.status
+
+      state, remaining = diagnose(self.dEs, self.NELM, self.EDIFF, self.window)
+      eta = None
+      if remaining is not None and self.rate:
+         eta = remaining / self.rate
+      message = ""
+      if state != "running":
+         message = "|dE| = {:.2e} after {:d} electronic steps (EDIFF = {:.0e}, NELM = {:d})".format(
+            abs(self.dEs[-1]) if len(self.dEs) else np.nan, len(self.dEs), self.EDIFF, self.NELM)
+      self.status = self.get_status(state, eta, message)
+      return self.status
+
+   def read_checked_bytes(self):
+      """
+      Last check_size bytes of OSZICAR before the offset (see is_rewritten).
+      """
+      start = max(0, self.parser.offset - self.check_size)
+      try:
+         with open(self.OSZICAR_file, "rb") as f:
+            f.seek(start)
+            return f.read(self.parser.offset - start)
+      except OSError:
+         return b""
+
+   def get_status(self, state, eta=None, message=""):
+      return run_status(self.folder, state,
+                        ionic_steps            = self.parser.number_of_steps,
+                        electronic_steps       = len(self.dEs),
+                        total_electronic_steps = self.completed_electronic_steps + len(self.dEs),
+                        energy                 = self.energies[-1] if len(self.energies) else self.last_energy,
+                        dE                     = self.dEs[-1] if len(self.dEs) else np.nan,
+                        rate                   = self.rate,
+                        eta                    = eta,
+                        message                = message)
+
+
+class inotify_watcher:
+   """
+   Linux inotify on a set of folders (through libc with ctypes, without dependencies): wait returns the
+   folders where a file was written, created or moved in. Raises OSError where inotify is not available.
+   """
+   _IN_MODIFY, _IN_CLOSE_WRITE, _IN_MOVED_TO, _IN_CREATE = 0x2, 0x8, 0x80, 0x100
+   _event = struct.Struct("iIII")
+
+   def __init__(self):
+      import ctypes
+      import ctypes.util
+      try:
+         self.libc = ctypes.CDLL(ctypes.util.find_library("c") or "libc.so.6", use_errno=True)
+         self.fd = self.libc.inotify_init1(os.O_NONBLOCK | os.O_CLOEXEC)
+      except (OSError, AttributeError) as error:
+         raise OSError("inotify is not available: "+str(error))
+      if self.fd < 0:
+         raise OSError(ctypes.get_errno(), "inotify_init1 failed")
+      self.folders = {}
+      return
+
+   def add(self, folder):
+      import ctypes
+      mask = self._IN_MODIFY | self._IN_CLOSE_WRITE | self._IN_MOVED_TO | self._IN_CREATE
+      wd = self.libc.inotify_add_watch(self.fd, os.fsencode(folder), mask)
+      if wd < 0:
+         raise OSError(ctypes.get_errno(), "inotify_add_watch failed for "+folder)
+      self.folders[wd] = folder
+      return
+
+   def wait(self, timeout):
+      import select
+      if not select.select([self.fd], [], [], timeout)[0]:
+         return set()
+      changed = set()
+      try:
+         while True:
+            data = os.read(self.fd, 65536)
+            position = 0
+            while position < len(data):
+               wd, _, _, length = self._event.unpack_from(data, position)
+               position += self._event.size + length
+               if wd in self.folders:
+                  changed.add(self.folders[wd])
+      except BlockingIOError:
+         pass
+      return changed
+
+   def close(self):
+      os.close(self.fd)
+      return
+
+
+class job_monitor:
+   """
+   Live monitor of many running calculations (one run_tracker per folder), e.g. after pyVASP.submit_job.
+
+   poll() waits for outputs to change (with inotify where available, otherwise it only compares the size and
+   modification time of OSZICAR and OUTCAR), reads the new lines and returns the run_status of every folder:
+   progress, the electronic-step rate, the time until the current electronic loop converges (from the
+   decrease of |dE| towards EDIFF, at most NELM steps) and whether the run is diverging, sloshing, stuck at
+   NELM or stalled (no output for stall_time s, if given). watch() polls until every run is finished or
+   failed, optionally cancelling failed runs (see cancel_jobs).
+   NELM and EDIFF are read from the INCAR of each folder (NELM and EDIFF are the fallbacks).
+   """
+
+   def __init__(self, folders, NELM=None, EDIFF=None, window=10, stall_time=None, use_inotify=True,
+                verbose="normal"):
+
+      self.trackers = {os.path.abspath(folder): run_tracker(folder, NELM, EDIFF, window, stall_time)
+                       for folder in folders}
+      self.verbose  = verbose
+
+      self.watcher = None
+      if use_inotify:
+         try:
+            self.watcher = inotify_watcher()
+         except OSError:
+            self.watcher = None
+      self.watched = set()
+
+      return
+
+   def __enter__(self):
+      return self
+
+   def __exit__(self, *args):
+      self.close()
+      return False
+
+   def close(self):
+      if self.watcher is not None:
+         self.watcher.close()
+         self.watcher = None
+      return
+
+   ###############################################################################
+   # functionalities
+   def poll(self, timeout=0):
+      """
+      Waits up to timeout seconds for a change (only with inotify; otherwise it returns at once),
+      updates every folder and returns a dict with the run_status of each.
+      """
+      if self.watcher is not None:
+         for folder in self.trackers:
+            if folder not in self.watched and os.path.isdir(folder):
+               try:
+                  self.watcher.add(folder)
+                  self.watched.add(folder)
+               except OSError:
+                  pass
+         if timeout > 0:
+            self.watcher.wait(timeout)
+      # trackers only read files whose size or modification time changed
+      now = time.time()
+      return {folder: tracker.update(now) for folder, tracker in self.trackers.items()}
+
+   def get_statuses(self):
+      return {folder: tracker.status for folder, tracker in self.trackers.items()}
+
+   def get_failed(self):
+      return [folder for folder, status in self.get_statuses().items() if status.failed]
+
+   def is_done(self):
+      return all(status.state == "finished" or status.failed for status in self.get_statuses().values())
+
+   def watch(self, poll_interval=10, timeout=None, callback=None, cancel_failed=False):
+      """
+      Polls every poll_interval seconds (or as soon as an output changes, with inotify) until every run is
+      finished or failed, or timeout seconds passed. callback(statuses) is called after every poll.
+      With cancel_failed, the Slurm jobs of failed runs are cancelled as soon as they are flagged.
+      Returns the last statuses.
+      """
+      start = time.monotonic()
+      cancelled = set()
+      while True:
+         statuses = self.poll(timeout=poll_interval if self.watcher is not None else 0)
+         if callback is not None:
+            callback(statuses)
+         elif self.verbose == "high":
+            print(self.summary())
+
+         failed = [folder for folder, status in statuses.items() if status.failed and folder not in cancelled]
+         for folder in failed:
+            if self.verbose != "low":
+               print("WARNING: "+folder+" is "+statuses[folder].state+": "+statuses[folder].message)
+         if cancel_failed and failed:
+            cancel_jobs(failed, verbose=self.verbose)
+         cancelled.update(failed)
+
+         if self.is_done() or (timeout is not None and time.monotonic() - start > timeout):
+            return statuses
+         if self.watcher is None:
+            time.sleep(poll_interval)
+
+   def summary(self):
+      lines = ["{:<50} {:>11} {:>6} {:>6} {:>10} {:>9} {:>9}".format("folder", "state", "ionic", "elec", "dE",
+                                                                    "steps/s", "ETA [s]")]
+      for folder, status in self.get_statuses().items():
+         lines.append("{:<50} {:>11} {:>6d} {:>6d} {:>10.2e} {:>9} {:>9}".format(
+            folder[-50:], status.state, status.ionic_steps, status.electronic_steps, status.dE,
+            "-" if status.rate is None else "{:.3g}".format(status.rate),
+            "-" if status.eta is None else "{:.0f}".format(status.eta)))
+      return "\n".join(lines)
+
+
+def get_array_tasks(job_id):
+   """
+   Array job id and task indices of a squeue job id: "1234_5" (running task) or "1234_[6-8,10%2]" (pending tasks).
+   None for a job that is not an array task.
+   """
+   array_id, _, tasks = job_id.partition("_")
+   if not tasks:
+      return None
+   indices = []
+   for part in tasks.strip("[]").split("%")[0].split(","):
+      first, _, last = part.partition("-")
+      if not first.isdigit() or not (last or first).isdigit():
+         return None
+      indices.extend(range(int(first), int(last or first) + 1))
+   return array_id, indices
+
+
+def get_slurm_jobs():
+   """
+   Job ids of the Slurm jobs of the user, by working directory (from squeue).
+   None if squeue failed (e.g. the controller did not answer): which jobs are queued is then unknown.
+   Tasks of job arrays (see pyVASP.submit_array_job) are found in their own folder, through the index file of
+   their submit folder (ARRAY_INDEX_FILE), with job ids such as "1234_5". The job steps of packed jobs
+   run in one allocation, found only in their submit folder.
+   """
+   import subprocess
+   process = subprocess.run(["squeue", "--me", "--noheader", "--format=%i %Z"], capture_output=True, text=True)
+   if process.returncode != 0:
+      return None
+   jobs = {}
+   indices = {}
+   for line in process.stdout.splitlines():
+      job_id, _, folder = line.strip().partition(" ")
+      if not folder:
+         continue
+      tasks = get_array_tasks(job_id)
+      if tasks is not None:
+         if folder not in indices:
+            try:
+               with open(os.path.join(folder, ARRAY_INDEX_FILE)) as f:
+                  indices[folder] = f.read().splitlines()
+            except OSError:
+               indices[folder] = []
+         array_id, task_indices = tasks
+         if all(task < len(indices[folder]) for task in task_indices):
+            for task in task_indices:
+               jobs.setdefault(os.path.abspath(indices[folder][task]), []).append(array_id + "_" + str(task))
+            continue
+      jobs.setdefault(os.path.abspath(folder), []).append(job_id)
+   return jobs
+
+
+def cancel_jobs(folders, verbose="normal"):
+   """
+   Cancels (scancel) the Slurm jobs running in folders: jobs of pyVASP.submit_job and tasks of job arrays.
+   The runs of a packed job are steps of a single allocation and are not cancelled one by one (see get_slurm_jobs).
+   Returns the job ids cancelled.
+   """
+   import subprocess
+   jobs = get_slurm_jobs()
+   if jobs is None:
+      raise RuntimeError("squeue failed: the jobs in "+", ".join(folders)+" were not cancelled")
+   job_ids = [job_id for folder in folders for job_id in jobs.get(os.path.abspath(folder), [])]
+   if verbose != "low":
+      missing = [folder for folder in folders if os.path.abspath(folder) not in jobs]
+      if missing:
+         print("WARNING: no Slurm job of its own found for "+", ".join(missing)+" (e.g. runs of packed jobs), not cancelled")
+   if job_ids:
+      subprocess.run(["scancel"] + job_ids, check=False)
+      if verbose != "low":
+         print("Cancelled jobs "+", ".join(job_ids))
+   return job_ids
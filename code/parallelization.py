@@ -0,0 +1,211 @@
+import numpy as np
+from dataclasses import dataclass, fields
+
+@dataclass(frozen=True)
+class parallelization_plan:
+   ntasks:  int
+   nodes:   int
+   KPAR:    int
+   NCORE:   int
+   NPAR:    int
+   # NBANDS after VASP rounds it up to a multiple of NPAR (None if the band count is unknown)
+   number_of_bands: int = None
+   # predicted wall time and core-hours, relative units
+   time:       float = None
+   core_hours: float = None
+   # predicted memory per task, in MB (None if the number of plane waves is unknown)
+   memory:     float = None
+
+
+@dataclass(frozen=False)
+class cost_model:
+   """
+   Cost of a parallelization plan, in relative units:
+      time       = work / ntasks * exp( sum(weight * feature) )
+      core_hours = ntasks * time
+   The features are listed in get_features. The weights can be fitted to measured timings with fit.
+   """
+   kpoint_imbalance:  float = 1.0   # log of max k-points per k-group over the average
+   band_padding:      float = 1.0   # log of NBANDS rounded up to a multiple of NPAR over NBANDS
+   kpoint_groups:     float = 0.02  # log2(KPAR): replicated memory and setup per k-group
+   band_groups:       float = 0.04  # log2(NPAR): communication between band groups
+   core_groups:       float = 0.04  # log2(NCORE): communication inside a band group
+   core_band_balance: float = 0.02  # log2(NCORE/NPAR)**2: best with NCORE ~ NPAR ~ sqrt(tasks per k-group)
+   split_core_group:  float = 0.5   # 1 if a band group (NCORE tasks) does not fit in whole nodes
+   nodes:             float = 0.1   # log2(nodes): inter-node communication
+   work:              float = 1.0
+
+   def get_features(self, plan, number_of_kpoints, number_of_bands, ntasks_per_node):
+      kpoints_per_group = -(-number_of_kpoints // plan.KPAR)
+      features = {
+         "kpoint_imbalance" : np.log(kpoints_per_group * plan.KPAR / number_of_kpoints),
+         "band_padding"     : 0.0,
+         "kpoint_groups"    : np.log2(plan.KPAR),
+         "band_groups"      : np.log2(plan.NPAR),
+         "core_groups"      : np.log2(plan.NCORE),
+         "core_band_balance": np.log2(plan.NCORE / plan.NPAR)**2,
+         "split_core_group" : float(ntasks_per_node % plan.NCORE != 0 and plan.NCORE % ntasks_per_node != 0),
+         "nodes"            : np.log2(plan.nodes),
+      }
+      if number_of_bands is not None:
+         padded_bands = -(-number_of_bands // plan.NPAR) * plan.NPAR
+         features["band_padding"] = np.log(padded_bands / number_of_bands)
+      return features
+
+   def predict(self, plan, number_of_kpoints, number_of_bands, ntasks_per_node):
+      features = self.get_features(plan, number_of_kpoints, number_of_bands, ntasks_per_node)
+      exponent = sum(getattr(self, name) * value for name, value in features.items())
+      time = float(self.work / plan.ntasks * np.exp(exponent))
+      return time, time * plan.ntasks
+
+   def fit(self, history, ntasks_per_node):
+      """
+      Fits work and the weights to measured runs of similar calculations. history is a list of dicts
+      with ntasks, nodes, KPAR, NCORE, number_of_kpoints, number_of_bands (or None) and time (wall time).
+      """
+      names = [field.name for field in fields(self) if field.name != "work"]
+      rows, targets = [], []
+      for run in history:
+         ntasks = int(run["ntasks"])
+         plan = parallelization_plan(ntasks=ntasks, nodes=int(run["nodes"]), KPAR=int(run["KPAR"]),
+                                     NCORE=int(run["NCORE"]), NPAR=ntasks//int(run["KPAR"])//int(run["NCORE"]))
+         features = self.get_features(plan, int(run["number_of_kpoints"]), run.get("number_of_bands"), ntasks_per_node)
+         rows.append([1.0] + [features[name] for name in names])
+         targets.append(np.log(float(run["time"]) * ntasks))
+
+      solution = np.linalg.lstsq(np.array(rows), np.array(targets), rcond=None)[0]
+      self.work = float(np.exp(solution[0]))
+      for name, weight in zip(names, solution[1:]):
+         setattr(self, name, float(weight))
+      return self
+
+
+@dataclass(frozen=False)
+class memory_model:
+   """
+   Rough memory per task of a parallelization plan, in MB:
+      wavefunctions: bytes_per_coefficient * NBANDS * plane waves * spinors * k-points per k-group * wavefunction_copies,
+                     distributed over the tasks of the k-group
+      grids:         bytes_per_coefficient * grid_points_per_plane_wave * plane waves * density components * grid_copies,
+                     replicated in every k-group and distributed over its tasks
+      base:          code, projectors and buffers
+   so that large KPAR, which replicates the grids, is ruled out when memory is short.
+   """
+   bytes_per_coefficient:      float = 16.    # complex double
+   wavefunction_copies:        float = 3.     # wavefunctions and work arrays of the eigensolver
+   grid_points_per_plane_wave: float = 122.   # fine FFT grid of PREC = Accurate over the plane waves of the basis
+   grid_copies:                float = 10.    # densities, potentials and mixing history
+   base:                       float = 300.
+
+   def predict(self, plan, number_of_kpoints, number_of_bands, number_of_plane_waves, spinors=1):
+      tasks_per_group   = plan.ntasks // plan.KPAR
+      kpoints_per_group = -(-number_of_kpoints // plan.KPAR)
+      wavefunctions = self.bytes_per_coefficient * number_of_bands * number_of_plane_waves * spinors \
+                      * kpoints_per_group * self.wavefunction_copies / tasks_per_group
+      components = 4 if spinors == 2 else 2
+      grids = self.bytes_per_coefficient * self.grid_points_per_plane_wave * number_of_plane_waves * components \
+              * self.grid_copies / tasks_per_group
+      return float(self.base + (wavefunctions + grids) / 2**20)
+
+
+def get_number_of_plane_waves(volume, ENCUT):
+   """
+   Number of plane waves of the basis of a cell of volume (Angstrom^3) at ENCUT (eV), per k-point:
+   volume * G_cut^3 / (6 pi^2), with hbar^2 G_cut^2 / 2m = ENCUT.
+   """
+   G_cut = np.sqrt(float(ENCUT) / 3.80998212) # hbar^2/2m in eV Angstrom^2
+   return int(volume * G_cut**3 / (6 * np.pi**2))
+
+
+def get_memory_in_MB(memory):
+   """
+   Memory of a Slurm option (e.g. mem_per_cpu = "3GB", "3000M" or "3000") in MB.
+   """
+   units = {"K": 2.**-10, "M": 1., "G": 2.**10, "T": 2.**20}
+   memory = str(memory).strip().upper().rstrip("B")
+   if memory[-1:] in units:
+      return float(memory[:-1]) * units[memory[-1]]
+   return float(memory)
+
+
+def get_default_NPAR(ntasks):
+   """
+   Divisor of ntasks closest to sqrt(ntasks) (trying below first): NPAR of a single k-group.
+   """
+   ntasks = int(ntasks)
+   NPAR0 = int(round(np.sqrt(ntasks)))
+   for shift in range(ntasks):
+      for NPAR in (NPAR0 - shift, NPAR0 + shift):
+         if 0 < NPAR <= ntasks and ntasks % NPAR == 0:
+            return NPAR
+   return 1
+
+
+def get_divisors(n):
+   return [d for d in range(1, n + 1) if n % d == 0]
+
+
+class parallelization_planner:
+   """
+   Enumerates the valid combinations of (nodes, ntasks, KPAR, NCORE, NPAR) and ranks them with a cost_model,
+   among those that fit in memory according to a memory_model.
+   """
+
+   def __init__(self, ntasks_per_node, model=None, memory=None):
+
+      self.ntasks_per_node = int(ntasks_per_node)
+      self.model  = cost_model() if model is None else model
+      self.memory = memory_model() if memory is None else memory
+
+      return
+
+   def get_ntasks_options(self, max_nodes):
+      """
+      Whole nodes up to max_nodes, and divisors of ntasks_per_node for jobs smaller than a node.
+      """
+      options = get_divisors(self.ntasks_per_node)
+      options += [self.ntasks_per_node * nodes for nodes in range(2, int(max_nodes) + 1)]
+      return options
+
+   def enumerate_plans(self, ntasks_options, number_of_kpoints, number_of_bands=None,
+                       number_of_plane_waves=None, spinors=1):
+      """
+      All valid plans, with their predicted time, core-hours and (if number_of_plane_waves and number_of_bands
+      are given) memory per task.
+      """
+      plans = []
+      for ntasks in ntasks_options:
+         ntasks = int(ntasks)
+         nodes = -(-ntasks // self.ntasks_per_node)
+         for KPAR in get_divisors(ntasks):
+            if KPAR > number_of_kpoints:
+               break
+            for NCORE in get_divisors(ntasks // KPAR):
+               NPAR = ntasks // KPAR // NCORE
+               if number_of_bands is not None and NPAR > number_of_bands:
+                  continue
+               plan = parallelization_plan(ntasks=ntasks, nodes=nodes, KPAR=KPAR, NCORE=NCORE, NPAR=NPAR)
+               time, core_hours = self.model.predict(plan, number_of_kpoints, number_of_bands, self.ntasks_per_node)
+               padded_bands = None if number_of_bands is None else -(-number_of_bands // NPAR) * NPAR
+               memory = None
+               if number_of_plane_waves is not None and padded_bands is not None:
+                  memory = self.memory.predict(plan, number_of_kpoints, padded_bands, number_of_plane_waves, spinors)
+               plans.append(parallelization_plan(ntasks=ntasks, nodes=nodes, KPAR=KPAR, NCORE=NCORE, NPAR=NPAR,
+                                                 number_of_bands=padded_bands, time=time, core_hours=core_hours,
+                                                 memory=memory))
+      return plans
+
+   def rank(self, plans, objective="core_hours", max_memory=None):
+      """
+      Plans sorted from best to worst by objective ("core_hours" or "time"), leaving out those predicted to
+      need more than max_memory MB per task. If none fits, only single k-group plans (KPAR = 1, which replicate
+      nothing) are kept.
+      """
+      if objective not in ("core_hours", "time"):
+         raise ValueError("objective should be 'core_hours' or 'time', not "+str(objective))
+      if max_memory is not None:
+         fitting = [plan for plan in plans if plan.memory is None or plan.memory <= max_memory]
+         if not fitting:
+            fitting = [plan for plan in plans if plan.KPAR == 1]
+         plans = fitting
+      return sorted(plans, key=lambda plan: (getattr(plan, objective), plan.ntasks, plan.NPAR))
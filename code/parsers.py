@@ -0,0 +1,213 @@
+import os
+import re
+import numpy as np
+
+# Fortran-style real numbers, e.g. -24.12345678, .12345678E+02, 0.26012E-03
+_number = rb"[-+]?(?:\d+\.?\d*|\.\d+)(?:[EeDd][-+]?\d+)?"
+_number_re = re.compile(_number)
+_key_value_re = re.compile(rb"(\w+(?: \w)?)\s*=\s*(" + _number + rb")")
+_electronic_re = re.compile(rb"^\s*[A-Z]{2,3}\s*:\s*\d+")
+_without_entropy_re = re.compile(rb"without\s+entropy\s*=\s*(" + _number + rb")\s+energy\(sigma->0\)\s*=\s*(" + _number + rb")")
+_penalty_re = re.compile(rb"E_p\s*=\s*(" + _number + rb")")
+_lambda_re = re.compile(rb"lambda\s*=\s*(" + _number + rb")")
+
+
+def _to_float(string):
+   return float(string.replace(b"D", b"E").replace(b"d", b"e"))
+
+def _numbers(line):
+   return [_to_float(number) for number in _number_re.findall(line)]
+
+def is_finished(OUTCAR_file):
+   """
+   True if OUTCAR_file ends with the timing summary VASP writes once a run is complete.
+   """
+   try:
+      with open(OUTCAR_file, "rb") as f:
+         f.seek(0, os.SEEK_END)
+         f.seek(max(f.tell() - 65536, 0))
+         return b"General timing and accounting" in f.read()
+   except OSError:
+      return False
+
+
+class output_parser:
+   """
+   Base class of the streaming parsers of VASP outputs.
+   Lines are read one by one, so memory does not depend on the file size.
+   offset is the byte offset right after the last ionic step returned: a parser created with
+   that offset (e.g. saved by a monitor) resumes there without re-reading the file.
+   An incomplete last line (file still being written) is left for the next read.
+   """
+
+   def __init__(self, file_name, offset=0, number_of_steps=0):
+      self.file_name       = file_name
+      self.offset          = offset
+      self.number_of_steps = number_of_steps
+      return
+
+   def __iter__(self):
+      return self.steps()
+
+   def steps(self):
+      """
+      Generator of the ionic steps completed after offset.
+      """
+      with open(self.file_name, "rb") as f:
+         f.seek(self.offset)
+         self.reset()
+         position = self.offset
+         for line in iter(f.readline, b""):
+            if not line.endswith(b"\n"):
+               break
+            position += len(line)
+            step = self.parse_line(line)
+            if step is not None:
+               self.offset = position
+               self.number_of_steps += 1
+               step["step"] = step.get("step", self.number_of_steps)
+               yield step
+      return
+
+   def read_new_steps(self):
+      """
+      List of the ionic steps written since the last call (or since offset).
+      """
+      return list(self.steps())
+
+   def reset(self):
+      return
+
+   def parse_line(self, line):
+      raise NotImplementedError
+
+
+class OSZICAR_parser(output_parser):
+   """
+   Streaming parser of OSZICAR. Each ionic step is a dict with the values of its ionic line
+   (step, F, E0, dE, mag, and T, E, EK, SP, SK for MD runs), plus
+   electronic_energies and electronic_dEs (arrays over the electronic steps).
+   """
+
+   def reset(self):
+      self._electronic_energies = []
+      self._electronic_dEs      = []
+      return
+
+   def parse_line(self, line):
+      if _electronic_re.match(line):
+         numbers = _numbers(line.split(b":", 1)[1])
+         # N, E, dE, d eps, ncg, rms, rms(c)
+         self._electronic_energies.append(numbers[1])
+         self._electronic_dEs.append(numbers[2])
+         return None
+
+      if b"F=" not in line:
+         return None
+
+      line, _, mag = line.partition(b"mag=")
+      number, line = line.split(None, 1)
+      step = {"step": int(number)}
+      for key, value in _key_value_re.findall(line):
+         step[key.decode().replace(" ", "")] = _to_float(value)
+      if mag:
+         moments = _numbers(mag)
+         step["mag"] = moments[0] if len(moments) == 1 else np.array(moments)
+
+      step["electronic_energies"] = np.array(self._electronic_energies)
+      step["electronic_dEs"]      = np.array(self._electronic_dEs)
+      self.reset()
+
+      return step
+
+   def get_pending_electronic_steps(self):
+      """
+      Energies and dEs of the electronic steps of the ionic step still running, as read by the last
+      call to steps() (they are read again from offset by the next one, as the ionic step is not complete).
+      """
+      if not hasattr(self, "_electronic_energies"):
+         self.reset()
+      return np.array(self._electronic_energies), np.array(self._electronic_dEs)
+
+
+class OUTCAR_parser(output_parser):
+   """
+   Streaming parser of OUTCAR. Each ionic step is a dict with
+   free_energy (TOTEN), energy (without entropy), energy_sigma_0, forces and positions (N, 3),
+   stress (XX YY ZZ XY YZ ZX, in kB), magnetization (total moment, 3 components for noncollinear runs),
+   and, for constrained moments, penalty_energy (E_p), LAMBDA and integrated_moments (MW_int, (N, 3)).
+   Values missing from the step (e.g. no stress with ISIF=0) are None.
+   """
+
+   def reset(self):
+      self._step = {"free_energy": None, "energy": None, "energy_sigma_0": None,
+                    "forces": None, "positions": None, "stress": None,
+                    "magnetization": None, "penalty_energy": None, "LAMBDA": None, "integrated_moments": None}
+      self._forces_block  = None
+      self._moments_block = None
+      self._final_energy  = False
+      return
+
+   def parse_line(self, line):
+      # inside POSITION / TOTAL-FORCE block
+      if self._forces_block is not None:
+         if line.strip().startswith(b"---"):
+            if self._forces_block:
+               block = np.array(self._forces_block)
+               self._step["positions"] = block[:, :3]
+               self._step["forces"]    = block[:, 3:6]
+               self._forces_block = None
+            return None
+         self._forces_block.append(_numbers(line))
+         return None
+
+      # inside the MW_int / M_int block of constrained moments (rows: ion, MW_int, M_int)
+      if self._moments_block is not None:
+         numbers = _numbers(line)
+         if len(numbers) >= 4:
+            self._moments_block.append(numbers[1:4])
+            return None
+         if not self._moments_block and not line.strip():
+            return None
+         if self._moments_block:
+            self._step["integrated_moments"] = np.array(self._moments_block)
+         # the line after the block is parsed as any other
+         self._moments_block = None
+
+      if b"TOTAL-FORCE" in line:
+         self._forces_block = []
+
+      elif line.lstrip().startswith(b"in kB"):
+         self._step["stress"] = np.array(_numbers(line)[:6])
+
+      elif b"number of electron" in line and b"magnetization" in line:
+         moments = _numbers(line.split(b"magnetization", 1)[1])
+         self._step["magnetization"] = moments[0] if len(moments) == 1 else np.array(moments)
+
+      elif b"MW_int" in line:
+         self._moments_block = []
+
+      elif b"E_p" in line:
+         match = _penalty_re.search(line)
+         if match:
+            self._step["penalty_energy"] = _to_float(match.group(1))
+         match = _lambda_re.search(line)
+         if match:
+            self._step["LAMBDA"] = _to_float(match.group(1))
+
+      elif b"FREE ENERGIE OF THE ION-ELECTRON SYSTEM" in line:
+         self._final_energy = True
+
+      elif self._final_energy and b"TOTEN" in line:
+         self._step["free_energy"] = _numbers(line.split(b"=", 1)[1])[0]
+
+      elif self._final_energy and b"without" in line:
+         match = _without_entropy_re.search(line)
+         if match:
+            self._step["energy"]         = _to_float(match.group(1))
+            self._step["energy_sigma_0"] = _to_float(match.group(2))
+         step = self._step
+         self.reset()
+         return step
+
+      return None
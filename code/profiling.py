@@ -0,0 +1,142 @@
+import json
+import time
+import threading
+from contextlib import contextmanager, nullcontext
+
+
+class null_profiler:
+   """
+   Profiler that records nothing, used when profiling is off:
+   every instrumented stage only costs a method call returning a shared null context.
+   """
+   enabled = False
+   _null_context = nullcontext()
+
+   def stage(self, name):
+      return self._null_context
+
+   def count(self, name, number=1):
+      return
+
+   def add_bytes(self, file_name, number_of_bytes):
+      return
+
+   def __deepcopy__(self, memo):
+      return self
+
+
+class profiler:
+   """
+   Timers and counters of the stages of pyVASP (see pyVASP.enable_profiling).
+
+   Stages are timed with the stage context manager and named by their nesting,
+   e.g. "set_calculation/write_inputs/write_POTCAR". For each one it keeps the number of calls
+   and the total time, and calls callback(name, seconds) when it ends. Bytes written are kept per
+   file name (e.g. all INCARs together). Results are available as a dict, a JSON file or a summary table.
+   With cprofile, the outermost stages run in the main thread are also profiled with cProfile
+   (see write_pstats).
+
+   A profiler is shared by the copies of a pyVASP object (e.g. the jobs of a campaign written
+   with threads), and is thread safe. Copies sent to other processes do not record anything.
+   """
+   enabled = True
+
+   def __init__(self, callback=None, cprofile=False):
+      self.callback = callback
+      self.cprofile = None
+      if cprofile:
+         import cProfile
+         self.cprofile = cProfile.Profile()
+      self._lock  = threading.Lock()
+      self._local = threading.local()
+      self.reset()
+      return
+
+   def __deepcopy__(self, memo):
+      return self
+
+   def __reduce__(self):
+      # copies sent to other processes (e.g. a campaign written with processes) record nothing
+      return (null_profiler, ())
+
+   def reset(self):
+      with self._lock:
+         self.stages        = {} # name: [calls, seconds]
+         self.counters      = {}
+         self.bytes_written = {}
+      return
+
+   ###############################################################################
+   # instrumentation
+   @contextmanager
+   def stage(self, name):
+      stack = getattr(self._local, "stack", None)
+      if stack is None:
+         stack = self._local.stack = []
+      stack.append(name)
+      full_name = "/".join(stack)
+      profile = self.cprofile is not None and len(stack) == 1 and threading.current_thread() is threading.main_thread()
+
+      if profile:
+         self.cprofile.enable()
+      start = time.perf_counter()
+      try:
+         yield
+      finally:
+         seconds = time.perf_counter() - start
+         if profile:
+            self.cprofile.disable()
+         stack.pop()
+         with self._lock:
+            entry = self.stages.setdefault(full_name, [0, 0.0])
+            entry[0] += 1
+            entry[1] += seconds
+         if self.callback is not None:
+            self.callback(full_name, seconds)
+
+   def count(self, name, number=1):
+      with self._lock:
+         self.counters[name] = self.counters.get(name, 0) + number
+      return
+
+   def add_bytes(self, file_name, number_of_bytes):
+      name = file_name.rstrip("/").rsplit("/", 1)[-1]
+      with self._lock:
+         self.bytes_written[name] = self.bytes_written.get(name, 0) + number_of_bytes
+      return
+
+   ###############################################################################
+   # outputs
+   def to_dict(self):
+      with self._lock:
+         return {"stages":        {name: {"calls": calls, "seconds": seconds} for name, (calls, seconds) in self.stages.items()},
+                 "counters":      dict(self.counters),
+                 "bytes_written": dict(self.bytes_written)}
+
+   def write_json(self, file_name):
+      with open(file_name, "w") as f:
+         json.dump(self.to_dict(), f, indent=1)
+      return
+
+   def write_pstats(self, file_name):
+      """
+      cProfile statistics of the profiled stages, readable with pstats.Stats(file_name).
+      """
+      if self.cprofile is None:
+         raise ValueError("cProfile is off: enable profiling with cprofile=True")
+      self.cprofile.dump_stats(file_name)
+      return
+
+   def summary(self):
+      data = self.to_dict()
+      lines = ["{:<60} {:>8} {:>12} {:>12}".format("stage", "calls", "total [s]", "mean [ms]")]
+      for name, entry in sorted(data["stages"].items()):
+         lines.append("{:<60} {:>8} {:>12.5f} {:>12.3f}".format(name, entry["calls"], entry["seconds"],
+                                                                1e3 * entry["seconds"] / entry["calls"]))
+      for name, number in data["counters"].items():
+         lines.append("{:<60} {:>8}".format(name, number))
+      if data["bytes_written"]:
+         lines.append("{:<60} {:>12}".format("file", "bytes"))
+         for name, number in data["bytes_written"].items():
+            lines.append("{:<60} {:>12}".format(name, number))
+      return "\n".join(lines)
@@ -0,0 +1,151 @@
+import os
+from dataclasses import dataclass
+
+# ioctl of Linux to clone a file (copy-on-write, on btrfs, XFS, ...)
+_FICLONE = 0x40049409
+
+
+@dataclass(frozen=True)
+class restart_step:
+   """
+   One calculation of a restart graph (see pyVASP.prepare_restarts): it runs in folder,
+   starting from the CHGCAR and WAVECAR of the calculation in parent.
+   """
+   folder:  str
+   parent:  str
+   LAMBDA:  str = None
+   kpoints: str = None
+
+
+def is_true(value):
+   """
+   Value of a logical INCAR tag (.TRUE., T, .FALSE., F, ...).
+   """
+   return str(value).strip().strip(".").upper().startswith("T")
+
+
+def reflink(source, target):
+   import fcntl
+   with open(source, "rb") as source_file, open(target, "wb") as target_file:
+      fcntl.ioctl(target_file.fileno(), _FICLONE, source_file.fileno())
+   return
+
+
+def copy_range(source, target):
+   """
+   Copy done by the kernel (os.copy_file_range), without going through user space;
+   some filesystems turn it into a reflink or a server-side copy.
+   """
+   with open(source, "rb") as source_file, open(target, "wb") as target_file:
+      remaining = os.fstat(source_file.fileno()).st_size
+      while remaining > 0:
+         copied = os.copy_file_range(source_file.fileno(), target_file.fileno(), remaining)
+         if copied == 0:
+            raise OSError("copy_file_range stopped before the end of "+source)
+         remaining -= copied
+   return
+
+
+def copy(source, target):
+   import shutil
+   shutil.copyfile(source, target)
+   return
+
+
+def hardlink(source, target):
+   os.link(source, target)
+   return
+
+
+def symlink(source, target):
+   os.symlink(os.path.abspath(source), target)
+   return
+
+
+def transfer_file(source, target, shared=False):
+   """
+   Makes target hold the content of source, as cheaply as possible. Returns the method used
+   ("hardlink", "symlink", "reflink", "copy_range" or "copy"), or None if source does not exist.
+
+   With shared, target may share its inode with source (hardlink, then symlink): only for files
+   that the calculation in target reads but does not rewrite, as VASP rewrites files in place and
+   would change source too. Otherwise target gets its own inode: reflink (copy-on-write), then a
+   kernel copy, then a plain copy.
+   """
+   if not os.path.exists(source):
+      return None
+   if os.path.lexists(target):
+      os.remove(target)
+
+   methods = [reflink, copy_range, copy]
+   if shared:
+      methods = [hardlink, symlink] + methods
+   for method in methods[:-1]:
+      try:
+         method(source, target)
+         return method.__name__
+      except (OSError, AttributeError):
+         # AttributeError: no os.copy_file_range or fcntl on this platform
+         if os.path.lexists(target):
+            os.remove(target)
+   methods[-1](source, target)
+   return methods[-1].__name__
+
+
+def update_INCAR_text(text, changes):
+   """
+   text of an INCAR with the tags in changes (a dict of tag: value) set to their new value,
+   or removed if the value is None, and the other lines untouched. Tags not yet in text are added at the end.
+   """
+   lines = text.splitlines(keepends=True)
+   remaining = dict(changes)
+   for i, line in enumerate(lines):
+      tag, equal, _ = line.partition("=")
+      tag = tag.strip()
+      if equal and tag in changes:
+         value = remaining.pop(tag, None)
+         lines[i] = "" if value is None else tag + "=" + str(value) + "\n"
+   lines = [line for line in lines if line]
+   if lines and not lines[-1].endswith("\n"):
+      lines[-1] += "\n"
+   lines += [tag + "=" + str(value) + "\n" for tag, value in remaining.items() if value is not None]
+   return "".join(lines)
+
+
+def read_INCAR_tags(text):
+   """
+   dict of tag: value of an INCAR with one tag per line (comments after ! or # are left out).
+   """
+   tags = {}
+   for line in text.splitlines():
+      tag, equal, value = line.partition("=")
+      tag = tag.strip()
+      if equal and tag and tag[0] not in "!#":
+         tags[tag] = value.split("!")[0].split("#")[0].strip()
+   return tags
+
+
+def get_INCAR_changes(old_text, new_text):
+   """
+   Changes (see update_INCAR_text) that turn the tags of the INCAR old_text into those of new_text:
+   the tags of new_text with another value or not in old_text, and None for the tags only in old_text.
+   """
+   old_tags, new_tags = read_INCAR_tags(old_text), read_INCAR_tags(new_text)
+   changes = {tag: value for tag, value in new_tags.items() if old_tags.get(tag) != value}
+   changes.update({tag: None for tag in old_tags if tag not in new_tags})
+   return changes
+
+
+def has_content(file_name, content):
+   """
+   True if file_name exists and holds exactly content (str or bytes).
+   """
+   if isinstance(content, str):
+      content = content.encode()
+   try:
+      if os.path.getsize(file_name) != len(content):
+         return False
+      with open(file_name, "rb") as f:
+         return f.read() == content
+   except OSError:
+      return False
@@ -0,0 +1,390 @@
+import os
+import re
+import glob
+import json
+import time
+import threading
+import numpy as np
+from math import gcd
+from functools import reduce
+from contextlib import contextmanager
+from pyVASP.code.parsers import OUTCAR_parser, OSZICAR_parser, is_finished
+
+# serializes the updates of stores by the threads of this process (flock serializes processes)
+_store_lock = threading.Lock()
+
+# columns kept for every row in the index of the store, and usable as query conditions
+INDEX_COLUMNS = ("folder", "composition", "LAMBDA", "m", "betah", "kpoints", "fingerprint", "source")
+
+_duration_re = re.compile(rb"Job duration:\s*([-+]?[\d.]+)\s*minutes")
+_LAMBDA_re   = re.compile(r"^\s*LAMBDA\s*=\s*([-+]?[\d.]+(?:[EeDd][-+]?\d+)?)", re.M)
+
+
+def get_source(folder):
+   """
+   Size and modification time of the outputs of folder, or None if it has no output yet.
+   A folder is only parsed again when its source changes.
+   """
+   source = []
+   for name in ["OSZICAR", "OUTCAR"]:
+      try:
+         stat = os.stat(os.path.join(folder, name))
+      except OSError:
+         continue
+      source.append(name+":"+str(stat.st_size)+":"+str(stat.st_mtime_ns))
+   return " ".join(source) if source else None
+
+
+def get_composition(species, counts):
+   """
+   Reduced composition, e.g. "Ga1Mn3N1" for species ["Ga", "Mn", "N"] and counts [2, 6, 2].
+   """
+   counts  = [int(count) for count in counts]
+   divisor = reduce(gcd, counts)
+   return "".join(element + str(count // divisor) for element, count in zip(species, counts))
+
+
+def read_inputs(folder):
+   """
+   composition (reduced, in POSCAR order, e.g. "Ga1Mn3N1"), number of atoms, LAMBDA and kpoints
+   of the inputs in folder, plus m, betah and the fingerprint (with io.skip_unchanged) recorded in its manifest.
+   """
+   row = {"composition": "", "number_of_atoms": np.nan, "LAMBDA": np.nan, "kpoints": "",
+          "m": np.nan, "betah": np.nan, "fingerprint": ""}
+   try:
+      with open(os.path.join(folder, "POSCAR")) as f:
+         lines = f.readlines()
+      species = lines[5].split()
+      counts  = [int(count) for count in lines[6].split()]
+      row["composition"]     = get_composition(species, counts)
+      row["number_of_atoms"] = sum(counts)
+   except (OSError, IndexError, ValueError):
+      pass
+   try:
+      with open(os.path.join(folder, "INCAR")) as f:
+         match = _LAMBDA_re.search(f.read())
+      if match is not None:
+         row["LAMBDA"] = float(match.group(1).replace("D", "E").replace("d", "e"))
+   except OSError:
+      pass
+   try:
+      with open(os.path.join(folder, "KPOINTS")) as f:
+         row["kpoints"] = f.readlines()[3].strip()
+   except (OSError, IndexError):
+      pass
+   try:
+      with open(os.path.join(folder, "pyVASP_manifest.json")) as f:
+         manifest = json.load(f)
+      row["m"]           = manifest.get("m", np.nan)
+      row["betah"]       = manifest.get("betah", np.nan)
+      row["fingerprint"] = manifest.get("inputs") or ""
+   except (OSError, ValueError):
+      pass
+   return row
+
+
+def read_duration(folder, out_file_name="out"):
+   """
+   Job duration (minutes) echoed at the end of the job script, searched in the Slurm outputs
+   of folder and in its out file. NaN if the job has not finished.
+   """
+   for file_name in sorted(glob.glob(os.path.join(folder, "slurm-*.out")), reverse=True) + [os.path.join(folder, out_file_name)]:
+      try:
+         with open(file_name, "rb") as f:
+            f.seek(0, os.SEEK_END)
+            f.seek(max(f.tell() - 4096, 0))
+            matches = _duration_re.findall(f.read())
+      except OSError:
+         continue
+      if matches:
+         return float(matches[-1])
+   return np.nan
+
+
+def read_results(folder, out_file_name="out"):
+   """
+   One row of the store for folder: its inputs (see read_inputs), the last ionic step of OSZICAR
+   (F, E0, mag) and OUTCAR (energies, penalty energy, forces, stress, magnetization), the number of
+   ionic and electronic steps, whether the run finished and the job duration.
+   None if folder has no output.
+   """
+   source = get_source(folder)
+   if source is None:
+      return None
+
+   row = {"folder": os.path.abspath(folder), "source": source}
+   row.update(read_inputs(folder))
+
+   OSZICAR_file = os.path.join(folder, "OSZICAR")
+   if os.path.exists(OSZICAR_file):
+      parser = OSZICAR_parser(OSZICAR_file)
+      step = {}
+      for step in parser:
+         pass
+      row["number_of_ionic_steps"]      = parser.number_of_steps
+      row["number_of_electronic_steps"] = len(step.get("electronic_energies", []))
+      row["F"]   = step.get("F", np.nan)
+      row["E0"]  = step.get("E0", np.nan)
+      row["mag"] = step.get("mag", np.nan)
+
+   OUTCAR_file = os.path.join(folder, "OUTCAR")
+   if os.path.exists(OUTCAR_file):
+      step = {}
+      for step in OUTCAR_parser(OUTCAR_file):
+         pass
+      for name in ["free_energy", "energy", "energy_sigma_0", "penalty_energy", "forces", "stress", "magnetization"]:
+         value = step.get(name)
+         row[name] = np.nan if value is None else value
+      row["finished"] = float(is_finished(OUTCAR_file))
+
+   row["duration"] = read_duration(folder, out_file_name)
+   return row
+
+
+def _match(values, condition):
+   """
+   Mask of the values matching condition: a (min, max) tuple, a list of allowed values,
+   or a single value (numbers are compared with np.isclose).
+   """
+   if isinstance(condition, tuple):
+      return (values >= condition[0]) & (values <= condition[1])
+   if isinstance(condition, list):
+      return np.logical_or.reduce([_match(values, value) for value in condition] + [np.zeros(len(values), bool)])
+   if values.dtype.kind in "fi":
+      return np.isclose(values, float(condition), rtol=1e-9, atol=1e-12)
+   return values == condition
+
+
+class results_store:
+   """
+   Append-only columnar store of parsed VASP outputs, one row per calculation folder.
+
+   Each ingestion appends one chunk (chunk_<n>.npz, never modified afterwards) and rewrites index.npz,
+   which holds the INDEX_COLUMNS of every row together with the chunk and row where the rest of it is.
+   Queries filter the index and then only load the requested columns of the chunks they need.
+   Array values (forces, stress, noncollinear magnetizations) are stored flattened per chunk,
+   with the offsets and number of columns of each row.
+
+   Folders whose outputs changed since they were ingested get a new row; by default queries return
+   the latest row of each folder.
+
+   Appending and compacting hold an exclusive lock on index.lock and reload the index first, so that
+   several ingesters (e.g. a monitor and a campaign, in other processes) can share a store.
+   """
+
+   def __init__(self, root, verbose="normal"):
+      if root[-1] != "/":
+         root += "/"
+      self.root       = root
+      self.index_file = root + "index.npz"
+      self.lock_file  = root + "index.lock"
+      self.verbose    = verbose
+      os.makedirs(root, exist_ok=True)
+      self.load_index()
+      return
+
+   def __len__(self):
+      return len(self.index["folder"])
+
+   ###############################################################################
+   # index
+   def load_index(self):
+      if os.path.exists(self.index_file):
+         with np.load(self.index_file) as f:
+            self.index = {name: f[name] for name in f.files}
+      else:
+         self.index = {name: np.array([], dtype=float if name in ("LAMBDA", "m", "betah") else str)
+                       for name in INDEX_COLUMNS}
+         self.index["chunk"] = np.array([], dtype=int)
+         self.index["row"]   = np.array([], dtype=int)
+      return
+
+   @contextmanager
+   def locked(self):
+      """
+      Exclusive lock of the store (flock of lock_file) with the index reloaded from disk,
+      for read-modify-write updates of the index. Other processes and threads wait for it.
+      """
+      with open(self.lock_file, "a") as f:
+         try:
+            import fcntl
+         except ImportError:
+            # no flock on this platform: only the threads of this process are serialized
+            fcntl = None
+         with _store_lock:
+            if fcntl is not None:
+               fcntl.flock(f.fileno(), fcntl.LOCK_EX)
+            try:
+               self.load_index()
+               yield
+            finally:
+               if fcntl is not None:
+                  fcntl.flock(f.fileno(), fcntl.LOCK_UN)
+      return
+
+   def save(self, file_name, columns):
+      """
+      Atomic np.savez of columns (a reader never sees a partial file).
+      """
+      tmp_file = file_name + "." + str(os.getpid()) + "." + str(threading.get_ident()) + ".tmp"
+      with open(tmp_file, "wb") as f:
+         np.savez(f, **columns)
+      os.replace(tmp_file, file_name)
+      return
+
+   def get_latest(self):
+      """
+      Mask of the latest row of each folder.
+      """
+      folders = self.index["folder"]
+      latest = np.zeros(len(folders), dtype=bool)
+      if len(folders):
+         _, last = np.unique(folders[::-1], return_index=True)
+         latest[len(folders) - 1 - last] = True
+      return latest
+
+   ###############################################################################
+   # ingestion
+   def ingest(self, folders, max_workers=None, executor="thread", out_file_name="out"):
+      """
+      Parses the folders whose outputs are new or changed since the last ingestion, through a pool of
+      threads (executor="thread") or processes (executor="process"), and appends them as one chunk.
+      Returns the number of rows added.
+      """
+      self.load_index()
+      sources = dict(zip(self.index["folder"][self.get_latest()].tolist(), self.index["source"][self.get_latest()].tolist()))
+      pending = []
+      for folder in folders:
+         source = get_source(folder)
+         if source is not None and sources.get(os.path.abspath(folder)) != source:
+            pending.append(folder)
+
+      # imported here, as it is slow to import and only needed to ingest
+      from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+      if executor == "thread":
+         pool = ThreadPoolExecutor(max_workers=max_workers)
+      elif executor == "process":
+         pool = ProcessPoolExecutor(max_workers=max_workers)
+      else:
+         raise ValueError("executor should be 'thread' or 'process', not "+str(executor))
+
+      start = time.perf_counter()
+      with pool:
+         rows = [row for row in pool.map(read_results, pending, [out_file_name]*len(pending)) if row is not None]
+      self.append(rows)
+
+      if self.verbose != "low":
+         print("Results store: "+str(len(rows))+" folders ingested in "+"{:.2f}".format(time.perf_counter() - start)
+               +" s ("+str(len(folders) - len(pending))+" unchanged or without outputs)")
+      return len(rows)
+
+   def append(self, rows):
+      """
+      Appends rows (dicts of column values, see read_results) as a new chunk.
+      """
+      if not rows:
+         return
+      with self.locked():
+         self.append_chunk(rows)
+      return
+
+   def append_chunk(self, rows):
+      chunk = int(self.index["chunk"].max()) + 1 if len(self) else 0
+
+      columns = {}
+      names = sorted(set().union(*rows))
+      for name in names:
+         values = [row.get(name) for row in rows]
+         if any(isinstance(value, np.ndarray) for value in values):
+            arrays = [np.atleast_1d(np.asarray(np.nan if value is None else value, dtype=float)) for value in values]
+            columns[name + ".values"]  = np.concatenate([array.ravel() for array in arrays])
+            columns[name + ".offsets"] = np.cumsum([0] + [array.size for array in arrays])
+            columns[name + ".columns"] = np.array([array.shape[1] if array.ndim == 2 else 0 for array in arrays])
+         elif any(isinstance(value, str) for value in values):
+            columns[name] = np.array(["" if value is None else value for value in values], dtype=str)
+         else:
+            columns[name] = np.array([np.nan if value is None else value for value in values], dtype=float)
+      self.save(self.root + "chunk_" + str(chunk).zfill(6) + ".npz", columns)
+
+      for name in INDEX_COLUMNS:
+         self.index[name] = np.concatenate([self.index[name], columns[name]])
+      self.index["chunk"] = np.concatenate([self.index["chunk"], np.full(len(rows), chunk)])
+      self.index["row"]   = np.concatenate([self.index["row"], np.arange(len(rows))])
+      self.save(self.index_file, self.index)
+      return
+
+   ###############################################################################
+   # queries
+   def query(self, columns=("E0",), latest=True, **conditions):
+      """
+      Rows matching all conditions on index columns, as a dict with the index columns and the requested
+      columns (arrays, or lists of arrays for array values). A condition is a value, a list of allowed values
+      or a (min, max) tuple, e.g. store.query(["E0", "mag"], composition="Ga1Mn3N1", LAMBDA=10, m=(0.2, 0.8)).
+      """
+      mask = self.get_latest() if latest else np.ones(len(self), dtype=bool)
+      for name, condition in conditions.items():
+         if name not in INDEX_COLUMNS:
+            raise ValueError("Queries can only filter on "+", ".join(INDEX_COLUMNS)+", not "+name)
+         mask &= _match(self.index[name], condition)
+      selection = np.nonzero(mask)[0]
+
+      result = {name: self.index[name][selection] for name in INDEX_COLUMNS}
+      # pieces of each column, as (positions in the result, values)
+      pieces = {name: [] for name in columns}
+      chunks = self.index["chunk"][selection]
+      for chunk in np.unique(chunks):
+         positions = np.nonzero(chunks == chunk)[0]
+         rows = self.index["row"][selection[positions]]
+         with np.load(self.root + "chunk_" + str(chunk).zfill(6) + ".npz") as f:
+            for name in columns:
+               if name in f.files:
+                  pieces[name].append( (positions, f[name][rows]) )
+               elif name + ".values" in f.files:
+                  flat, offsets, widths = f[name + ".values"], f[name + ".offsets"], f[name + ".columns"]
+                  arrays = [flat[offsets[row]:offsets[row+1]] for row in rows]
+                  arrays = [array.reshape(-1, widths[row]) if widths[row] else array for array, row in zip(arrays, rows)]
+                  pieces[name].append( (positions, arrays) )
+
+      for name in columns:
+         if all(isinstance(values, np.ndarray) for _, values in pieces[name]):
+            dtype = np.result_type(*[values for _, values in pieces[name]]) if pieces[name] else np.dtype(float)
+            column = np.full(len(selection), "" if dtype.kind == "U" else np.nan, dtype=dtype)
+            for positions, values in pieces[name]:
+               column[positions] = values
+         else:
+            column = [None]*len(selection)
+            for positions, values in pieces[name]:
+               for position, value in zip(positions, values):
+                  column[position] = value
+         result[name] = column
+      return result
+
+   def compact(self):
+      """
+      Merges all chunks into one, keeping only the latest row of each folder.
+      """
+      with self.locked():
+         if len(self):
+            self.compact_chunks()
+      return
+
+   def compact_chunks(self):
+      latest = self.get_latest()
+      names = set()
+      for chunk in np.unique(self.index["chunk"]):
+         with np.load(self.root + "chunk_" + str(chunk).zfill(6) + ".npz") as f:
+            names.update(name.rsplit(".", 1)[0] if name.endswith((".values", ".offsets", ".columns")) else name
+                         for name in f.files)
+      data = self.query(columns=sorted(names - set(INDEX_COLUMNS)), latest=True)
+      rows = [{name: data[name][i] for name in data} for i in range(int(latest.sum()))]
+
+      old_chunks = [self.root + "chunk_" + str(chunk).zfill(6) + ".npz" for chunk in np.unique(self.index["chunk"])]
+      self.append_chunk(rows)
+      new_chunk = int(self.index["chunk"].max())
+      keep = self.index["chunk"] == new_chunk
+      for name in self.index:
+         self.index[name] = self.index[name][keep]
+      self.save(self.index_file, self.index)
+      for file_name in old_chunks:
+         os.remove(file_name)
+      return
@@ -0,0 +1,81 @@
+import os
+import time
+from dataclasses import dataclass
+
+@dataclass(frozen=True)
+class job_result:
+   cwd:        str
+   command:    str
+   returncode: int
+   wall_time:  float # in seconds
+   out_file:   str
+   err_file:   str = None
+
+
+def run_command(command, cwd, out_file=None, err_file=None):
+   """
+   Runs command (through the shell) in cwd, with stdout written to out_file as it comes, and stderr
+   (e.g. errors of mpirun or srun) to err_file: by default out_file + ".err", so that they do not end up in
+   the output that is parsed. err_file = out_file merges both explicitly.
+   Blocks until it finishes and returns its job_result.
+   """
+   import subprocess
+   start = time.perf_counter()
+   if out_file is None:
+      process = subprocess.run(command, shell=True, cwd=cwd)
+   else:
+      if err_file is None:
+         err_file = out_file + ".err"
+      with open(out_file, "w") as out:
+         if err_file == out_file:
+            process = subprocess.run(command, shell=True, cwd=cwd, stdout=out, stderr=subprocess.STDOUT)
+         else:
+            with open(err_file, "w") as err:
+               process = subprocess.run(command, shell=True, cwd=cwd, stdout=out, stderr=err)
+   return job_result(cwd, command, process.returncode, time.perf_counter() - start, out_file, err_file)
+
+
+class job_runner:
+   """
+   Runs many calculations at the same time on the local machine,
+   with at most max_jobs of them running at once.
+   Each job runs in its own working directory (passed as cwd, the one of
+   the python process is never changed), and submit returns at once with a
+   concurrent.futures.Future of its job_result.
+   """
+
+   def __init__(self, max_jobs=1):
+
+      from concurrent.futures import ThreadPoolExecutor
+      self.max_jobs = max_jobs
+      self.pool     = ThreadPoolExecutor(max_workers=max_jobs)
+      self.futures  = []
+
+      return
+
+   def __enter__(self):
+      return self
+
+   def __exit__(self, *args):
+      self.shutdown()
+      return False
+
+   ###############################################################################
+   # functionalities
+
+   def submit(self, command, cwd, out_file=None, err_file=None):
+      if not os.path.isdir(cwd):
+         raise FileNotFoundError("Working directory does not exist: "+cwd)
+      future = self.pool.submit(run_command, command, cwd, out_file, err_file)
+      self.futures.append(future)
+      return future
+
+   def wait(self):
+      """
+      Waits for all submitted jobs and returns their job_results, in order of submission.
+      """
+      return [future.result() for future in self.futures]
+
+   def shutdown(self, wait=True):
+      self.pool.shutdown(wait=wait)
+      return
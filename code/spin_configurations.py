@@ -0,0 +1,232 @@
+import hashlib
+import numpy as np
+from pyVASP.code.symmetry import get_symmetry_permutations
+
+
+def _get_hash(canonical_form):
+   return hashlib.blake2b(np.asarray(canonical_form, dtype=np.int16).tobytes(), digest_size=16).digest()
+
+
+class spin_configurations:
+   """
+   Symmetry-inequivalent spin configurations of the magnetic sublattice of a structure.
+
+   Each magnetic site gets one of the directions (by default up and down along z, i.e. collinear;
+   pass e.g. the six +-x, +-y, +-z for noncollinear arrangements), scaled by its moment.
+   Spins are taken as decoupled from the lattice (no spin-orbit coupling): a space-group operation
+   only permutes the sites, and with time_reversal a configuration and the one with all spins reversed
+   are equivalent. counts optionally fixes how many sites point along each direction.
+
+   A configuration is an array with the index of the direction of each site, and its canonical form is
+   the lexicographically smallest of its images under the symmetry group.
+   enumerate() streams the configurations that are their own canonical form, building them site by site
+   and pruning every partial configuration that an operation already maps onto a smaller one, so that
+   neither the full set of configurations nor the ones already found are ever kept.
+   For supercells that are too large to enumerate, sample() draws random configurations and keeps
+   those whose hashed canonical form has not been seen yet.
+   """
+
+   def __init__(self, structure_ase, magnetic_sites=None, directions=None, counts=None,
+                time_reversal=True, symprec=1e-4):
+
+      self.number_of_atoms = len(structure_ase)
+
+      if magnetic_sites is None:
+         if not "magdirs" in structure_ase.arrays:
+            raise ValueError("Pass the magnetic_sites, or set magdirs (zero on non-magnetic sites)")
+         magnetic_sites = np.nonzero(np.linalg.norm(structure_ase.arrays["magdirs"], axis=1) > 0)[0]
+      self.magnetic_sites = np.asarray(magnetic_sites, dtype=int)
+      self.number_of_sites = len(self.magnetic_sites)
+
+      # moment of each site: the size of its magdir if given, otherwise 1
+      self.moments = np.ones(self.number_of_sites)
+      if "magdirs" in structure_ase.arrays:
+         sizes = np.linalg.norm(structure_ase.arrays["magdirs"][self.magnetic_sites], axis=1)
+         self.moments = np.where(sizes > 0, sizes, 1.0)
+
+      if directions is None:
+         directions = [[0, 0, 1], [0, 0, -1]]
+      self.directions = np.asarray(directions, dtype=float).reshape(-1, 3)
+      self.directions /= np.linalg.norm(self.directions, axis=1)[:,None]
+      number_of_directions = len(self.directions)
+
+      if counts is not None:
+         counts = np.asarray(counts, dtype=int)
+         if len(counts) != number_of_directions or counts.sum() != self.number_of_sites:
+            raise ValueError("counts should give, for each direction, its number of sites (adding up to "
+                             +str(self.number_of_sites)+")")
+      self.counts = counts
+
+      self.set_symmetry(structure_ase, time_reversal, symprec)
+
+      return
+
+   ###############################################################################
+   # symmetry
+   def set_symmetry(self, structure_ase, time_reversal=True, symprec=1e-4):
+      """
+      Permutations of the magnetic sites (only the operations that keep the magnetic sublattice and its moments),
+      with the relabelling of directions that goes with each one (time reversal maps each direction onto its opposite).
+      """
+      site_index = np.full(self.number_of_atoms, -1)
+      site_index[self.magnetic_sites] = np.arange(self.number_of_sites)
+
+      permutations = site_index[get_symmetry_permutations(structure_ase, symprec)[:, self.magnetic_sites]]
+      keep = np.all(permutations >= 0, axis=1)
+      keep[keep] = np.all(np.isclose(self.moments[permutations[keep]], self.moments), axis=1)
+      permutations = np.unique(permutations[keep], axis=0)
+
+      # relabelling of directions, with the unassigned value (number of directions) kept as it is
+      number_of_directions = len(self.directions)
+      relabellings = [np.arange(number_of_directions + 1)]
+      if time_reversal:
+         opposite = np.all(np.isclose(-self.directions[:,None], self.directions[None]), axis=2)
+         if np.all(opposite.any(axis=1)):
+            reversed_labels = np.append(opposite.argmax(axis=1), number_of_directions)
+            if self.counts is None or np.array_equal(self.counts[reversed_labels[:-1]], self.counts):
+               relabellings.append(reversed_labels)
+      relabellings = np.array(relabellings)
+
+      # operation g maps configuration c onto relabellings[g][c[inverse_permutations[g]]]
+      self.inverse_permutations = np.tile(np.argsort(permutations, axis=1), (len(relabellings), 1))
+      self.relabellings = np.repeat(relabellings, len(permutations), axis=0)
+      self.number_of_operations = len(self.inverse_permutations)
+
+      # the image of sites 0, ..., j-1 only depends on sites 0, ..., k-1 for j < determined[g, k]
+      largest_source = np.maximum.accumulate(self.inverse_permutations, axis=1)
+      self.determined = np.array([np.searchsorted(row, np.arange(self.number_of_sites + 1)) for row in largest_source])
+      return
+
+   def get_images(self, configuration, operations=None):
+      if operations is None:
+         operations = np.arange(self.number_of_operations)
+      sources = configuration[self.inverse_permutations[operations]]
+      return np.take_along_axis(self.relabellings[operations], sources, axis=1)
+
+   def get_canonical_form(self, configuration, chunk_size=4096):
+      """
+      Lexicographically smallest image of configuration under the symmetry group.
+      """
+      configuration = np.asarray(configuration)
+      canonical = configuration
+      for start in range(0, self.number_of_operations, chunk_size):
+         images = self.get_images(configuration, np.arange(start, min(start + chunk_size, self.number_of_operations)))
+         images = np.vstack([images, canonical[None]])
+         canonical = images[np.lexsort(images.T[::-1])[0]]
+      return canonical
+
+   def get_key(self, configuration):
+      """
+      Hash of the canonical form of configuration: equal for (and only for) equivalent configurations.
+      """
+      return _get_hash(self.get_canonical_form(configuration))
+
+   ###############################################################################
+   # configurations
+   def prune(self, configuration, number_of_assigned_sites, operations):
+      """
+      Operations that may still map configuration (of which the first sites are assigned) onto a smaller one,
+      or None if one of them already does (then no completion of configuration is canonical).
+      """
+      # only operations that map some of the assigned sites onto the first sites can decide anything
+      limits = self.determined[operations, number_of_assigned_sites]
+      checked = np.nonzero(limits > 0)[0]
+      if len(checked) == 0:
+         return operations
+      limits = limits[checked]
+      width  = limits.max()
+
+      sources = configuration[self.inverse_permutations[operations[checked], :width]]
+      images  = np.take_along_axis(self.relabellings[operations[checked]], sources, axis=1)
+      differ  = (images != configuration[:width]) & (np.arange(width) < limits[:,None])
+      decided = differ.any(axis=1)
+      first   = differ.argmax(axis=1)
+      if np.any(decided & (images[np.arange(len(checked)), first] < configuration[first])):
+         return None
+
+      keep = np.ones(len(operations), dtype=bool)
+      keep[checked[decided]] = False
+      return operations[keep]
+
+   def enumerate(self, max_configurations=None):
+      """
+      Generator of the symmetry-inequivalent configurations (their canonical forms), in lexicographic order.
+      """
+      number_of_sites      = self.number_of_sites
+      number_of_directions = len(self.directions)
+      unassigned = number_of_directions
+
+      configuration = np.full(number_of_sites, unassigned)
+      used = np.zeros(number_of_directions, dtype=int)
+      next_label = np.zeros(number_of_sites + 1, dtype=int)
+      operations = [np.arange(self.number_of_operations)] + [None]*number_of_sites
+      number_of_configurations = 0
+
+      site = 0
+      while site >= 0:
+         if site == number_of_sites:
+            yield configuration.copy()
+            number_of_configurations += 1
+            if max_configurations is not None and number_of_configurations >= max_configurations:
+               return
+            site -= 1
+            continue
+
+         # undo the current label of site, then try the next ones
+         if configuration[site] != unassigned:
+            used[configuration[site]] -= 1
+         label = next_label[site]
+         remaining = None
+         while label < number_of_directions:
+            if self.counts is None or used[label] < self.counts[label]:
+               configuration[site] = label
+               used[label] += 1
+               remaining = self.prune(configuration, site + 1, operations[site])
+               if remaining is not None:
+                  break
+               used[label] -= 1
+            label += 1
+
+         if remaining is None:
+            configuration[site] = unassigned
+            next_label[site] = 0
+            site -= 1
+         else:
+            next_label[site] = label + 1
+            operations[site + 1] = remaining
+            site += 1
+      return
+
+   def sample(self, number_of_configurations, rng, max_attempts=None):
+      """
+      Generator of up to number_of_configurations random inequivalent configurations (their canonical forms),
+      drawn with rng (a np.random.RandomState) and deduplicated by the hash of their canonical form.
+      Stops after max_attempts draws (by default 100 per configuration asked for).
+      """
+      if max_attempts is None:
+         max_attempts = 100 * number_of_configurations
+      if self.counts is not None:
+         labels = np.repeat(np.arange(len(self.directions)), self.counts)
+
+      seen = set()
+      for attempt in range(max_attempts):
+         if self.counts is None:
+            configuration = rng.randint(len(self.directions), size=self.number_of_sites)
+         else:
+            configuration = rng.permutation(labels)
+         canonical = self.get_canonical_form(configuration)
+         key = _get_hash(canonical)
+         if key not in seen:
+            seen.add(key)
+            yield canonical
+            if len(seen) == number_of_configurations:
+               return
+      return
+
+   def get_magdirs(self, configuration):
+      """
+      magdirs of all atoms (zero on non-magnetic sites) for configuration, ready to be set in the structure.
+      """
+      magdirs = np.zeros((self.number_of_atoms, 3))
+      magdirs[self.magnetic_sites] = self.directions[configuration] * self.moments[:,None]
+      return magdirs
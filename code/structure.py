@@ -1,12 +1,51 @@
+import numpy as np
+from pyVASP.code.symmetry import get_point_group
+
+# styles of the KPOINTS mesh: Monkhorst_Pack (off Gamma along even divisions) or Gamma (centred)
+KPOINTS_STYLES = ("Monkhorst_Pack", "Gamma")
+
+
+def get_kpoints_mesh(lattice_vectors, density, reference_lattice_vectors=None):
+    """
+    Divisions along each reciprocal lattice vector b_i (with the factor 2 pi) for at least density
+    k-points per 1/Angstrom along each of them, i.e. max(1, ceil(density |b_i|)), as a KPOINTS string.
+
+    With reference_lattice_vectors (a cell of which lattice_vectors is a diagonal supercell, e.g. the
+    unit cell), the mesh of the reference cell is folded into the supercell: its divisions are divided
+    by the repetitions along each vector (rounded up). All supercells of the reference cell then get the
+    same density, and, for Gamma-centred meshes with divisions multiple of the repetitions, exactly the
+    same sampling as the reference cell.
+    """
+    lattice_vectors = np.asarray(lattice_vectors, dtype=float)
+    if reference_lattice_vectors is None:
+        reciprocal_lengths = 2*np.pi*np.linalg.norm(np.linalg.inv(lattice_vectors).T, axis=1)
+        # small tolerance so that exact products do not round up
+        return " ".join(str(max(1, int(np.ceil(density*b - 1e-8)))) for b in reciprocal_lengths)
+
+    repetitions = lattice_vectors @ np.linalg.inv(np.asarray(reference_lattice_vectors, dtype=float))
+    if not np.allclose(repetitions, np.diag(np.round(np.diag(repetitions))), atol=1e-6):
+        raise ValueError("lattice_vectors should be a diagonal supercell of reference_lattice_vectors")
+    repetitions = np.round(np.diag(repetitions)).astype(int)
+    reference_mesh = [int(n) for n in get_kpoints_mesh(reference_lattice_vectors, density).split()]
+    return " ".join(str(max(1, -(-n // repetition))) for n, repetition in zip(reference_mesh, repetitions))
+
+
 class structure:
     """
     Class to set properties of the crystal structure.
+
+    kpoints is the mesh written in KPOINTS ("n1 n2 n3"), either set directly or computed from
+    kpoints_density (see set_kpoints_density) every time lattice_vectors change, so that it follows
+    supercells. kpoints_style is Monkhorst_Pack or Gamma, and with explicit_kpoints the irreducible
+    k-points of the mesh are written in KPOINTS with their weights instead of the mesh.
+    With symprec set, the point group (rotations) of each structure is found (see set_symmetry) and used
+    to count the irreducible k-points; otherwise only time-reversal symmetry is used.
     """
 
     def __init__(self, verbose):
 
         self.verbose = verbose
-        
+
         ###############################################################################
         # Set default inputs
 
@@ -14,9 +53,21 @@ class structure:
         self._kpoints  = "12 12 12"
         self._species  = [] # all species (without repetition)
         self._elements = [] # all atoms
+        self._lattice_vectors = None
+
+        # k-point mesh
+        self.kpoints_style     = "Monkhorst_Pack"
+        self.kpoints_shift     = "0 0 0"
+        self.explicit_kpoints  = False
+        self.kpoints_density   = None # k-points per 1/Angstrom, see set_kpoints_density
+        self.kpoints_reference = None # lattice vectors of the reference cell of supercells
+
+        # symmetry (off by default)
+        self.symprec   = None
+        self.rotations = None # point group, integer matrices acting on fractional coordinates
 
         return
-    
+
 ###############################################################################
     # main methods
 
@@ -28,7 +79,18 @@ class structure:
         return self._kpoints
     @kpoints.setter
     def kpoints(self, new_val):
+        # a mesh set by hand replaces the density
         self._kpoints = new_val
+        self.kpoints_density = None
+
+    @property
+    def lattice_vectors(self):
+        return self._lattice_vectors
+    @lattice_vectors.setter
+    def lattice_vectors(self, new_val):
+        self._lattice_vectors = new_val
+        if self.kpoints_density is not None:
+            self.update_kpoints()
 
     @property
     def species(self):
@@ -45,4 +107,100 @@ class structure:
         self._elements = new_val
 
     ###############################################################################
-    # functionalities
\ No newline at end of file
+    # functionalities
+
+    def set_kpoints_density(self, density, style=None, reference_lattice_vectors=None):
+        """
+        Computes kpoints from density (k-points per 1/Angstrom, see get_kpoints_mesh) for the current and
+        every later structure. style is Monkhorst_Pack or Gamma (Gamma-centred meshes are the ones that
+        fold consistently between supercells). reference_lattice_vectors: see get_kpoints_mesh.
+        """
+        if style is not None:
+            if style not in KPOINTS_STYLES:
+                raise ValueError("style should be one of "+", ".join(KPOINTS_STYLES)+", not "+str(style))
+            self.kpoints_style = style
+        self.kpoints_density   = density
+        self.kpoints_reference = reference_lattice_vectors
+        if self.lattice_vectors is not None:
+            self.update_kpoints()
+        return
+
+    def update_kpoints(self):
+        self._kpoints = get_kpoints_mesh(self.lattice_vectors, self.kpoints_density, self.kpoints_reference)
+        if self.verbose == "high":
+            print("kpoints from a density of "+str(self.kpoints_density)+" / Angstrom^-1: "+self._kpoints)
+        return
+
+    def set_symmetry(self, structure_ase, magmoms=None):
+        """
+        Point group of structure_ase (if symprec is set), keeping only the operations that map every atom
+        onto one of the same element and magmom (moments are compared as labels, which is stricter than
+        magnetic symmetry: a conservative choice for counting k-points).
+        """
+        if self.symprec is None:
+            self.rotations = None
+            return
+        labels = structure_ase.numbers[:,None]
+        if magmoms is not None:
+            labels = np.column_stack([labels, np.round(np.asarray(magmoms, dtype=float).reshape(len(structure_ase), -1), 4)])
+        labels = np.unique(labels, axis=0, return_inverse=True)[1].ravel()
+        self.rotations = get_point_group(structure_ase, self.symprec, numbers=labels)
+        return
+
+    def get_kpoints_mesh(self):
+        return [int(n) for n in self.kpoints.split()[:3]]
+
+    def get_number_of_kpoints(self):
+        """
+        Number of k-points of the full mesh.
+        """
+        return int(np.prod(self.get_kpoints_mesh()))
+
+    def get_kpoints(self):
+        """
+        Fractional coordinates (in the reciprocal lattice) of the k-points of the full mesh, in [-1/2, 1/2),
+        as VASP generates them: Monkhorst_Pack meshes are off Gamma along even divisions.
+        """
+        mesh   = np.array(self.get_kpoints_mesh())
+        offset = np.array([float(shift) for shift in self.kpoints_shift.split()[:3]])
+        if self.kpoints_style == "Monkhorst_Pack":
+            offset = offset + 0.5 * (mesh % 2 == 0)
+        indices = np.stack(np.meshgrid(*[np.arange(n) for n in mesh], indexing="ij"), axis=-1).reshape(-1, 3)
+        kpoints = (indices + offset) / mesh
+        return kpoints - np.floor(kpoints + 0.5)
+
+    def get_irreducible_kpoints(self, time_reversal=True):
+        """
+        Irreducible k-points of the mesh under rotations (if set) and time reversal (k and -k equivalent),
+        as (fractional coordinates, integer weights). Rotations that do not map the mesh onto itself are ignored.
+        """
+        mesh    = np.array(self.get_kpoints_mesh())
+        offset  = np.array([float(shift) for shift in self.kpoints_shift.split()[:3]])
+        if self.kpoints_style == "Monkhorst_Pack":
+            offset = offset + 0.5 * (mesh % 2 == 0)
+        kpoints = self.get_kpoints()
+
+        # k-points transform with the transpose of the rotations (the inverse of R^-T is in the group too)
+        rotations = [np.eye(3, dtype=int)] if self.rotations is None else list(self.rotations)
+        if time_reversal:
+            rotations += [-rotation for rotation in rotations]
+
+        representatives = np.arange(len(kpoints))
+        for rotation in rotations:
+            positions = kpoints @ rotation * mesh - offset
+            indices   = np.round(positions)
+            if not np.allclose(positions, indices, atol=1e-6):
+                continue
+            indices = indices.astype(int) % mesh
+            images  = (indices[:,0]*mesh[1] + indices[:,1])*mesh[2] + indices[:,2]
+            representatives = np.minimum(representatives, images)
+
+        irreducible, weights = np.unique(representatives, return_counts=True)
+        return kpoints[irreducible], weights
+
+    def get_number_of_irreducible_kpoints(self, time_reversal=True):
+        """
+        Number of irreducible k-points of the mesh (see get_irreducible_kpoints). Without rotations, only
+        a mesh with a point with k = -k (e.g. Gamma) has a k-point that is its own pair.
+        """
+        return len(self.get_irreducible_kpoints(time_reversal)[1])
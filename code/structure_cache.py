@@ -0,0 +1,96 @@
+import json
+import hashlib
+import threading
+import numpy as np
+from collections import OrderedDict
+from dataclasses import dataclass
+
+# arrays of the ASE structure that the prepared structure depends on (betahs and magmoms are recomputed)
+MAGNETIC_ARRAYS = ("magdirs", "ms", "B_CONSTRs")
+
+
+@dataclass(frozen=True)
+class prepared_structure:
+   """
+   What the df setter of pyVASP computes from an ASE structure before sampling magmoms:
+   atoms is a copy of the structure with magdirs, ms, B_CONSTRs and betahs, table its sorted atom_table
+   (with magmoms still to be set, see atom_table.with_magmoms), and rotations its point group if it
+   does not depend on the sampled magmoms (no DLM sites) and symprec is set, otherwise None.
+   Shared by all the calls that hit the same cache entry, so none of it is modified.
+   """
+   atoms:     object
+   table:     object
+   rotations: object = None
+
+
+class structure_cache:
+   """
+   Thread-safe LRU cache of prepared_structure, keyed by get_key: a hash of the positions, cell, symbols
+   and magnetic arrays of the ASE structure, and of the settings the preparation depends on.
+   Holds at most max_size structures (0 turns it off), evicting the least recently used one.
+
+   By default all pyVASP objects of a process share one cache (shared_structure_cache); copies of a
+   pyVASP object (e.g. the jobs of a campaign) keep sharing it, and copies sent to other processes
+   start with an empty one.
+   """
+
+   def __init__(self, max_size=32):
+      self.max_size = max_size
+      self._lock    = threading.Lock()
+      self.clear()
+      return
+
+   def __deepcopy__(self, memo):
+      return self
+
+   def __reduce__(self):
+      return (structure_cache, (self.max_size,))
+
+   def __len__(self):
+      return len(self._entries)
+
+   def clear(self):
+      with self._lock:
+         self._entries = OrderedDict()
+         self.hits     = 0
+         self.misses   = 0
+      return
+
+   def get_key(self, structure_ase, settings):
+      """
+      blake2b of the atoms of structure_ase (symbols, positions, cell and MAGNETIC_ARRAYS) and of settings
+      (e.g. the defaults and DLM type of magnetism), which should have a stable str.
+      """
+      key = hashlib.blake2b(digest_size=16)
+      key.update(json.dumps(settings, default=str).encode())
+      key.update(np.ascontiguousarray(structure_ase.numbers, dtype=np.int64).tobytes())
+      key.update(np.ascontiguousarray(structure_ase.positions, dtype=float).tobytes())
+      key.update(np.ascontiguousarray(structure_ase.cell.array, dtype=float).tobytes())
+      for name in MAGNETIC_ARRAYS:
+         if name in structure_ase.arrays:
+            key.update(name.encode())
+            key.update(np.ascontiguousarray(structure_ase.arrays[name], dtype=float).tobytes())
+      return key.digest()
+
+   def get(self, key):
+      with self._lock:
+         entry = self._entries.get(key)
+         if entry is None:
+            self.misses += 1
+         else:
+            self.hits += 1
+            self._entries.move_to_end(key)
+         return entry
+
+   def put(self, key, entry):
+      if self.max_size <= 0:
+         return
+      with self._lock:
+         self._entries[key] = entry
+         self._entries.move_to_end(key)
+         while len(self._entries) > self.max_size:
+            self._entries.popitem(last=False)
+      return
+
+
+shared_structure_cache = structure_cache()
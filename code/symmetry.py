@@ -0,0 +1,84 @@
+import numpy as np
+from itertools import product
+
+
+def _get_operations(structure_ase, symprec=1e-4, numbers=None):
+   """
+   Rotations (integer matrices acting on fractional coordinates) that map structure_ase onto itself
+   with some translation, each with the atom permutation of one such operation, and the atom permutations
+   of the pure translations (those of a supercell). Atoms with different numbers (by default the atomic
+   numbers; e.g. pass labels of the magnetic moments too) are never mapped onto each other.
+
+   Rotations are the integer matrices with entries -1, 0, 1 that keep the metric of the cell
+   (enough for reduced cells), and positions are compared on a grid of symprec (in fractional
+   coordinates). For each rotation only one translation per class of the translation group is tried.
+   """
+   cell      = structure_ase.cell.array
+   positions = structure_ase.get_scaled_positions(wrap=True)
+   if numbers is None:
+      numbers = structure_ase.numbers
+   numbers = np.unique(numbers, return_inverse=True)[1].astype(np.int64)
+
+   metric = cell @ cell.T
+   candidates = np.array(list(product((-1, 0, 1), repeat=9))).reshape(-1, 3, 3)
+   transformed = np.einsum("rji,jk,rkl->ril", candidates, metric, candidates)
+   rotations = candidates[np.all(np.abs(transformed - metric) < 1e-3*np.abs(metric).max(), axis=(1, 2))]
+
+   grid = int(round(1/symprec))
+   def get_keys(scaled_positions):
+      indices = np.round((scaled_positions - np.floor(scaled_positions)) * grid).astype(np.int64) % grid
+      return ((numbers*grid + indices[:,0])*grid + indices[:,1])*grid + indices[:,2]
+
+   keys  = get_keys(positions)
+   order = np.argsort(keys)
+   sorted_keys = keys[order]
+   if np.any(sorted_keys[1:] == sorted_keys[:-1]):
+      raise ValueError("Two atoms of the same element are closer than symprec = "+str(symprec))
+
+   def get_permutation(rotation, translation):
+      image = get_keys(positions @ rotation.T + translation)
+      indices = np.minimum(np.searchsorted(sorted_keys, image), len(keys) - 1)
+      if not np.array_equal(sorted_keys[indices], image):
+         return None
+      return order[indices]
+
+   # atoms of the rarest element fix the candidate translations
+   elements, element_counts = np.unique(numbers, return_counts=True)
+   reference_atoms = np.nonzero(numbers == elements[element_counts.argmin()])[0]
+   origin = positions[reference_atoms[0]]
+
+   translations = [get_permutation(np.eye(3, dtype=int), positions[atom] - origin) for atom in reference_atoms]
+   translations = np.array([permutation for permutation in translations if permutation is not None])
+
+   # one reference atom per class of reference atoms related by a translation
+   representatives = np.unique(translations[:, reference_atoms].min(axis=0))
+
+   operations = []
+   for rotation in rotations:
+      for atom in representatives:
+         permutation = get_permutation(rotation, positions[atom] - rotation @ origin)
+         if permutation is not None:
+            operations.append( (rotation, permutation) )
+            break
+
+   return operations, translations
+
+
+def get_symmetry_permutations(structure_ase, symprec=1e-4, numbers=None):
+   """
+   Space-group operations of structure_ase (including the translations of a supercell),
+   as an array of atom permutations of shape (number of operations, number of atoms):
+   operation g takes atom i onto atom permutations[g, i]. See _get_operations for numbers.
+   """
+   operations, translations = _get_operations(structure_ase, symprec, numbers)
+   # (translation) after (rotation, translation to atom)
+   return np.concatenate([translations[:, permutation] for _, permutation in operations])
+
+
+def get_point_group(structure_ase, symprec=1e-4, numbers=None):
+   """
+   Rotations of the space group of structure_ase, as integer matrices acting on fractional coordinates,
+   of shape (number of rotations, 3, 3). See _get_operations for numbers.
+   """
+   operations, _ = _get_operations(structure_ase, symprec, numbers)
+   return np.array([rotation for rotation, _ in operations])
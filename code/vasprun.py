@@ -0,0 +1,189 @@
+import numpy as np
+
+# fields that can be extracted, and the element holding each of them:
+# (tag, name attribute or None, tag of the parent)
+CONTAINERS = {
+   "energies"      : ("energy",      None,            "calculation"),
+   "final_energy"  : ("energy",      None,            "calculation"),
+   "structures"    : ("structure",   None,            "calculation"),
+   "forces"        : ("varray",      "forces",        "calculation"),
+   "stress"        : ("varray",      "stress",        "calculation"),
+   "magnetization" : ("varray",      "magnetization", "calculation"),
+   "eigenvalues"   : ("eigenvalues", None,            "calculation"),
+   "dos"           : ("dos",         None,            "calculation"),
+   "efermi"        : ("dos",         None,            "calculation"),
+   "kpoints"       : ("kpoints",     None,            "modeling"),
+}
+# fields of which only the last occurrence is returned
+LAST_FIELDS = ("final_energy", "magnetization", "eigenvalues", "dos", "efermi", "kpoints")
+
+
+def _values(element):
+   """
+   All numbers in the <v>/<r> rows below element, as a flat array.
+   """
+   return np.array(" ".join(row.text for row in element.iter() if row.tag in ("v", "r")).split(), dtype=float)
+
+def _varray(element):
+   rows = [row.text.split() for row in element.iter("v")]
+   return np.array(rows, dtype=float)
+
+
+class vasprun_parser:
+   """
+   Selective parser of vasprun.xml based on xml.etree.iterparse.
+   Only the elements holding the requested fields are kept in memory, and only until
+   they are converted into arrays; everything else is dropped as soon as it is read,
+   so peak memory does not depend on the size of the file.
+
+   Available fields:
+   - energies:      dict of arrays over ionic steps (e_fr_energy, e_wo_entrp, e_0_energy)
+   - final_energy:  dict with the energies of the last ionic step
+   - structures:    dict with lattice_vectors (steps, 3, 3) and positions (steps, N, 3, fractional)
+   - forces:        (steps, N, 3), in eV/Angst
+   - stress:        (steps, 3, 3), in kB
+   - magnetization: per-ion moments of the last step, (N, 3) for noncollinear runs, (N,) otherwise
+   - eigenvalues:   (spins, kpoints, bands, 2): eigenvalues and occupations of the last step
+   - dos:           dict with efermi, energies (NEDOS), total and integrated (spins, NEDOS) of the last step
+   - efermi:        Fermi energy of the last step
+   - kpoints:       dict with kpoints (nkpoints, 3) and weights (nkpoints)
+   """
+
+   def __init__(self, file_name, fields=("final_energy",)):
+
+      self.file_name = file_name
+
+      unknown = [field for field in fields if field not in CONTAINERS]
+      if unknown:
+         raise ValueError("Unknown fields: "+str(unknown)+"\nAvailable fields are: "+str(list(CONTAINERS)))
+      self.fields = list(fields)
+
+      self.containers = {}
+      for field in self.fields:
+         self.containers.setdefault(CONTAINERS[field], []).append(field)
+
+      return
+
+   ###############################################################################
+   # functionalities
+
+   def parse(self):
+      """
+      Returns a dict with the requested fields (None if missing from the file).
+      """
+      collected = {field: [] for field in self.fields}
+
+      from xml.etree.ElementTree import iterparse
+
+      stack = []
+      capture = None # element being kept, with the fields it holds
+      for event, element in iterparse(self.file_name, events=("start", "end")):
+         if event == "start":
+            if capture is None and stack:
+               key = (element.tag, element.get("name") if element.tag == "varray" else None, stack[-1].tag)
+               if key in self.containers:
+                  capture = (element, self.containers[key])
+            stack.append(element)
+            continue
+
+         stack.pop()
+         if capture is not None:
+            if element is not capture[0]:
+               continue
+            for field in capture[1]:
+               collected[field].append(element)
+            self.extract(collected, capture[1])
+            capture = None
+
+         # drop what has been read (the parser reads ahead, so the element
+         # is the first remaining child of its parent rather than the last)
+         if stack:
+            stack[-1].remove(element)
+
+      return self.finalize(collected)
+
+   def extract(self, collected, fields):
+      """
+      Converts the element just collected for fields into arrays (so that the element can be freed).
+      """
+      for field in fields:
+         value = getattr(self, "get_"+field)(collected[field][-1])
+         if field in LAST_FIELDS:
+            collected[field] = [value]
+         else:
+            collected[field][-1] = value
+      return
+
+   def finalize(self, collected):
+      results = {}
+      for field, values in collected.items():
+         if not values:
+            results[field] = None
+         elif field in LAST_FIELDS:
+            results[field] = values[-1]
+         elif field in ("energies", "structures"):
+            results[field] = {key: np.array([value[key] for value in values]) for key in values[0]}
+         else:
+            results[field] = np.array(values)
+      return results
+
+   ###############
+   # fields
+   def get_energies(self, element):
+      return {i.get("name"): float(i.text) for i in element.iter("i")}
+
+   def get_final_energy(self, element):
+      return self.get_energies(element)
+
+   def get_structures(self, element):
+      structure = {}
+      for varray in element.iter("varray"):
+         if varray.get("name") == "basis":
+            structure["lattice_vectors"] = _varray(varray)
+         elif varray.get("name") == "positions":
+            structure["positions"] = _varray(varray)
+      return structure
+
+   def get_forces(self, element):
+      return _varray(element)
+
+   def get_stress(self, element):
+      return _varray(element)
+
+   def get_magnetization(self, element):
+      magnetization = _varray(element)
+      if magnetization.shape[1] == 1:
+         return magnetization.ravel()
+      return magnetization
+
+   def get_eigenvalues(self, element):
+      spins = [child for child in element.iter("set") if (child.get("comment") or "").startswith("spin")]
+      number_of_kpoints = len([child for child in spins[0] if child.tag == "set"])
+      values = _values(element)
+      return values.reshape(len(spins), number_of_kpoints, -1, 2)
+
+   def get_dos(self, element):
+      dos = {"efermi": self.get_efermi(element)}
+      total = element.find("total")
+      if total is not None:
+         spins = [child for child in total.iter("set") if (child.get("comment") or "").startswith("spin")]
+         values = _values(total).reshape(len(spins), -1, 3)
+         dos["energies"]   = values[0, :, 0]
+         dos["total"]      = values[:, :, 1]
+         dos["integrated"] = values[:, :, 2]
+      return dos
+
+   def get_efermi(self, element):
+      for i in element.iter("i"):
+         if i.get("name") == "efermi":
+            return float(i.text)
+      return None
+
+   def get_kpoints(self, element):
+      kpoints = {}
+      for varray in element.iter("varray"):
+         if varray.get("name") == "kpointlist":
+            kpoints["kpoints"] = _varray(varray)
+         elif varray.get("name") == "weights":
+            kpoints["weights"] = _varray(varray).ravel()
+      return kpoints
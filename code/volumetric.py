@@ -0,0 +1,212 @@
+import os
+import json
+import numpy as np
+
+class volumetric_data:
+   """
+   Volumetric data of VASP (CHGCAR, CHG, and similar files such as LOCPOT or PARCHG).
+
+   The grids are parsed in chunks straight into a memory-mapped .npy sidecar next to the file
+   (file_name + ".npy", with its metadata in file_name + ".npy.json"), so that the text file is never
+   held in memory and the next open only maps the sidecar. The sidecar is rebuilt when the
+   size or modification time of the file change.
+
+   data has shape (number of grids, NGX, NGY, NGZ): one grid for non-spin-polarized runs,
+   total and magnetization for ISPIN=2, and total plus magnetization x, y, z for noncollinear runs.
+   As in the files, values are density times cell volume.
+   """
+
+   def __init__(self, file_name, cache=True, chunk_lines=100000):
+
+      self.file_name   = file_name
+      self.chunk_lines = chunk_lines
+      self.sidecar     = file_name + ".npy"
+
+      if cache and self.sidecar_is_valid():
+         self.load_sidecar()
+      else:
+         self.parse(cache)
+
+      self.set_header()
+
+      return
+
+   ###############################################################################
+   # properties
+   @property
+   def grid(self):
+      return self.data.shape[1:]
+
+   @property
+   def total(self):
+      return self.data[0]
+
+   @property
+   def magnetization(self):
+      """
+      None, one grid (ISPIN=2) or three grids x, y, z (noncollinear).
+      """
+      if len(self.data) == 1:
+         return None
+      if len(self.data) == 2:
+         return self.data[1]
+      return self.data[1:]
+
+   ###############################################################################
+   # functionalities
+
+   def parse(self, cache=True):
+      """
+      Reads the file. self.texts keeps everything that is not a grid
+      (header, augmentation occupancies, ...): the file is
+      texts[0] + grid 0 + texts[1] + grid 1 + ... + texts[-1].
+      """
+      # first pass: layout of the file (where each grid starts), reading only non-grid lines
+      with open(self.file_name, "rb") as f:
+         header = []
+         for line in iter(f.readline, b""):
+            header.append(line)
+            if self.is_grid_line(header):
+               break
+         grid = tuple(int(n) for n in header[-1].split())
+         number_of_values = grid[0]*grid[1]*grid[2]
+
+         texts = [b"".join(header)]
+         offsets = [f.tell()]
+         self.values_per_line = len(f.readline().split())
+         f.seek(offsets[0])
+         number_of_lines = -(-number_of_values // self.values_per_line)
+
+         while True:
+            self.skip_lines(f, number_of_lines)
+            text = []
+            for line in iter(f.readline, b""):
+               text.append(line)
+               if tuple(line.split()) == tuple(str(n).encode() for n in grid):
+                  break
+            else:
+               texts.append(b"".join(text))
+               break
+            texts.append(b"".join(text))
+            offsets.append(f.tell())
+
+      self.texts = [text.decode() for text in texts]
+
+      # second pass: grids, chunk by chunk
+      shape = (len(offsets), grid[2], grid[1], grid[0])
+      if cache:
+         values = np.lib.format.open_memmap(self.sidecar, mode="w+", dtype=float, shape=shape)
+      else:
+         values = np.empty(shape)
+      flat = values.reshape(len(offsets), -1)
+
+      with open(self.file_name, "rb") as f:
+         for i, offset in enumerate(offsets):
+            f.seek(offset)
+            start = 0
+            while start < number_of_values:
+               lines = [f.readline() for n in range(min(self.chunk_lines, -(-(number_of_values-start) // self.values_per_line)))]
+               chunk = np.array(b"".join(lines).split(), dtype=float)
+               flat[i, start:start+len(chunk)] = chunk
+               start += len(chunk)
+
+      if cache:
+         values.flush()
+         self.write_sidecar_metadata()
+         del values
+         self.load_sidecar()
+      else:
+         # x runs fastest in the files
+         self.data = values.transpose(0, 3, 2, 1)
+
+      return
+
+   def is_grid_line(self, header):
+      """
+      True if the last line of header is the grid line (NGX NGY NGZ) that follows the positions.
+      """
+      if len(header) < 9 or header[-2].strip() != b"":
+         return False
+      words = header[-1].split()
+      return len(words) == 3 and all(word.isdigit() for word in words)
+
+   def skip_lines(self, f, number_of_lines):
+      for n in range(number_of_lines):
+         f.readline()
+      return
+
+   def set_header(self):
+      """
+      Structure of the header (POSCAR format).
+      """
+      lines = self.texts[0].splitlines()
+      scale = float(lines[1].split()[0])
+      self.lattice_vectors = scale * np.array([[float(x) for x in line.split()[:3]] for line in lines[2:5]])
+      if lines[5].split()[0].isdigit():
+         # VASP 4 format, without species
+         self.species = []
+         self.counts  = [int(n) for n in lines[5].split()]
+      else:
+         self.species = lines[5].split()
+         self.counts  = [int(n) for n in lines[6].split()]
+      return
+
+   ###############
+   # sidecar
+   def get_source_stamp(self):
+      stat = os.stat(self.file_name)
+      return [stat.st_size, stat.st_mtime_ns]
+
+   def sidecar_is_valid(self):
+      try:
+         with open(self.sidecar + ".json") as f:
+            metadata = json.load(f)
+      except (OSError, ValueError):
+         return False
+      return os.path.exists(self.sidecar) and metadata.get("source") == self.get_source_stamp()
+
+   def write_sidecar_metadata(self):
+      metadata = {"source": self.get_source_stamp(), "values_per_line": self.values_per_line, "texts": self.texts}
+      with open(self.sidecar + ".json", "w") as f:
+         json.dump(metadata, f)
+      return
+
+   def load_sidecar(self):
+      with open(self.sidecar + ".json") as f:
+         metadata = json.load(f)
+      self.values_per_line = metadata["values_per_line"]
+      self.texts = metadata["texts"]
+      # x runs fastest in the files
+      self.data = np.load(self.sidecar, mmap_mode="r").transpose(0, 3, 2, 1)
+      return
+
+   ###############
+   # writing
+   def write(self, file_name, data=None, chunk_lines=None):
+      """
+      Writes the file again with the grids in data (default: self.data), e.g. modified densities for a restart.
+      Everything else (header, augmentation occupancies) is kept as read.
+      """
+      if data is None:
+         data = self.data
+      data = np.asarray(data, dtype=float)
+      if data.shape != self.data.shape:
+         raise ValueError("data should have shape "+str(self.data.shape)+", not "+str(data.shape))
+      if chunk_lines is None:
+         chunk_lines = self.chunk_lines
+
+      chunk = chunk_lines * self.values_per_line
+      with open(file_name, "w") as f:
+         for i, grid in enumerate(data):
+            f.write(self.texts[i])
+            # x runs fastest in the files
+            flat = grid.transpose(2, 1, 0).ravel()
+            for start in range(0, len(flat), chunk):
+               values = flat[start:start+chunk]
+               full = len(values) // self.values_per_line * self.values_per_line
+               line_format = " %17.10E" * self.values_per_line + "\n"
+               f.write((line_format * (full // self.values_per_line)) % tuple(values[:full].tolist()))
+               if full < len(values):
+                  f.write((" %17.10E" * (len(values) - full) + "\n") % tuple(values[full:].tolist()))
+         f.write(self.texts[-1])
+      return
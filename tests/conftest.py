@@ -0,0 +1,88 @@
+import os
+import sys
+import types
+import importlib.util
+
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+DATA = os.path.join(os.path.dirname(os.path.abspath(__file__)), "data")
+
+# the package is imported as pyVASP (from pyVASP.code.io import io): if the checkout is not installed
+# nor in a folder named pyVASP on the path, it is registered under that name
+if importlib.util.find_spec("pyVASP") is None:
+   package = types.ModuleType("pyVASP")
+   package.__path__ = [ROOT]
+   sys.modules["pyVASP"] = package
+
+
+@pytest.fixture
+def data_file():
+   """
+   Path of a file of tests/data.
+   """
+   return lambda name: os.path.join(DATA, name)
+
+
+def make_Mn3GaN(repeat=(1, 1, 1)):
+   """
+   Antiperovskite Mn3GaN with the triangular (Gamma_5g) magnetic order, repeated.
+   """
+   import numpy as np
+   from ase.spacegroup import crystal
+   structure_ase = crystal(("Ga", "Mn", "N"), basis=[(0, 0, 0), (0, .5, .5), (.5, .5, .5)], spacegroup=221,
+                           cellpar=[3.9, 3.9, 3.9, 90, 90, 90]).repeat(repeat)
+   magdirs, ms = [], []
+   angle = 0.
+   for element in structure_ase.get_chemical_symbols():
+      if element == "Mn":
+         angle += 2*np.pi/3
+         magdirs.append([3*np.cos(angle), 3*np.sin(angle), 0])
+         ms.append(0.5)
+      else:
+         magdirs.append([0, 0, 0])
+         ms.append(1)
+   structure_ase.new_array("magdirs", magdirs, dtype=float)
+   structure_ase.new_array("ms", ms, dtype=float)
+   return structure_ase
+
+
+@pytest.fixture
+def Mn3GaN():
+   return make_Mn3GaN
+
+
+@pytest.fixture
+def potentials(tmp_path):
+   """
+   Folder of stand-in POTCARs (only their ZVAL) for Mn3GaN.
+   """
+   folder = tmp_path / "potentials"
+   for potential, ZVAL in [("Mn_pv", 13), ("Ga_d", 13), ("N", 5)]:
+      (folder / potential).mkdir(parents=True)
+      (folder / potential / "POTCAR").write_text("   POMASS =   1.000; ZVAL   =   "+str(ZVAL)+"    mass and valenz\n")
+   return str(folder)
+
+
+@pytest.fixture
+def vasp_factory(tmp_path, potentials):
+   """
+   Makes pyVASP objects working in tmp_path/name, with the stand-in POTCARs and a stand-in executable
+   (tmp_path/bin/vasp_ncl, with the given text).
+   """
+   from pyVASP.code.main import pyVASP
+
+   def make(name="job", executable_text="#!/bin/bash\n", **options):
+      bin_folder = tmp_path / "bin"
+      bin_folder.mkdir(exist_ok=True)
+      executable = bin_folder / "vasp_ncl"
+      executable.write_text(executable_text)
+      executable.chmod(0o755)
+      options.setdefault("verbose", "low")
+      options.setdefault("seed_mag", 42)
+      vasp = pyVASP(executable_path=str(bin_folder), potential_path=potentials, **options)
+      os.makedirs(tmp_path / name, exist_ok=True)
+      vasp.io.cwd = str(tmp_path / name)
+      return vasp
+
+   return make
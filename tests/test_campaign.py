@@ -0,0 +1,48 @@
+import os
+
+import pytest
+
+
+def test_grid_folder_names():
+   from pyVASP.code.campaign import grid, get_folder_value
+   assert get_folder_value("4 4  4") == "4x4x4"
+   assert get_folder_value("a/b") == "a-b"
+   variations = grid(kpoints=["4 4 4", "6 6 6"], INCAR__ENCUT=["400"])
+   assert [variation["folder"] for variation in variations] == ["kpoints_4x4x4_ENCUT_400", "kpoints_6x6x6_ENCUT_400"]
+   assert variations[0]["INCAR.ENCUT"] == "400"
+
+
+@pytest.mark.parametrize("executor", ["thread", "process"])
+def test_write_campaign(vasp_factory, Mn3GaN, tmp_path, monkeypatch, capsys, executor):
+   from pyVASP.code.campaign import grid
+   vasp = vasp_factory(verbose="normal")
+   cwd, template_cwd, ENCUT = os.getcwd(), vasp.io.cwd, vasp.io.INCAR.ENCUT
+
+   def chdir(path):
+      raise AssertionError("the campaign changed the working directory to "+str(path))
+   monkeypatch.setattr(os, "chdir", chdir)
+
+   jobs = vasp.write_campaign(Mn3GaN(), grid(kpoints=["2 2 2", "4 4 4"], INCAR__ENCUT=["400", "500"]),
+                              root=str(tmp_path / "campaign"), max_workers=2, executor=executor)
+
+   names = ["kpoints_2x2x2_ENCUT_400", "kpoints_2x2x2_ENCUT_500", "kpoints_4x4x4_ENCUT_400", "kpoints_4x4x4_ENCUT_500"]
+   assert sorted(os.listdir(tmp_path / "campaign")) == names
+   for name in names:
+      folder = tmp_path / "campaign" / name
+      assert "ENCUT="+name.split("_")[-1]+"\n" in (folder / "INCAR").read_text()
+      assert " ".join(name.split("_")[1].split("x")) in (folder / "KPOINTS").read_text()
+      for file_name in ("POSCAR", "POTCAR", "job"):
+         assert (folder / file_name).exists()
+
+   # neither the template nor the working directory are modified
+   assert os.getcwd() == cwd
+   assert vasp.io.cwd == template_cwd and vasp.io.INCAR.ENCUT == ENCUT
+
+   assert jobs.throughput > 0
+   assert "Campaign: 4 jobs written in" in capsys.readouterr().out
+
+
+def test_unknown_key(vasp_factory, Mn3GaN):
+   vasp = vasp_factory()
+   with pytest.raises(ValueError):
+      vasp.write_campaign(Mn3GaN(), [{"INCAR.NOT_A_TAG": "1"}])
@@ -0,0 +1,82 @@
+import os
+import json
+import stat
+
+# stand-in for VASP: E0 = natoms*(-5 + 3*exp(-ENCUT/60)), failing (without output) at ENCUT = 450
+VASP = """#!/usr/bin/env python3
+import math, re, sys
+ENCUT = float(re.search(r"ENCUT=(\\S+)", open("INCAR").read()).group(1))
+if ENCUT == 450:
+   sys.exit(1)
+natoms = sum(int(count) for count in open("POSCAR").readlines()[6].split())
+energy = natoms*(-5.0 + 3*math.exp(-ENCUT/60.0))
+print("   1 F= %.8E E0= %.8E  d E =0.0  mag=  0.1" % (energy, energy))
+open("OUTCAR", "w").write(" General timing and accounting informations for this job:\\n")
+"""
+# stand-ins for sbatch (runs the job at once) and squeue (no job left in the queue)
+SBATCH = """#!/bin/bash
+bash "$1" > /dev/null 2>&1
+echo 1234
+"""
+SQUEUE = """#!/bin/bash
+exit 0
+"""
+# stand-ins for sbatch (queues the job) and squeue (fails every other call, and runs the queued jobs otherwise)
+QUEUING_SBATCH = """#!/bin/bash
+echo "$PWD" >> "{queue}"
+echo 1234
+"""
+FAILING_SQUEUE = """#!/bin/bash
+echo call >> "{calls}"
+if (( $(wc -l < "{calls}") % 2 )); then echo "squeue: error: slurm_load_jobs error" >&2; exit 1; fi
+if [[ -f "{queue}" ]]; then
+   while read -r folder; do (cd "$folder" && bash job > /dev/null 2>&1); done < "{queue}"
+   rm "{queue}"
+fi
+exit 0
+"""
+VALUES = ["300", "350", "400", "450", "500", "550", "600"]
+
+
+def check_study(study):
+   # 450 failed: 400 -> 500 changes by 3.1 meV, 500 -> 550 by 0.4 meV
+   assert study.converged_value == "500"
+   assert [study.values[i] for i in sorted(study.failed)] == ["450"]
+   assert not os.path.exists(study.specs[-1].folder)
+   record = json.load(open(study.record_file))["Ga1Mn3N1"]["ENCUT"]
+   assert record["value"] == "500" and record["failed"] == ["450"]
+   assert sorted(record["energies"]) == ["300", "350", "400", "500", "550"]
+
+
+def test_ladder_skips_failed_values(vasp_factory, Mn3GaN, tmp_path):
+   vasp = vasp_factory(executable_text=VASP, command="")
+   study = vasp.converge(Mn3GaN(), "ENCUT", values=VALUES, tolerance=1e-3)
+   check_study(study)
+
+
+def write_slurm(tmp_path, monkeypatch, sbatch, squeue):
+   for name, text in [("sbatch", sbatch), ("squeue", squeue)]:
+      path = tmp_path / "bin" / name
+      path.write_text(text.format(queue=tmp_path / "queue", calls=tmp_path / "calls"))
+      path.chmod(path.stat().st_mode | stat.S_IXUSR)
+   monkeypatch.setenv("PATH", str(tmp_path / "bin") + os.pathsep + os.environ["PATH"])
+   return
+
+
+def test_submitted_ladder_does_not_wait_for_dead_jobs(vasp_factory, Mn3GaN, tmp_path, monkeypatch):
+   vasp = vasp_factory(executable_text=VASP, command="")
+   write_slurm(tmp_path, monkeypatch, SBATCH, SQUEUE)
+
+   study = vasp.converge(Mn3GaN(), "ENCUT", values=VALUES, tolerance=1e-3, batch_size=2,
+                         submit=True, poll_interval=0.01, timeout=30)
+   check_study(study)
+
+
+def test_submitted_ladder_waits_while_squeue_fails(vasp_factory, Mn3GaN, tmp_path, monkeypatch):
+   # while squeue fails, queued jobs are not taken for dead ones
+   vasp = vasp_factory(executable_text=VASP, command="")
+   write_slurm(tmp_path, monkeypatch, QUEUING_SBATCH, FAILING_SQUEUE)
+
+   study = vasp.converge(Mn3GaN(), "ENCUT", values=VALUES, tolerance=1e-3, batch_size=2,
+                         submit=True, poll_interval=0.01, timeout=30)
+   check_study(study)
@@ -0,0 +1,52 @@
+import os
+
+import numpy as np
+
+
+def read_MAGMOM(folder):
+   for line in open(os.path.join(folder, "INCAR")):
+      if line.startswith("MAGMOM"):
+         return line
+   raise AssertionError("no MAGMOM in "+folder)
+
+
+def test_ensemble_folders(vasp_factory, Mn3GaN):
+   vasp = vasp_factory()
+   folders = vasp.set_ensemble(Mn3GaN(), 4)
+
+   assert [os.path.basename(folder.rstrip("/")) for folder in folders] == ["snapshot_"+str(i) for i in range(4)]
+   assert len(set(read_MAGMOM(folder) for folder in folders)) == 4
+   assert vasp.ensemble_magmoms.shape == (4, 5, 3)
+   assert vasp.ensemble_seeds == [42, 43, 44, 45]
+   # the snapshots have their own generators: nothing else is sampled
+   assert vasp.magnetism.rng.random() == np.random.RandomState(42).random()
+
+   # structure files are written once, in their own folder, and linked
+   shared = os.path.join(vasp.io.cwd, "snapshot_shared")
+   for file_name in ("POSCAR", "KPOINTS", "POTCAR"):
+      assert not os.path.exists(os.path.join(vasp.io.cwd, file_name))
+      assert os.path.isfile(os.path.join(shared, file_name))
+      for folder in folders:
+         path = os.path.join(folder, file_name)
+         assert os.path.islink(path)
+         assert os.path.samefile(path, os.path.join(shared, file_name))
+   for folder in folders:
+      assert not os.path.islink(os.path.join(folder, "INCAR"))
+      assert os.path.isfile(os.path.join(folder, "job"))
+
+
+def test_ensemble_seeds(vasp_factory, Mn3GaN):
+   structure_ase = Mn3GaN()
+   vasp = vasp_factory("first")
+   vasp.set_ensemble(structure_ase, 3, seeds=[7, 8, 9])
+   again = vasp_factory("second", seed_mag=1)
+   again.set_ensemble(structure_ase, 3, seeds=[7, 8, 9])
+   assert np.array_equal(vasp.ensemble_magmoms, again.ensemble_magmoms)
+
+   # snapshot i is the single calculation with seed i
+   single = vasp_factory("single", seed_mag=8)
+   single.set_calculation(structure_ase)
+   assert np.allclose(single.df["magmoms"], vasp.ensemble_magmoms[1])
+   assert read_MAGMOM(single.io.cwd) == read_MAGMOM(os.path.join(vasp.io.cwd, "snapshot_1"))
+   # the structure is not modified
+   assert "magmoms" not in structure_ase.arrays
@@ -0,0 +1,44 @@
+import os
+import importlib.util
+import pytest
+
+from pyVASP.code.main import pyVASP
+
+BENCHMARKS = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "benchmarks")
+
+
+def load_benchmark(name):
+   spec = importlib.util.spec_from_file_location(name, os.path.join(BENCHMARKS, name + ".py"))
+   module = importlib.util.module_from_spec(spec)
+   spec.loader.exec_module(module)
+   return module
+
+
+def test_lazy_modules_are_not_imported():
+   bench_import = load_benchmark("bench_import")
+   times = bench_import.import_times("pyVASP.code.main")
+   assert "pyVASP.code.main" in times
+   assert [module for module in bench_import.LAZY_MODULES if module in times] == []
+
+
+def test_paths_are_checked_when_first_used(tmp_path, potentials, Mn3GaN):
+   executable_path = tmp_path / "bin"
+   executable_path.mkdir()
+   (executable_path / "vasp_ncl").write_text("#!/bin/bash\n")
+
+   # construction does not touch the paths
+   vasp = pyVASP(executable_path=str(executable_path), potential_path=str(tmp_path / "missing"), verbose="low")
+   vasp.io.cwd = str(tmp_path)
+   with pytest.raises(AssertionError, match="potential path"):
+      vasp.set_calculation(Mn3GaN())
+   vasp = pyVASP(executable_path=str(tmp_path / "missing"), potential_path=potentials, verbose="low")
+   with pytest.raises(AssertionError, match="executable"):
+      vasp.executable
+
+   # checked once, and again when set
+   vasp.executable_path = str(executable_path)
+   vasp.executable = "vasp_ncl"
+   assert vasp.executable == str(executable_path / "vasp_ncl")
+   vasp.potential_path = str(tmp_path / "missing")
+   with pytest.raises(AssertionError, match="potential path"):
+      vasp.potential_path
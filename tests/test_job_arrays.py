@@ -0,0 +1,166 @@
+import os
+import stat
+import subprocess
+import pytest
+
+from pyVASP.code.io import io
+from pyVASP.code.main import pyVASP
+
+# stand-ins for sbatch (records its call) and srun (drops its options)
+SBATCH = """#!/bin/bash
+echo "$PWD $@" >> "{log}"
+echo 1234
+"""
+SRUN = """#!/bin/bash
+while [[ $1 == --* ]]; do shift; done
+exec "$@"
+"""
+DUMMY_VASP = """#!/bin/bash
+echo "start $(date +%s.%N)" >> ../times
+sleep 0.2
+echo "done in $PWD"
+echo "end $(date +%s.%N)" >> ../times
+"""
+
+
+def write_executable(path, text):
+   path.write_text(text)
+   path.chmod(path.stat().st_mode | stat.S_IXUSR)
+   return str(path)
+
+
+@pytest.fixture
+def fake_slurm(tmp_path, monkeypatch):
+   bin_folder = tmp_path / "bin"
+   bin_folder.mkdir()
+   log = tmp_path / "sbatch.log"
+   write_executable(bin_folder / "sbatch", SBATCH.format(log=log))
+   write_executable(bin_folder / "srun", SRUN)
+   write_executable(bin_folder / "vasp_ncl", DUMMY_VASP)
+   monkeypatch.setenv("PATH", str(bin_folder) + os.pathsep + os.environ["PATH"])
+   return bin_folder, log
+
+
+@pytest.fixture
+def folders(tmp_path):
+   folders = []
+   for i in range(3):
+      folders.append(str(tmp_path / ("job folder_" + str(i))))
+      os.makedirs(folders[-1])
+   return folders
+
+
+def read_running(times_file):
+   """
+   Largest number of jobs running at once, from the start and end times written by DUMMY_VASP.
+   """
+   events = []
+   for line in open(times_file).read().splitlines():
+      kind, moment = line.split()
+      events.append((float(moment), 1 if kind == "start" else -1))
+   running = largest = 0
+   for _, change in sorted(events):
+      running += change
+      largest = max(largest, running)
+   return largest
+
+
+def test_array_job(fake_slurm, folders, tmp_path):
+   bin_folder, _ = fake_slurm
+   job_io = io(str(tmp_path))
+   job_io.command = ""
+   job_file = job_io.write_array_job(str(bin_folder / "vasp_ncl"), folders, max_simultaneous=2)
+   text = open(job_file).read()
+   assert "#SBATCH --array=0-2%2" in text
+   assert open(tmp_path / "job_array.index").read().splitlines() == [folder + "/" for folder in folders]
+
+   # each task runs in its folder (whose name has a space)
+   for task in range(len(folders)):
+      subprocess.run(["bash", job_file], check=True, cwd=str(tmp_path),
+                     env=dict(os.environ, SLURM_ARRAY_TASK_ID=str(task)), capture_output=True)
+   for folder in folders:
+      assert open(os.path.join(folder, "out")).read() == "done in " + folder + "\n"
+
+
+def test_packed_job(fake_slurm, folders, tmp_path):
+   bin_folder, _ = fake_slurm
+   job_io = io(str(tmp_path))
+   job_io.command = "srun"
+   job_file = job_io.write_packed_job(str(bin_folder / "vasp_ncl"), folders, ntasks_per_step=4, max_parallel_steps=2)
+   assert "#SBATCH --ntasks=8" in open(job_file).read()
+
+   subprocess.run(["bash", job_file], check=True, cwd=str(tmp_path), capture_output=True)
+   for folder in folders:
+      assert open(os.path.join(folder, "out")).read() == "done in " + folder + "\n"
+   assert read_running(tmp_path / "times") <= 2
+
+
+def test_empty_folders(tmp_path):
+   job_io = io(str(tmp_path))
+   with pytest.raises(ValueError):
+      job_io.write_array_job("vasp_ncl", [])
+   with pytest.raises(ValueError):
+      job_io.write_packed_job("vasp_ncl", [], ntasks_per_step=4, max_parallel_steps=2)
+
+
+@pytest.mark.parametrize("packed", [False, True])
+def test_submit_array_job(fake_slurm, folders, tmp_path, monkeypatch, packed):
+   bin_folder, log = fake_slurm
+   monkeypatch.chdir(tmp_path)
+   vasp = pyVASP(executable_path=str(bin_folder), potential_path=str(tmp_path), verbose="low")
+   job_file = vasp.submit_array_job(folders, max_simultaneous=2, packed=packed, ntasks_per_step=4)
+   assert os.path.basename(job_file) == ("job_packed" if packed else "job_array")
+   # a single sbatch call, from cwd
+   assert open(log).read().splitlines() == [str(tmp_path) + " " + job_file]
+
+   with pytest.raises(ValueError):
+      vasp.submit_array_job([], packed=packed)
+   assert len(open(log).read().splitlines()) == 1
+
+
+# stand-ins for squeue (lists the jobs of the file jobs) and scancel (records its call)
+SQUEUE = """#!/bin/bash
+cat "{jobs}"
+"""
+SCANCEL = """#!/bin/bash
+echo "$@" >> "{log}"
+"""
+
+
+@pytest.mark.parametrize("packed", [False, True])
+def test_cancel_jobs(fake_slurm, folders, tmp_path, monkeypatch, capsys, packed):
+   from pyVASP.code.monitor import get_slurm_jobs, cancel_jobs
+   bin_folder, _ = fake_slurm
+   jobs, log = tmp_path / "jobs", tmp_path / "scancel.log"
+   write_executable(bin_folder / "squeue", SQUEUE.format(jobs=jobs))
+   write_executable(bin_folder / "scancel", SCANCEL.format(log=log))
+   monkeypatch.chdir(tmp_path)
+   vasp = pyVASP(executable_path=str(bin_folder), potential_path=str(tmp_path), verbose="low")
+   vasp.submit_array_job(folders, max_simultaneous=2, packed=packed, ntasks_per_step=4)
+
+   # as squeue shows them: a running task and pending ones, or the packed job, plus a job of another folder
+   if packed:
+      jobs.write_text("1234 "+str(tmp_path)+"\n99 /elsewhere\n")
+   else:
+      jobs.write_text("1234_0 "+str(tmp_path)+"\n1234_[1-2%2] "+str(tmp_path)+"\n99 /elsewhere\n")
+   queued = get_slurm_jobs()
+   assert queued["/elsewhere"] == ["99"]
+
+   if packed:
+      # the runs are steps of one job, in the submit folder: not cancelled one by one
+      assert queued[str(tmp_path)] == ["1234"]
+      assert cancel_jobs([folders[1]]) == []
+      assert not log.exists()
+      assert "not cancelled" in capsys.readouterr().out
+   else:
+      assert [queued[folder] for folder in folders] == [["1234_0"], ["1234_1"], ["1234_2"]]
+      assert str(tmp_path) not in queued
+      assert cancel_jobs([folders[0], folders[2]], verbose="low") == ["1234_0", "1234_2"]
+      assert log.read_text() == "1234_0 1234_2\n"
+
+
+def test_array_tasks():
+   from pyVASP.code.monitor import get_array_tasks
+   assert get_array_tasks("1234") is None
+   assert get_array_tasks("1234_5") == ("1234", [5])
+   assert get_array_tasks("1234_[6-8,10%2]") == ("1234", [6, 7, 8, 10])
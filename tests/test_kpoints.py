@@ -0,0 +1,68 @@
+import numpy as np
+import pytest
+
+
+def make_structure(structure_ase, kpoints, style="Monkhorst_Pack", symprec=1e-4):
+   from pyVASP.code.structure import structure
+   cell = structure("low")
+   cell.symprec = symprec
+   cell.kpoints_style = style
+   cell.kpoints = kpoints
+   cell.lattice_vectors = structure_ase.cell.array
+   cell.set_symmetry(structure_ase)
+   return cell
+
+
+def test_mesh_from_density():
+   from pyVASP.code.structure import get_kpoints_mesh
+   # |b| = 2 pi / 3.9
+   assert get_kpoints_mesh(3.9*np.eye(3), 10) == "17 17 17"
+   assert get_kpoints_mesh(np.diag([3.9, 3.9, 7.8]), 10) == "17 17 9"
+   assert get_kpoints_mesh(np.diag([3.9, 3.9, 1000.]), 10) == "17 17 1"
+
+
+def test_supercells_follow_the_unit_cell(Mn3GaN, vasp_factory):
+   from pyVASP.code.structure import get_kpoints_mesh
+   unit = Mn3GaN().cell.array
+   assert get_kpoints_mesh(unit, 10, reference_lattice_vectors=unit) == "17 17 17"
+   assert get_kpoints_mesh(np.diag([2, 2, 1]) @ unit, 10, reference_lattice_vectors=unit) == "9 9 17"
+   assert get_kpoints_mesh(np.diag([4, 4, 4]) @ unit, 8, reference_lattice_vectors=unit) == "4 4 4"
+   with pytest.raises(ValueError):
+      get_kpoints_mesh(np.array([[1, 1, 0], [0, 1, 0], [0, 0, 1]]) @ unit, 10, reference_lattice_vectors=unit)
+
+   # through set_calculation, for every structure
+   vasp = vasp_factory()
+   vasp.structure.set_kpoints_density(10, "Gamma", reference_lattice_vectors=unit)
+   for repeat, mesh in [((1, 1, 1), "17 17 17"), ((2, 2, 1), "9 9 17"), ((1, 1, 3), "17 17 6")]:
+      vasp.set_calculation(Mn3GaN(repeat))
+      assert vasp.structure.kpoints == mesh
+      with open(vasp.io.KPOINTS_file) as f:
+         lines = f.read().splitlines()
+      assert lines[2] == "Gamma" and lines[3] == mesh
+
+   # a mesh set by hand switches the density off
+   vasp.structure.kpoints = "2 2 2"
+   vasp.set_calculation(Mn3GaN((2, 2, 2)))
+   assert vasp.structure.kpoints == "2 2 2"
+
+
+@pytest.mark.parametrize("kpoints, style, symprec, count", [
+   ("4 4 4", "Monkhorst_Pack", 1e-4, 4),   # (1/8 or 3/8)^3 up to permutations
+   ("4 4 4", "Gamma",          1e-4, 10),
+   ("4 4 4", "Monkhorst_Pack", None, 32),  # only k and -k
+   ("4 4 4", "Gamma",          None, 36),  # 8 points with k = -k, and 56 in pairs
+])
+def test_irreducible_kpoints_simple_cubic(kpoints, style, symprec, count):
+   from ase import Atoms
+   cell = make_structure(Atoms("Po", cell=3.35*np.eye(3), pbc=True), kpoints, style, symprec)
+   kpoints, weights = cell.get_irreducible_kpoints()
+   assert len(weights) == count == cell.get_number_of_irreducible_kpoints()
+   assert weights.sum() == 64
+
+
+def test_irreducible_kpoints_fcc():
+   from ase.build import bulk
+   # 29 k-points, as VASP gives for a Gamma-centred 8x8x8 mesh of fcc Cu
+   cell = make_structure(bulk("Cu", "fcc", a=3.61), "8 8 8", "Gamma")
+   assert cell.get_number_of_irreducible_kpoints() == 29
+   assert len(cell.rotations) == 48
@@ -0,0 +1,126 @@
+import os
+import json
+import stat
+
+# stand-in for VASP with constrained moments: the moments tilt out of their constrained directions by
+# arctan(20/LAMBDA), the penalty energy is LAMBDA times the squared perpendicular moments, and the
+# electronic loop takes 10 steps from a WAVECAR, 25 otherwise. The restart files found are logged.
+VASP = """#!/usr/bin/env python3
+import os, re
+import numpy as np
+INCAR = open("INCAR").read()
+LAMBDA = float(re.search(r"^LAMBDA=(\\S+)", INCAR, re.M).group(1))
+targets = np.array(re.search(r"^M_CONSTR=(.*)$", INCAR, re.M).group(1).split(), float).reshape(-1, 3)
+with open("restart_files", "w") as f:
+   f.write(" ".join(name for name in ["CHGCAR", "WAVECAR"] if os.path.exists(name)))
+
+angle = np.arctan(20.0 / LAMBDA)
+moments = np.zeros_like(targets)
+for i, target in enumerate(targets):
+   if np.linalg.norm(target) > 0:
+      direction = target / np.linalg.norm(target)
+      moments[i] = 2*(np.cos(angle)*direction + np.sin(angle)*np.array([0, 0, 1.]))
+penalty = LAMBDA * np.sum((2*np.sin(angle))**2 * (np.linalg.norm(targets, axis=1) > 0))
+
+with open("OSZICAR", "w") as f:
+   for i in range(10 if os.path.exists("WAVECAR") else 25):
+      f.write("DAV: %3d   -0.1E+02   -0.1E-0%d   0.1E+00  100   0.1E+00\\n" % (i + 1, min(i, 9)))
+   f.write("   1 F= -.10E+02 E0= -.10E+02  d E =-.1E-04  mag=     0.1 0.2 0.3\\n")
+with open("OUTCAR", "w") as f:
+   f.write("\\n E_p =  %.5E  lambda =  %.3E\\n" % (penalty, LAMBDA))
+   f.write("\\n ion             MW_int                 M_int\\n")
+   for i, moment in enumerate(moments):
+      f.write("%5d %8.3f %8.3f %8.3f %8.3f %8.3f %8.3f\\n" % ((i + 1,) + tuple(moment) + tuple(moment)))
+   f.write("\\n  FREE ENERGIE OF THE ION-ELECTRON SYSTEM (eV)\\n")
+   f.write("  free  energy   TOTEN  =       -10.0 eV\\n\\n  energy  without entropy=      -10.0  energy(sigma->0) =      -10.0\\n")
+   f.write(" General timing and accounting informations for this job:\\n")
+if not re.search(r"^LCHARG=\\.FALSE\\.", INCAR, re.M):
+   open("CHGCAR", "w").write("CHGCAR of LAMBDA = %g" % LAMBDA)
+if re.search(r"^LWAVE=\\.TRUE\\.", INCAR, re.M):
+   open("WAVECAR", "w").write("WAVECAR of LAMBDA = %g" % LAMBDA)
+"""
+# stand-ins for sbatch (runs the job script, its last argument, at once) and squeue (empty queue)
+SBATCH = """#!/bin/bash
+bash "${@: -1}" > /dev/null 2>&1
+echo 1234
+"""
+SQUEUE = """#!/bin/bash
+exit 0
+"""
+
+
+def make_template(vasp_factory, Mn3GaN, **options):
+   vasp = vasp_factory(executable_text=VASP, command="", **options)
+   vasp.prepare_bfields(I_CONSTRAINED_M="4", LAMBDA="1")
+   vasp.set_calculation(Mn3GaN())
+   return vasp
+
+
+def read(folder, file_name):
+   with open(os.path.join(folder, file_name)) as f:
+      return f.read()
+
+
+def check_ramp(vasp, ramp):
+   assert ramp.converged
+   assert ramp.steps[-1]["penalty_energy"] <= 1.0 and ramp.steps[-1]["max_deviation"] <= 2.0
+   assert [step["LAMBDA"] for step in ramp.steps] == sorted(step["LAMBDA"] for step in ramp.steps)
+
+   # every calculation, the first one included, leaves its CHGCAR and WAVECAR to the next one
+   for step in ramp.steps:
+      INCAR = read(step["folder"], "INCAR")
+      assert "LWAVE=.TRUE.\n" in INCAR and "LCHARG=.TRUE.\n" in INCAR
+   for step in ramp.steps[1:]:
+      assert read(step["folder"], "restart_files") == "CHGCAR WAVECAR"
+      assert step["electronic_steps"] == 10
+   assert ramp.steps[0]["electronic_steps"] == 25
+
+   # the template is left as it was
+   assert vasp.io.INCAR.LWAVE == ".FALSE." and vasp.io.INCAR_constr.LAMBDA == "1"
+   record = json.load(open(ramp.record_file))
+   assert record["converged"] and len(record["steps"]) == len(ramp.steps)
+
+
+def test_ramp(vasp_factory, Mn3GaN):
+   vasp = make_template(vasp_factory, Mn3GaN)
+   ramp = vasp.ramp_LAMBDA(target_penalty=1.0, max_deviation=2.0)
+   check_ramp(vasp, ramp)
+   assert ramp.folder == ramp.steps[-1]["folder"]
+
+   # run again: the steps already done are not run again
+   mtime = os.path.getmtime(ramp.folder + "OUTCAR")
+   again = vasp.ramp_LAMBDA(target_penalty=1.0, max_deviation=2.0)
+   assert again.folder == ramp.folder and os.path.getmtime(ramp.folder + "OUTCAR") == mtime
+
+
+def test_ramp_with_pyscript(vasp_factory, Mn3GaN):
+   vasp = make_template(vasp_factory, Mn3GaN, pyscript=True)
+   check_ramp(vasp, vasp.ramp_LAMBDA(target_penalty=1.0, max_deviation=2.0))
+
+
+def test_submitted_ramp(vasp_factory, Mn3GaN, tmp_path, monkeypatch):
+   vasp = make_template(vasp_factory, Mn3GaN)
+   for name, text in [("sbatch", SBATCH), ("squeue", SQUEUE)]:
+      path = tmp_path / "bin" / name
+      path.write_text(text)
+      path.chmod(path.stat().st_mode | stat.S_IXUSR)
+   monkeypatch.setenv("PATH", str(tmp_path / "bin") + os.pathsep + os.environ["PATH"])
+   check_ramp(vasp, vasp.ramp_LAMBDA(target_penalty=1.0, max_deviation=2.0, submit=True, poll_interval=0.01, timeout=30))
+
+
+def test_max_steps(vasp_factory, Mn3GaN):
+   vasp = make_template(vasp_factory, Mn3GaN)
+   ramp = vasp.ramp_LAMBDA(target_penalty=1e-6, max_steps=3)
+   assert not ramp.converged
+   assert len(ramp.steps) == 3
+
+
+def test_prepare_first_step(vasp_factory, Mn3GaN):
+   from pyVASP.code.lambda_ramp import lambda_ramp
+   vasp = make_template(vasp_factory, Mn3GaN)
+   INCAR, LCHARG = read(vasp.io.cwd, "INCAR"), vasp.io.INCAR.LCHARG
+   lambda_ramp(vasp).prepare_first_step()
+   # the INCAR is rewritten from the template, with the tags of RAMP_INCAR, and the template is left as it was
+   expected = INCAR.replace("LWAVE=.FALSE.\n", "LWAVE=.TRUE.\n").replace("LCHARG=.FALSE.\n", "LCHARG=.TRUE.\n")
+   assert read(vasp.io.cwd, "INCAR") == expected != INCAR
+   assert vasp.io.INCAR.LWAVE == ".FALSE." and vasp.io.INCAR.LCHARG == LCHARG
@@ -0,0 +1,112 @@
+import numpy as np
+import pytest
+
+
+def get_magmoms_loop(mag, structure_ase, number_of_atoms):
+   # site-by-site sampling that get_magmoms replaced, kept as reference
+   magmoms = []
+   for i in range(number_of_atoms):
+      this_m      = structure_ase.arrays["ms"][i]
+      this_betah  = structure_ase.arrays["betahs"][i]
+      this_magdir = structure_ase.arrays["magdirs"][i]
+
+      if this_m==1:
+         magmoms.append( this_magdir )
+
+      elif mag.DLM_type=="Heisenberg":
+         random_number = mag.rng.random()
+         theta = mag.get_theta_mag(random_number, this_betah)
+         phi   = mag.rng.random() * 2*np.pi
+
+         mod = np.linalg.norm( this_magdir )
+         mu = mod * np.array( [np.sin(theta)*np.cos(phi), np.sin(theta)*np.sin(phi), np.cos(theta)] )
+         magmoms.append( mag.rotate_magmom(mu, this_magdir) )
+
+      elif mag.DLM_type=="Ising":
+         random_number = mag.rng.random()
+         if random_number < 0.5*(this_m + 1):
+            magmoms.append( this_magdir )
+         else:
+            magmoms.append( -this_magdir )
+
+   return np.array(magmoms, dtype=float)
+
+
+def get_structure(number_of_atoms, ordered_sites):
+   from ase import Atoms
+   rng = np.random.RandomState(0)
+   structure_ase = Atoms("Fe"+str(number_of_atoms), positions=rng.random((number_of_atoms, 3)))
+   ms = rng.uniform(0, 0.9, number_of_atoms)
+   ms[::7] = 0
+   if ordered_sites:
+      ms[::3] = 1
+   structure_ase.new_array("magdirs", rng.normal(size=(number_of_atoms, 3)), dtype=float)
+   structure_ase.new_array("ms", ms, dtype=float)
+   return structure_ase
+
+
+@pytest.mark.parametrize("DLM_type", ["Heisenberg", "Ising"])
+@pytest.mark.parametrize("ordered_sites", [False, True])
+def test_get_magmoms_matches_loop(DLM_type, ordered_sites):
+   from pyVASP.code.magnetism import magnetism
+   number_of_atoms = 50
+   mag = magnetism(seed=1234, DLM_type=DLM_type)
+   structure_ase = mag.set_betahs_from_ms(get_structure(number_of_atoms, ordered_sites), number_of_atoms)
+
+   mag.rng = 1234
+   reference = get_magmoms_loop(mag, structure_ase, number_of_atoms)
+   mag.rng = 1234
+   magmoms = mag.set_magmoms(structure_ase, number_of_atoms).arrays["magmoms"]
+
+   assert magmoms.shape == (number_of_atoms, 3)
+   assert np.allclose(magmoms, reference, rtol=0, atol=1e-12)
+   # ordered sites keep their direction, and every moment its length
+   ordered = structure_ase.arrays["ms"] == 1
+   assert np.array_equal(magmoms[ordered], structure_ase.arrays["magdirs"][ordered])
+   assert np.allclose(np.linalg.norm(magmoms, axis=1), np.linalg.norm(structure_ase.arrays["magdirs"], axis=1))
+
+
+def test_ensemble_snapshots_match_single_draws():
+   from pyVASP.code.magnetism import magnetism
+   number_of_atoms = 20
+   mag = magnetism(seed=7)
+   structure_ase = mag.set_betahs_from_ms(get_structure(number_of_atoms, True), number_of_atoms)
+
+   magmoms, seeds = mag.get_magmoms_ensemble(structure_ase, number_of_atoms, 3)
+   assert seeds == [7, 8, 9]
+   for snapshot, seed in zip(magmoms, seeds):
+      mag.rng = seed
+      assert np.allclose(snapshot, get_magmoms_loop(mag, structure_ase, number_of_atoms), rtol=0, atol=1e-12)
+
+
+def get_betah_from_m_minimize(order_parameter, maximum_value_of_betah=1000, tolerance_of_order_parameter_for_inversion=1e-2):
+   # bounded search that get_betahs_from_ms replaced, kept as reference
+   from scipy.optimize import minimize_scalar
+   def f(x, order_parameter):
+      return ( 1 + x*( order_parameter-1/np.tanh(x) ) )**2
+
+   if abs(order_parameter) < tolerance_of_order_parameter_for_inversion:
+      return 3*order_parameter
+   if order_parameter > 0:
+      res = minimize_scalar(f, bounds=(0, maximum_value_of_betah), args=(order_parameter), method='bounded')
+   else:
+      res = minimize_scalar(f, bounds=(-maximum_value_of_betah, 0), args=(order_parameter), method='bounded')
+   return res.x
+
+
+def test_betahs_from_ms():
+   from pyVASP.code.magnetism import magnetism
+   mag = magnetism(seed=0)
+   ms = np.linspace(-0.999, 0.999, 1001)
+   betahs = mag.get_betahs_from_ms(ms)
+
+   reference = np.array([get_betah_from_m_minimize(m) for m in ms])
+   assert np.allclose(betahs, reference, rtol=3e-5, atol=0)
+
+   # solved values are exact inverses of the Langevin function
+   solved = np.abs(ms) >= 1e-2
+   x = betahs[solved]
+   assert np.all(np.abs(1/np.tanh(x) - 1/x - ms[solved]) < 1e-12)
+   # the linear limit below the tolerance
+   assert np.array_equal(betahs[~solved], 3*ms[~solved])
+   assert mag.get_betah_from_m(0.5) == mag.get_betahs_from_ms(np.array([0.5]))[0]
@@ -0,0 +1,65 @@
+import os
+import time
+
+
+def finish(folder):
+   """
+   Writes an OUTCAR as VASP leaves it after a complete run.
+   """
+   with open(os.path.join(folder, "OUTCAR"), "w") as f:
+      f.write(" General timing and accounting informations for this job:\n")
+   return
+
+
+def test_no_fingerprints_by_default(vasp_factory, Mn3GaN):
+   vasp = vasp_factory()
+   vasp.set_calculation(Mn3GaN())
+   assert os.path.exists(vasp.io.INCAR_file)
+   # only m and betah, for the results store
+   manifest = vasp.io.read_manifest()
+   assert manifest["m"] == 0.5 and manifest["betah"] > 0
+   assert manifest["inputs"] is None and "job" not in manifest
+
+   # a fingerprint recorded with skip_unchanged is dropped when the inputs are written without it
+   vasp.io.skip_unchanged = True
+   vasp.set_calculation(Mn3GaN())
+   assert vasp.io.read_manifest()["inputs"]
+   vasp.io.skip_unchanged = False
+   vasp.set_calculation(Mn3GaN())
+   assert vasp.io.read_manifest()["inputs"] is None
+
+
+def test_skip_unchanged(vasp_factory, Mn3GaN):
+   vasp = vasp_factory()
+   vasp.io.skip_unchanged = True
+   structure_ase = Mn3GaN()
+   vasp.set_calculation(structure_ase)
+   manifest = vasp.io.read_manifest()
+   assert manifest["inputs"] and manifest["job"]
+
+   # unchanged: left untouched
+   assert not vasp.io.write_inputs(vasp.potential_path, vasp.df, vasp.structure)
+   assert not vasp.io.write_job(vasp.executable)
+
+   # finished and unchanged: still skipped
+   finish(vasp.io.cwd)
+   assert not vasp.io.write_inputs(vasp.potential_path, vasp.df, vasp.structure)
+
+   # finished but changed: written again
+   vasp.io.INCAR.ENCUT = "650"
+   assert vasp.io.write_inputs(vasp.potential_path, vasp.df, vasp.structure)
+   assert "ENCUT=650\n" in open(vasp.io.INCAR_file).read()
+   assert vasp.io.read_manifest()["inputs"] != manifest["inputs"]
+
+
+def test_finished_with_current_inputs(vasp_factory, Mn3GaN):
+   vasp = vasp_factory()
+   vasp.set_calculation(Mn3GaN())
+   assert not vasp.io.is_finished_with_current_inputs()
+   finish(vasp.io.cwd)
+   assert vasp.io.is_finished_with_current_inputs()
+
+   # inputs rewritten after the run
+   later = time.time() + 10
+   os.utime(vasp.io.INCAR_file, (later, later))
+   assert not vasp.io.is_finished_with_current_inputs()
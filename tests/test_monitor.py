@@ -0,0 +1,105 @@
+import os
+import shutil
+import pytest
+
+from pyVASP.code.monitor import run_tracker, diagnose
+
+
+def read_lines(data_file, name):
+   with open(data_file(name), "rb") as f:
+      return f.readlines()
+
+
+def write(file_name, lines, mtime):
+   with open(file_name, "wb") as f:
+      f.write(b"".join(lines))
+   os.utime(file_name, (mtime, mtime))
+   return
+
+
+@pytest.fixture
+def folder(tmp_path):
+   (tmp_path / "INCAR").write_text("NELM=60\nEDIFF=1E-4\n")
+   return str(tmp_path)
+
+
+def replay(tracker, folder, lines, start=1000.0):
+   """
+   Writes OSZICAR one line at a time (one second apart), updating tracker after each. Returns the statuses.
+   """
+   statuses = []
+   for i in range(1, len(lines) + 1):
+      write(os.path.join(folder, "OSZICAR"), lines[:i], start + i)
+      statuses.append(tracker.update(now=start + i))
+   return statuses
+
+
+def test_replay_collinear_run(data_file, folder):
+   lines = read_lines(data_file, "OSZICAR_collinear")
+   tracker = run_tracker(folder)
+   assert tracker.update().state == "waiting"
+
+   statuses = replay(tracker, folder, lines)
+   assert [status.ionic_steps for status in statuses] == [0, 0, 0, 0, 0, 1, 1, 1, 1, 2]
+   assert [status.total_electronic_steps for status in statuses] == [0, 1, 2, 3, 4, 4, 5, 6, 7, 7]
+   assert statuses[3].state == "running" and statuses[3].electronic_steps == 3
+   assert statuses[3].rate == pytest.approx(1.0)
+   assert statuses[-1].energy == pytest.approx(-24.12)
+
+   shutil.copyfile(data_file("OUTCAR_collinear"), os.path.join(folder, "OUTCAR"))
+   assert tracker.update().state == "finished"
+
+
+def test_replaced_OSZICAR_is_read_again(data_file, folder):
+   lines = read_lines(data_file, "OSZICAR_collinear")
+   tracker = run_tracker(folder)
+   replay(tracker, folder, lines)
+   OSZICAR_file = os.path.join(folder, "OSZICAR")
+
+   # replaced by a new file (another inode), e.g. moved in by a new run
+   write(OSZICAR_file + ".new", lines[:7], 2000)
+   os.replace(OSZICAR_file + ".new", OSZICAR_file)
+   status = tracker.update(now=2000)
+   assert (status.ionic_steps, status.electronic_steps, status.total_electronic_steps) == (1, 1, 5)
+
+   # truncated in place
+   write(OSZICAR_file, lines[:3], 2001)
+   status = tracker.update(now=2001)
+   assert (status.ionic_steps, status.electronic_steps, status.total_electronic_steps) == (0, 2, 2)
+
+
+def test_rewritten_OSZICAR_is_read_again(data_file, folder):
+   lines = read_lines(data_file, "OSZICAR_collinear")
+   tracker = run_tracker(folder)
+   replay(tracker, folder, lines)
+
+   # rewritten in place by a new run, already longer than what was read: another first ionic step
+   # and five electronic steps of the second one
+   first_step = lines[5].replace(b"E0= -.24110000E+02", b"E0= -.24100000E+02")
+   new_lines  = lines[:5] + [first_step] + lines[6:9] + [lines[8], lines[8]]
+   assert len(b"".join(new_lines)) > len(b"".join(lines))
+   write(os.path.join(folder, "OSZICAR"), new_lines, 2000)
+   status = tracker.update(now=2000)
+   assert (status.ionic_steps, status.electronic_steps, status.total_electronic_steps) == (1, 5, 9)
+
+
+def test_diagnose():
+   assert diagnose([], 60, 1e-4) == ("running", None)
+   assert diagnose([1e-5], 60, 1e-4) == ("running", 0)
+   assert diagnose([1e-2]*60, 60, 1e-4)[0] == "unconverged"
+   # one decade per step, two more to go
+   state, remaining = diagnose([10.0**(-k) for k in range(8)], 60, 1e-9)
+   assert state == "running" and remaining in (2, 3)
+   assert diagnose([1e-3*1.5**k for k in range(20)], 60, 1e-4)[0] == "diverging"
+   assert diagnose([(-1)**k*1e-2 for k in range(20)], 60, 1e-4)[0] == "sloshing"
+
+
+def test_failing_squeue(tmp_path, monkeypatch):
+   from pyVASP.code.monitor import get_slurm_jobs, cancel_jobs
+   squeue = tmp_path / "squeue"
+   squeue.write_text("#!/bin/bash\necho '12 /some/folder'\nexit 1\n")
+   squeue.chmod(0o755)
+   monkeypatch.setenv("PATH", str(tmp_path) + os.pathsep + os.environ["PATH"])
+   assert get_slurm_jobs() is None
+   with pytest.raises(RuntimeError, match="squeue failed"):
+      cancel_jobs([str(tmp_path)], verbose="low")
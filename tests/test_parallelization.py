@@ -0,0 +1,64 @@
+import pytest
+
+from pyVASP.code.parallelization import (parallelization_planner, get_default_NPAR, get_memory_in_MB,
+                                         get_number_of_plane_waves)
+
+
+@pytest.mark.parametrize("ntasks, NPAR", [(40, 5), (16, 4), (36, 6), (7, 1), (1, 1), (80, 8)])
+def test_default_NPAR(ntasks, NPAR):
+   assert get_default_NPAR(ntasks) == NPAR
+
+
+@pytest.mark.parametrize("memory, MB", [("3GB", 3072), ("3000M", 3000), ("3000", 3000), ("2g", 2048), ("512KB", 0.5)])
+def test_memory_in_MB(memory, MB):
+   assert get_memory_in_MB(memory) == pytest.approx(MB)
+
+
+def test_memory_limits_KPAR():
+   planner = parallelization_planner(ntasks_per_node=40)
+   # 40-atom cell, noncollinear, 6x6x6 mesh
+   plane_waves = get_number_of_plane_waves(7.8**3, 500)
+   plans = planner.enumerate_plans([40], number_of_kpoints=112, number_of_bands=496,
+                                   number_of_plane_waves=plane_waves, spinors=2)
+   assert all(plan.KPAR * plan.NCORE * plan.NPAR == 40 for plan in plans)
+   # the replicated grids make the memory grow with KPAR
+   by_KPAR = {plan.KPAR: plan.memory for plan in plans if plan.NCORE == 1}
+   assert by_KPAR[40] > by_KPAR[8] > by_KPAR[1]
+
+   unlimited = planner.rank(plans)[0]
+   limited   = planner.rank(plans, max_memory=by_KPAR[8])[0]
+   assert limited.memory <= by_KPAR[8]
+   assert limited.KPAR < unlimited.KPAR
+   # nothing fits: a single k-group
+   assert planner.rank(plans, max_memory=1)[0].KPAR == 1
+
+
+def test_set_ntasks_keeps_sqrt_NPAR(vasp_factory, Mn3GaN):
+   vasp = vasp_factory()
+   vasp.structure.kpoints = "12 12 12"
+   vasp.set_calculation(Mn3GaN((3, 3, 3)), ntasks=40)
+   assert vasp.io.INCAR.NPAR == "5"
+   assert vasp.io.job_parameters.nodes == "1"
+   INCAR = open(vasp.io.cwd + "INCAR").read()
+   assert "NPAR=5\n" in INCAR and "KPAR" not in INCAR
+
+
+def test_planner_on_large_cell(vasp_factory, Mn3GaN):
+   # 135 atoms with a dense mesh: far more than 3GB per task, so no k-point parallelization
+   vasp = vasp_factory()
+   vasp.structure.kpoints = "12 12 12"
+   vasp.set_calculation(Mn3GaN((3, 3, 3)))
+   plan = vasp.set_ntasks(40, plan=True)[0]
+   assert plan.KPAR == 1
+   assert plan.NPAR > 1 and plan.NCORE > 1
+   assert vasp.io.INCAR.KPAR == "1" and vasp.io.INCAR.NPAR == str(plan.NPAR)
+
+
+def test_planner_on_small_cell(vasp_factory, Mn3GaN):
+   # 5 atoms fit easily in memory: k-point parallelization pays off
+   vasp = vasp_factory()
+   vasp.structure.kpoints = "8 8 8"
+   vasp.set_calculation(Mn3GaN())
+   plan = vasp.set_ntasks(40, plan=True)[0]
+   assert plan.KPAR > 1
+   assert plan.memory <= get_memory_in_MB(vasp.io.job_parameters.mem_per_cpu)
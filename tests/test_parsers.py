@@ -0,0 +1,109 @@
+import shutil
+import numpy as np
+import pytest
+
+from pyVASP.code.parsers import OSZICAR_parser, OUTCAR_parser, is_finished
+
+
+def copy_lines(source, target, number_of_lines, complete_last_line=True):
+   """
+   Writes the first number_of_lines lines of source to target, the last one without its newline if not complete_last_line.
+   """
+   with open(source, "rb") as f:
+      lines = f.readlines()[:number_of_lines]
+   if not complete_last_line:
+      lines[-1] = lines[-1].rstrip(b"\n")
+   with open(target, "wb") as f:
+      f.write(b"".join(lines))
+   return
+
+
+def test_OSZICAR_collinear(data_file):
+   steps = OSZICAR_parser(data_file("OSZICAR_collinear")).read_new_steps()
+   assert [step["step"] for step in steps] == [1, 2]
+   assert steps[0]["F"] == pytest.approx(-24.123457)
+   assert steps[0]["E0"] == pytest.approx(-24.11)
+   assert steps[0]["dE"] == pytest.approx(-24.1235)
+   assert steps[1]["mag"] == pytest.approx(1.98)
+   assert len(steps[0]["electronic_energies"]) == 4
+   assert len(steps[1]["electronic_dEs"]) == 3
+   assert steps[0]["electronic_dEs"][-1] == pytest.approx(-5.678e-5)
+
+
+def test_OSZICAR_noncollinear(data_file):
+   steps = OSZICAR_parser(data_file("OSZICAR_noncollinear")).read_new_steps()
+   assert len(steps) == 1
+   np.testing.assert_allclose(steps[0]["mag"], [0.001, 0.002, 3.995])
+
+
+def test_OSZICAR_resumes_from_offset(data_file, tmp_path):
+   file_name = str(tmp_path / "OSZICAR")
+   # first ionic step and the first electronic step of the second one
+   copy_lines(data_file("OSZICAR_collinear"), file_name, 7)
+   parser = OSZICAR_parser(file_name)
+   assert [step["step"] for step in parser.read_new_steps()] == [1]
+   energies, dEs = parser.get_pending_electronic_steps()
+   assert len(energies) == 1 and dEs[0] == pytest.approx(-6.5432e-3)
+
+   shutil.copyfile(data_file("OSZICAR_collinear"), file_name)
+   resumed = OSZICAR_parser(file_name, parser.offset, parser.number_of_steps)
+   steps = resumed.read_new_steps()
+   assert [step["step"] for step in steps] == [2]
+   # the electronic steps before the offset are read again
+   assert len(steps[0]["electronic_energies"]) == 3
+   assert resumed.read_new_steps() == []
+
+
+def test_OSZICAR_incomplete_last_line(data_file, tmp_path):
+   file_name = str(tmp_path / "OSZICAR")
+   copy_lines(data_file("OSZICAR_collinear"), file_name, 6, complete_last_line=False)
+   parser = OSZICAR_parser(file_name)
+   assert parser.read_new_steps() == []
+   assert parser.offset == 0
+
+   copy_lines(data_file("OSZICAR_collinear"), file_name, 6)
+   steps = parser.read_new_steps()
+   assert [step["step"] for step in steps] == [1]
+   with open(file_name, "rb") as f:
+      assert parser.offset == len(f.read())
+
+
+def test_OUTCAR_collinear(data_file):
+   steps = OUTCAR_parser(data_file("OUTCAR_collinear")).read_new_steps()
+   assert len(steps) == 2
+   assert steps[0]["free_energy"] == pytest.approx(-24.12345678)
+   assert steps[0]["energy"] == pytest.approx(-24.1)
+   assert steps[0]["energy_sigma_0"] == pytest.approx(-24.11)
+   assert steps[0]["magnetization"] == pytest.approx(2.0012345)
+   assert steps[0]["forces"].shape == (2, 3)
+   np.testing.assert_allclose(steps[1]["positions"][1], [1.96, 1.96, 1.96])
+   np.testing.assert_allclose(steps[1]["stress"], [-2, -2, -2, 0.1, 0, 0])
+   assert steps[0]["penalty_energy"] is None and steps[0]["integrated_moments"] is None
+   assert is_finished(data_file("OUTCAR_collinear"))
+
+
+def test_OUTCAR_constrained_moments(data_file):
+   steps = OUTCAR_parser(data_file("OUTCAR_constrained")).read_new_steps()
+   assert len(steps) == 1
+   step = steps[0]
+   np.testing.assert_allclose(step["magnetization"], [0.001, 0.002, 3.995])
+   assert step["penalty_energy"] == pytest.approx(0.035)
+   assert step["LAMBDA"] == pytest.approx(10)
+   np.testing.assert_allclose(step["integrated_moments"], [[1.99, 0.1, 0], [-1.99, -0.1, 0]])
+   assert step["free_energy"] == pytest.approx(-48.12345)
+
+
+def test_OUTCAR_resumes_from_offset(data_file, tmp_path):
+   file_name = str(tmp_path / "OUTCAR")
+   # up to the middle of the stress line of the second ionic step
+   copy_lines(data_file("OUTCAR_collinear"), file_name, 19, complete_last_line=False)
+   parser = OUTCAR_parser(file_name)
+   first = parser.read_new_steps()
+   assert len(first) == 1
+   assert not is_finished(file_name)
+
+   shutil.copyfile(data_file("OUTCAR_collinear"), file_name)
+   steps = OUTCAR_parser(file_name, parser.offset, parser.number_of_steps).read_new_steps()
+   assert [step["step"] for step in steps] == [2]
+   assert steps[0]["free_energy"] == pytest.approx(-24.1311)
+   np.testing.assert_allclose(steps[0]["stress"], [-2, -2, -2, 0.1, 0, 0])
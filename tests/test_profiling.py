@@ -0,0 +1,13 @@
+import os
+
+from pyVASP.code.io import io
+from pyVASP.code.profiling import profiler
+
+
+def test_bytes_written_are_bytes(tmp_path):
+   job_io = io(str(tmp_path))
+   job_io.profiler = profiler()
+   file_name = str(tmp_path / "INCAR")
+   job_io.write_file(file_name, "SYSTEM = Mn3GaN 120° Γ5g\nENCUT = 500\n")
+   job_io.write_file(file_name, "ENCUT = 500\n")
+   assert job_io.profiler.bytes_written["INCAR"] == len("SYSTEM = Mn3GaN 120° Γ5g\nENCUT = 500\n".encode()) + os.path.getsize(file_name)
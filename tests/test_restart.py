@@ -0,0 +1,122 @@
+import os
+import pytest
+
+from pyVASP.code.restart import update_INCAR_text, get_INCAR_changes
+
+
+def read(folder, file_name):
+   with open(os.path.join(folder, file_name)) as f:
+      return f.read()
+
+
+def test_INCAR_changes():
+   old = "ENCUT = 500 ! cutoff\nNELM=200\nLORBIT=11\n"
+   new = "ENCUT=650\nNELM=200\nISTART=1\n"
+   changes = get_INCAR_changes(old, new)
+   assert changes == {"ENCUT": "650", "ISTART": "1", "LORBIT": None}
+   assert update_INCAR_text(old, changes) == "ENCUT=650\nNELM=200\nISTART=1\n"
+
+
+def test_restart_keeps_the_current_settings(vasp_factory, Mn3GaN):
+   vasp = vasp_factory()
+   vasp.set_calculation(Mn3GaN())
+   source = vasp.io.cwd
+   for file_name in ["CHGCAR", "WAVECAR"]:
+      with open(source + file_name, "w") as f:
+         f.write(file_name)
+
+   vasp.io.INCAR.ENCUT = "650"
+   vasp.io.INCAR.NELM  = "77"
+   new = source.rstrip("/") + "_restart/"
+   vasp.restart_from_charge(new, kpoints="4 4 4")
+
+   INCAR = read(new, "INCAR")
+   for line in ["ENCUT=650\n", "NELM=77\n", "ISTART=1\n", "ICHARG=1\n"]:
+      assert line in INCAR
+   # the same as a full INCAR of the current settings
+   assert get_INCAR_changes(INCAR, vasp.io.get_INCAR_text(vasp.structure.species, vasp.df["magmoms"], vasp.df["B_CONSTRs"])) == {}
+
+   # only the unchanged inputs are links to those of the source
+   assert os.path.islink(new + "POSCAR") and os.path.islink(new + "POTCAR")
+   assert not os.path.islink(new + "KPOINTS")
+   assert read(new, "KPOINTS").splitlines()[3] == "4 4 4"
+   assert read(source, "KPOINTS").splitlines()[3] != "4 4 4"
+   assert read(new, "CHGCAR") == "CHGCAR"
+
+
+def test_restart_fingerprint_is_that_of_the_files(vasp_factory, Mn3GaN):
+   vasp = vasp_factory()
+   vasp.io.skip_unchanged = True
+   vasp.set_calculation(Mn3GaN())
+   new = vasp.io.cwd.rstrip("/") + "_restart/"
+   vasp.restart_from_charge(new)
+
+   contents = []
+   for file_name in [vasp.io.INCAR_file, vasp.io.KPOINTS_file, vasp.io.POTCAR_file, vasp.io.POSCAR_file]:
+      with open(file_name, "rb") as f:
+         contents.append(f.read())
+   assert vasp.io.read_manifest()["inputs"] == vasp.io.get_contents_fingerprint(contents)
+   assert not vasp.io.write_restart_inputs(new, vasp.potential_path, vasp.df, vasp.structure)
+
+   vasp.io.INCAR.NELM = "77"
+   assert vasp.io.write_restart_inputs(new, vasp.potential_path, vasp.df, vasp.structure)
+   assert "NELM=77\n" in read(new, "INCAR")
+
+
+def test_restart_graph_INCAR_tags(vasp_factory, Mn3GaN):
+   vasp = vasp_factory()
+   vasp.set_calculation(Mn3GaN())
+   ENCUT = vasp.io.INCAR.ENCUT
+   steps = vasp.prepare_restarts([{"INCAR": {"ENCUT": "650"}},
+                                  {"INCAR": {"NELM": "77"}},
+                                  {"parent": -1, "kpoints": "2 2 2"}])
+   first, second, branch = [read(step.folder, "INCAR") for step in steps]
+   assert "ENCUT=650\n" in first
+   # inherited from the parent
+   assert "ENCUT=650\n" in second and "NELM=77\n" in second
+   # another branch: not
+   assert "ENCUT="+ENCUT+"\n" in branch and "NELM=77\n" not in branch
+   assert vasp.io.INCAR.ENCUT == ENCUT
+
+
+# stand-in for sbatch --parsable: logs its call and prints increasing job ids, or fails
+SBATCH = """#!/bin/bash
+echo "$PWD $@" >> "{log}"
+if [[ -n "{fail}" ]]; then echo "sbatch: error: invalid partition" >&2; exit 1; fi
+echo $((1000 + $(wc -l < "{log}")))";cluster"
+"""
+
+
+def write_sbatch(tmp_path, monkeypatch, fail=""):
+   bin_folder = tmp_path / "slurm"
+   bin_folder.mkdir(exist_ok=True)
+   log = tmp_path / "sbatch.log"
+   sbatch = bin_folder / "sbatch"
+   sbatch.write_text(SBATCH.format(log=log, fail=fail))
+   sbatch.chmod(0o755)
+   monkeypatch.setenv("PATH", str(bin_folder) + os.pathsep + os.environ["PATH"])
+   return log
+
+
+def test_submit_restarts_chains_dependencies(vasp_factory, Mn3GaN, tmp_path, monkeypatch):
+   log = write_sbatch(tmp_path, monkeypatch)
+   vasp = vasp_factory()
+   vasp.set_calculation(Mn3GaN())
+   steps = vasp.prepare_restarts([{"INCAR": {"ENCUT": "650"}}, {"INCAR": {"NELM": "77"}}, {"parent": -1}])
+
+   job_ids = vasp.submit_restarts(steps, after="999")
+   assert [job_ids[step.folder] for step in steps] == ["1001", "1002", "1003"]
+   calls = log.read_text().splitlines()
+   assert calls[0] == steps[0].folder.rstrip("/")+" --parsable --dependency=afterok:999 job"
+   assert calls[1] == steps[1].folder.rstrip("/")+" --parsable --dependency=afterok:1001 job"
+   # another branch, from the calculation in cwd
+   assert calls[2] == steps[2].folder.rstrip("/")+" --parsable --dependency=afterok:999 job"
+
+
+def test_submit_restarts_failure(vasp_factory, Mn3GaN, tmp_path, monkeypatch):
+   write_sbatch(tmp_path, monkeypatch, fail="yes")
+   vasp = vasp_factory()
+   vasp.set_calculation(Mn3GaN())
+   steps = vasp.prepare_restarts([{"INCAR": {"ENCUT": "650"}}])
+   with pytest.raises(RuntimeError, match="invalid partition"):
+      vasp.submit_restarts(steps)
@@ -0,0 +1,54 @@
+import numpy as np
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+
+from pyVASP.code.results import results_store, INDEX_COLUMNS
+
+
+def append_rows(root, writer, number_of_chunks):
+   store = results_store(root, verbose="low")
+   for chunk in range(number_of_chunks):
+      row = {name: "" for name in INDEX_COLUMNS}
+      row.update(folder="/" + writer + "/" + str(chunk), LAMBDA=10.0, m=0.5, betah=np.nan, E0=float(chunk))
+      store.append([row])
+   return
+
+
+def test_concurrent_appends_keep_every_chunk(tmp_path):
+   root = str(tmp_path / "store")
+   results_store(root, verbose="low")
+   writers = ["process_" + str(i) for i in range(4)]
+   with ProcessPoolExecutor(max_workers=4) as pool:
+      list(pool.map(append_rows, [root]*4, writers, [10]*4))
+   with ThreadPoolExecutor(max_workers=4) as pool:
+      list(pool.map(append_rows, [root]*4, ["thread_" + str(i) for i in range(4)], [5]*4))
+
+   store = results_store(root, verbose="low")
+   assert len(store) == 4*10 + 4*5
+   assert len(set(store.index["chunk"].tolist())) == len(store)
+   result = store.query(["E0"], folder="/process_2/7")
+   np.testing.assert_allclose(result["E0"], [7.0])
+
+   store.compact()
+   assert len(results_store(root, verbose="low")) == 60
+   assert not [name for name in (tmp_path / "store").iterdir() if name.suffix == ".tmp"]
+
+
+def test_query_by_m_of_default_folders(vasp_factory, Mn3GaN, data_file, tmp_path):
+   import shutil
+   folders = []
+   for name, m in [("m_low", 0.2), ("m_high", 0.8)]:
+      vasp = vasp_factory(name)
+      structure_ase = Mn3GaN()
+      ms = structure_ase.arrays["ms"]
+      ms[ms != 1] = m
+      # written the default way (without skip_unchanged)
+      vasp.set_calculation(structure_ase)
+      shutil.copyfile(data_file("OSZICAR_collinear"), vasp.io.cwd + "OSZICAR")
+      folders.append(vasp.io.cwd)
+
+   store = results_store(str(tmp_path / "store"), verbose="low")
+   assert store.ingest(folders) == 2
+   result = store.query(["E0"], m=0.8)
+   assert result["folder"].tolist() == [folders[1].rstrip("/")]
+   assert len(store.query(["E0"], m=(0.1, 0.3))["folder"]) == 1
+   assert not np.isnan(store.query(["E0"])["betah"]).any()
@@ -0,0 +1,81 @@
+import stat
+import time
+import pytest
+
+from pyVASP.code.runner import run_command, job_runner
+
+DUMMY = """#!/bin/bash
+echo "start $(date +%s.%N)" >> ../times
+echo "energy in $PWD"
+echo "launcher error" >&2
+sleep {sleep}
+echo "end $(date +%s.%N)" >> ../times
+exit {status}
+"""
+
+
+def make_dummy(folder, sleep=0, status=0):
+   """
+   Stand-in for VASP: prints to stdout and stderr, records when it starts and ends in ../times.
+   """
+   executable = folder / "dummy_vasp"
+   executable.write_text(DUMMY.format(sleep=sleep, status=status))
+   executable.chmod(executable.stat().st_mode | stat.S_IXUSR)
+   return str(executable)
+
+
+def test_run_command_separates_stderr(tmp_path):
+   job = tmp_path / "job"
+   job.mkdir()
+   executable = make_dummy(tmp_path, status=3)
+   result = run_command(executable, str(job), str(job / "out"))
+   assert result.returncode == 3
+   assert result.err_file == str(job / "out.err")
+   assert (job / "out").read_text() == "energy in "+str(job)+"\n"
+   assert (job / "out.err").read_text() == "launcher error\n"
+
+
+def test_run_command_merged_output(tmp_path):
+   job = tmp_path / "job"
+   job.mkdir()
+   executable = make_dummy(tmp_path)
+   result = run_command(executable, str(job), str(job / "out"), err_file=str(job / "out"))
+   assert result.returncode == 0
+   assert sorted((job / "out").read_text().splitlines()) == ["energy in "+str(job), "launcher error"]
+   assert not (job / "out.err").exists()
+
+
+def test_job_runner_limits_concurrency(tmp_path):
+   executable = make_dummy(tmp_path, sleep=0.3)
+   folders = []
+   for i in range(4):
+      folders.append(tmp_path / ("job_" + str(i)))
+      folders[-1].mkdir()
+
+   start = time.perf_counter()
+   with job_runner(max_jobs=2) as runner:
+      for folder in folders:
+         runner.submit(executable, str(folder), str(folder / "out"))
+      results = runner.wait()
+   wall_time = time.perf_counter() - start
+
+   assert [result.cwd for result in results] == [str(folder) for folder in folders]
+   assert all(result.returncode == 0 for result in results)
+   # two rounds of two jobs
+   assert 0.55 < wall_time < 3
+
+   # at most two jobs running at any time
+   events = []
+   for line in (tmp_path / "times").read_text().splitlines():
+      kind, moment = line.split()
+      events.append((float(moment), 1 if kind == "start" else -1))
+   running = 0
+   for _, change in sorted(events):
+      running += change
+      assert running <= 2
+
+
+def test_job_runner_missing_folder(tmp_path):
+   with job_runner() as runner:
+      with pytest.raises(FileNotFoundError):
+         runner.submit("true", str(tmp_path / "missing"))
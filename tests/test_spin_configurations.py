@@ -0,0 +1,126 @@
+import os
+from itertools import product
+
+import numpy as np
+import pytest
+
+UP_DOWN   = [[0, 0, 1], [0, 0, -1]]
+FOUR_AXES   = [[0, 0, 1], [0, 0, -1], [1, 0, 0], [-1, 0, 0]]
+
+
+def make_bcc_Fe(repeat):
+   from ase.build import bulk
+   structure_ase = bulk("Fe", "bcc", a=2.83, cubic=True).repeat(repeat)
+   structure_ase.new_array("magdirs", np.tile([0, 0, 2.2], (len(structure_ase), 1)), dtype=float)
+   return structure_ase
+
+
+def get_group(structure_ase, directions, time_reversal):
+   """
+   (site permutation, relabelling of directions) of every operation, built independently of spin_configurations.
+   """
+   from pyVASP.code.symmetry import get_symmetry_permutations
+   permutations = np.unique(get_symmetry_permutations(structure_ase), axis=0)
+   directions = np.asarray(directions, dtype=float)
+   relabellings = [np.arange(len(directions))]
+   if time_reversal:
+      relabellings.append(np.array([np.flatnonzero(np.all(np.isclose(directions, -direction), axis=1))[0]
+                                    for direction in directions]))
+   return [(permutation, relabelling) for permutation in permutations for relabelling in relabellings]
+
+
+def get_orbit_minima(structure_ase, directions, time_reversal):
+   """
+   Smallest configuration of every orbit, from all configurations.
+   """
+   number_of_sites = len(structure_ase)
+   configurations = np.array(list(product(range(len(directions)), repeat=number_of_sites)))
+   minima = configurations.copy()
+   for permutation, relabelling in get_group(structure_ase, directions, time_reversal):
+      # site i goes onto site permutation[i], keeping its (relabelled) direction
+      images = np.empty_like(configurations)
+      images[:, permutation] = relabelling[configurations]
+      smaller = np.array([tuple(image) < tuple(minimum) for image, minimum in zip(images, minima)])
+      minima[smaller] = images[smaller]
+   return sorted(set(map(tuple, minima)))
+
+
+def count_orbits(structure_ase, directions, time_reversal):
+   """
+   Number of orbits by Burnside's lemma: average over the group of the configurations each operation fixes.
+   """
+   group = get_group(structure_ase, directions, time_reversal)
+   total = 0
+   for permutation, relabelling in group:
+      fixed = 1
+      seen = np.zeros(len(permutation), dtype=bool)
+      for start in range(len(permutation)):
+         length, site = 0, start
+         while not seen[site]:
+            seen[site] = True
+            site = permutation[site]
+            length += 1
+         if length:
+            # the direction of the cycle must come back to itself after length relabellings
+            labels = np.arange(len(directions))
+            for n in range(length):
+               labels = relabelling[labels]
+            fixed *= np.count_nonzero(labels == np.arange(len(directions)))
+      total += fixed
+   assert total % len(group) == 0
+   return total // len(group)
+
+
+@pytest.mark.parametrize("repeat, directions", [((2, 1, 1), UP_DOWN), ((2, 2, 1), UP_DOWN), ((2, 1, 1), FOUR_AXES)])
+@pytest.mark.parametrize("time_reversal", [True, False])
+def test_enumerate_matches_brute_force(repeat, directions, time_reversal):
+   from pyVASP.code.spin_configurations import spin_configurations
+   structure_ase = make_bcc_Fe(repeat)
+   configurations = spin_configurations(structure_ase, directions=directions, time_reversal=time_reversal)
+   found = [tuple(configuration) for configuration in configurations.enumerate()]
+   assert found == get_orbit_minima(structure_ase, directions, time_reversal)
+
+
+@pytest.mark.parametrize("repeat, directions", [((2, 2, 2), UP_DOWN), ((2, 2, 1), FOUR_AXES)])
+@pytest.mark.parametrize("time_reversal", [True, False])
+def test_enumerate_counts_orbits(repeat, directions, time_reversal):
+   from pyVASP.code.spin_configurations import spin_configurations
+   structure_ase = make_bcc_Fe(repeat)
+   configurations = spin_configurations(structure_ase, directions=directions, time_reversal=time_reversal)
+   found = list(configurations.enumerate())
+   assert len(found) == count_orbits(structure_ase, directions, time_reversal)
+   # canonical and pairwise inequivalent
+   assert all(np.array_equal(configurations.get_canonical_form(configuration), configuration) for configuration in found)
+   assert len(set(configurations.get_key(configuration) for configuration in found)) == len(found)
+
+
+def test_max_configurations():
+   from pyVASP.code.spin_configurations import spin_configurations
+   configurations = spin_configurations(make_bcc_Fe((2, 2, 1)))
+   every = list(configurations.enumerate())
+   first = list(configurations.enumerate(max_configurations=3))
+   assert len(every) > 3
+   assert [tuple(configuration) for configuration in first] == [tuple(configuration) for configuration in every[:3]]
+
+
+def test_magdirs_in_set_calculation(vasp_factory, potentials):
+   os.makedirs(os.path.join(potentials, "Fe_pv"))
+   with open(os.path.join(potentials, "Fe_pv", "POTCAR"), "w") as f:
+      f.write("   POMASS =   1.000; ZVAL   =   14    mass and valenz\n")
+   structure_ase = make_bcc_Fe((2, 1, 1))
+
+   vasp = vasp_factory()
+   magdirs = list(vasp.magnetism.enumerate_magdirs(structure_ase))
+   assert len(magdirs) == count_orbits(structure_ase, UP_DOWN, True)
+   for i, configuration in enumerate(magdirs):
+      assert configuration.shape == (4, 3)
+      assert np.allclose(np.abs(configuration[:, 2]), 2.2)
+      structure_ase.set_array("magdirs", configuration)
+      vasp.io.cwd = os.path.join(os.path.dirname(vasp.io.cwd.rstrip("/")), "configuration_"+str(i))
+      os.makedirs(vasp.io.cwd, exist_ok=True)
+      vasp.set_calculation(structure_ase)
+      # ordered sites (m = 1): MAGMOM is the configuration, in the sorted order of POSCAR
+      with open(vasp.io.INCAR_file) as f:
+         MAGMOM = [line for line in f if line.startswith("MAGMOM")][0]
+      assert np.allclose(np.array(MAGMOM.split("=")[1].split(), dtype=float).reshape(-1, 3),
+                         configuration[vasp.df.index])
@@ -0,0 +1,71 @@
+import copy
+import pickle
+
+import numpy as np
+
+from pyVASP.code.structure_cache import structure_cache
+
+
+def test_lru_eviction():
+   cache = structure_cache(max_size=2)
+   cache.put("a", 1)
+   cache.put("b", 2)
+   assert cache.get("a") == 1
+   # b is now the least recently used
+   cache.put("c", 3)
+   assert len(cache) == 2
+   assert cache.get("b") is None and cache.get("a") == 1 and cache.get("c") == 3
+   assert (cache.hits, cache.misses) == (3, 1)
+
+   off = structure_cache(max_size=0)
+   off.put("a", 1)
+   assert len(off) == 0 and off.get("a") is None
+
+
+def test_copies_share_the_cache():
+   cache = structure_cache(max_size=4)
+   cache.put("a", 1)
+   assert copy.deepcopy(cache) is cache
+   # other processes start empty
+   assert len(pickle.loads(pickle.dumps(cache))) == 0
+
+
+def test_hit_when_only_INCAR_changes(vasp_factory, Mn3GaN):
+   vasp = vasp_factory()
+   vasp.structure_cache = structure_cache(max_size=2)
+   structure_ase = Mn3GaN()
+
+   vasp.set_calculation(structure_ase)
+   first = vasp.df["magmoms"].copy()
+   vasp.io.INCAR.ENCUT = "650"
+   vasp.set_calculation(structure_ase)
+   assert (vasp.structure_cache.hits, vasp.structure_cache.misses) == (1, 1)
+   assert "ENCUT=650\n" in open(vasp.io.INCAR_file).read()
+   # the magmoms are still sampled at every call
+   assert not np.allclose(vasp.df["magmoms"], first)
+
+   # other magnetic inputs or positions: prepared again
+   changed = Mn3GaN()
+   changed.arrays["ms"][changed.arrays["ms"] != 1] = 0.8
+   vasp.set_calculation(changed)
+   moved = Mn3GaN()
+   moved.positions[0] += 0.01
+   vasp.set_calculation(moved)
+   assert (vasp.structure_cache.hits, vasp.structure_cache.misses) == (1, 3)
+   assert len(vasp.structure_cache) == 2
+
+
+def test_structure_is_not_modified(vasp_factory, Mn3GaN):
+   vasp = vasp_factory()
+   vasp.structure_cache = structure_cache()
+   structure_ase = Mn3GaN()
+   arrays = {name: array.copy() for name, array in structure_ase.arrays.items()}
+
+   for i in range(2):
+      vasp.set_calculation(structure_ase)
+   assert sorted(structure_ase.arrays) == sorted(arrays)
+   for name, array in arrays.items():
+      assert np.array_equal(structure_ase.arrays[name], array)
+   # nor are the prepared atoms shared with it
+   assert vasp.io.structure_ase is not structure_ase
+   assert "magmoms" in vasp.io.structure_ase.arrays
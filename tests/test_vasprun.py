@@ -0,0 +1,63 @@
+import numpy as np
+import pytest
+
+
+def test_selected_fields(data_file):
+   from pyVASP.code.vasprun import vasprun_parser
+   results = vasprun_parser(data_file("vasprun.xml"), fields=("final_energy", "magnetization", "forces")).parse()
+
+   # only the requested fields
+   assert sorted(results) == ["final_energy", "forces", "magnetization"]
+   assert results["final_energy"]["e_0_energy"] == -16.05
+   assert results["forces"].shape == (2, 2, 3)
+   # moments of the last calculation
+   assert np.array_equal(results["magnetization"], [[1.2, 0, 1.7], [-1.2, 0, -1.7]])
+
+
+def test_all_fields(data_file):
+   from pyVASP.code.vasprun import vasprun_parser, CONTAINERS
+   results = vasprun_parser(data_file("vasprun.xml"), fields=list(CONTAINERS)).parse()
+
+   assert np.array_equal(results["energies"]["e_fr_energy"], [-15.0, -16.0])
+   assert np.allclose(results["structures"]["lattice_vectors"][:, 0, 0], [2.83, 2.84])
+   assert results["structures"]["positions"].shape == (2, 2, 3)
+   assert results["stress"].shape == (2, 3, 3)
+   assert results["efermi"] == 5.5
+   assert np.array_equal(results["dos"]["energies"], [-1.0, 0.0])
+   assert np.array_equal(results["dos"]["total"], [[0.1, 0.2], [0.3, 0.4]])
+   assert np.array_equal(results["kpoints"]["weights"], [0.25, 0.75])
+   # not in the file
+   assert results["eigenvalues"] is None
+
+
+def test_unknown_field(data_file):
+   from pyVASP.code.vasprun import vasprun_parser
+   with pytest.raises(ValueError):
+      vasprun_parser(data_file("vasprun.xml"), fields=("magmoms",))
+
+
+def test_elements_are_cleared(data_file, monkeypatch):
+   import xml.etree.ElementTree as ElementTree
+   from pyVASP.code.vasprun import vasprun_parser
+   iterparse = ElementTree.iterparse
+   roots = []
+
+   def recording_iterparse(*args, **kwargs):
+      for event, element in iterparse(*args, **kwargs):
+         if not roots:
+            roots.append(element)
+         yield event, element
+   monkeypatch.setattr(ElementTree, "iterparse", recording_iterparse)
+
+   results = vasprun_parser(data_file("vasprun.xml"), fields=("magnetization",)).parse()
+   assert results["magnetization"].shape == (2, 3)
+   # every element has been dropped from the tree once read
+   assert roots[0].tag == "modeling" and len(roots[0]) == 0
+
+
+def test_collinear_magnetization(tmp_path):
+   from pyVASP.code.vasprun import vasprun_parser
+   path = tmp_path / "vasprun.xml"
+   path.write_text('<modeling><calculation><varray name="magnetization" >'
+                   '<v> 2.1 </v><v> -2.1 </v></varray></calculation></modeling>')
+   assert np.array_equal(vasprun_parser(str(path), fields=("magnetization",)).parse()["magnetization"], [2.1, -2.1])
@@ -0,0 +1,84 @@
+import os
+import shutil
+
+import numpy as np
+import pytest
+
+
+def expected_grid(block):
+   # values of tests/data/CHGCAR_noncollinear: 1000*block + 100*x + 10*y + z + 0.5, magnetizations scaled by -1/1000
+   x, y, z = np.meshgrid(np.arange(2), np.arange(3), np.arange(4), indexing="ij")
+   values = 1000*block + 100*x + 10*y + z + 0.5
+   return -values/1000 if block else values
+
+
+@pytest.fixture
+def CHGCAR(tmp_path, data_file):
+   path = str(tmp_path / "CHGCAR")
+   shutil.copyfile(data_file("CHGCAR_noncollinear"), path)
+   return path
+
+
+def test_header_and_grids(CHGCAR):
+   from pyVASP.code.volumetric import volumetric_data
+   chgcar = volumetric_data(CHGCAR, chunk_lines=2)
+
+   assert np.allclose(chgcar.lattice_vectors, 2.83*np.eye(3))
+   assert chgcar.species == ["Fe"] and chgcar.counts == [1]
+   assert chgcar.grid == (2, 3, 4)
+
+   # total and magnetization x, y, z
+   assert chgcar.data.shape == (4, 2, 3, 4)
+   assert chgcar.magnetization.shape == (3, 2, 3, 4)
+   for block in range(4):
+      assert np.array_equal(chgcar.data[block], expected_grid(block))
+   assert chgcar.texts[1].startswith("augmentation occupancies")
+
+
+def test_sidecar(CHGCAR, monkeypatch):
+   from pyVASP.code.volumetric import volumetric_data
+   first = volumetric_data(CHGCAR)
+   assert os.path.exists(CHGCAR+".npy") and os.path.exists(CHGCAR+".npy.json")
+
+   # the second open only maps the sidecar
+   def parse(self, cache=True):
+      raise AssertionError("parsed again")
+   with monkeypatch.context() as patch:
+      patch.setattr(volumetric_data, "parse", parse)
+      second = volumetric_data(CHGCAR)
+   assert isinstance(second.data.base, np.memmap)
+   assert np.array_equal(second.data, first.data) and second.texts == first.texts
+
+   # a new CHGCAR (same size here, another modification time) is parsed again
+   first.write(CHGCAR, 2*np.asarray(first.data))
+   os.utime(CHGCAR, ns=(0, 0))
+   third = volumetric_data(CHGCAR)
+   assert np.array_equal(third.data[1], 2*expected_grid(1))
+
+
+def test_no_cache(CHGCAR):
+   from pyVASP.code.volumetric import volumetric_data
+   chgcar = volumetric_data(CHGCAR, cache=False)
+   assert not os.path.exists(CHGCAR+".npy")
+   assert np.array_equal(chgcar.total, expected_grid(0))
+
+
+def test_write_round_trip(CHGCAR, tmp_path):
+   from pyVASP.code.volumetric import volumetric_data
+   chgcar = volumetric_data(CHGCAR)
+
+   copy = str(tmp_path / "CHGCAR_copy")
+   chgcar.write(copy, chunk_lines=2)
+   with open(CHGCAR, "rb") as f, open(copy, "rb") as g:
+      assert f.read() == g.read()
+
+   data = np.array(chgcar.data)
+   data[1:] = 0
+   chgcar.write(copy, data)
+   written = volumetric_data(copy, cache=False)
+   assert np.array_equal(written.total, expected_grid(0))
+   assert not np.any(written.magnetization)
+   assert written.texts == chgcar.texts
+
+   with pytest.raises(ValueError):
+      chgcar.write(copy, data[:1])
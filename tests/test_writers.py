@@ -0,0 +1,58 @@
+import os
+
+import numpy as np
+
+EXAMPLE = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "notebooks", "examples", "Mn3GaN")
+
+
+def make_example_structure():
+   """
+   Mn3GaN of notebooks/examples/Mn3GaN: triangular order with m = 0.99 on Mn.
+   """
+   from ase.spacegroup import crystal
+   a = 3.95
+   structure = crystal(("Ga", "Mn", "N"), basis=[(0, 0, 0), (0, .5, .5), (.5, .5, .5)], spacegroup=221,
+                       cellpar=[a, a, a, 90, 90, 90])
+   Dtheta = 120 * np.pi/180
+   theta = -Dtheta
+   magdirs, ms = [], []
+   for element in structure.get_chemical_symbols():
+      if element == "Mn":
+         theta += Dtheta
+         magdirs.append([np.cos(theta), np.sin(theta), 0])
+         ms.append(0.99)
+      else:
+         magdirs.append([0.0, 0.0, 0.0])
+         ms.append(1)
+   structure.new_array("magdirs", magdirs, dtype=float)
+   structure.new_array("ms", ms, dtype=float)
+   return structure
+
+
+def write_example(vasp_factory):
+   vasp = vasp_factory(seed_mag=23)
+   # defaults when the example was written
+   vasp.io.INCAR.SIGMA = "0.005"
+   vasp.io.INCAR.EDIFF = "1e-6"
+   vasp.prepare_bfields(I_CONSTRAINED_M="4", LAMBDA="1")
+   vasp.set_calculation(make_example_structure())
+   return vasp
+
+
+def read_bytes(path):
+   with open(path, "rb") as f:
+      return f.read()
+
+
+def test_inputs_match_example(vasp_factory):
+   vasp = write_example(vasp_factory)
+   for file_name in ("INCAR", "POSCAR", "KPOINTS"):
+      assert read_bytes(os.path.join(vasp.io.cwd, file_name)) == read_bytes(os.path.join(EXAMPLE, file_name)), file_name
+
+
+def test_job_matches_golden(vasp_factory, data_file):
+   vasp = write_example(vasp_factory)
+   with open(data_file("job_Mn3GaN")) as f:
+      golden = f.read().format(executable=vasp.executable, cwd=vasp.io.cwd)
+   assert read_bytes(vasp.io.job_file) == golden.encode()
+